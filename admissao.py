@@ -0,0 +1,57 @@
+import threading
+
+# ----------------------
+# Controle de admissão de requisições pesadas
+# ----------------------
+# Exportações (CSV/PDF) e visualizações para impressão de relatórios grandes disputam
+# as mesmas threads do waitress que o formulário de abastecimento. Elas passam por uma
+# "faixa pesada" com no máximo `limite` execuções simultâneas e uma fila de até
+# `fila` requisições esperando no máximo `espera_maxima` segundos. Com a faixa
+# saturada a requisição é recusada na hora (503 + Retry-After), sem ocupar mais threads.
+# Exportações pequenas (poucas linhas estimadas) nem entram na faixa.
+
+
+class FaixaPesada:
+    def __init__(self, limite, fila, espera_maxima):
+        self.limite = limite
+        self.fila = fila
+        self.espera_maxima = espera_maxima
+        self._vagas = threading.BoundedSemaphore(limite)
+        self._trava = threading.Lock()
+        self._aguardando = 0
+        self._em_execucao = 0
+
+    def entrar(self):
+        """Ocupa uma vaga; retorna False se a fila estiver cheia ou a espera máxima esgotar."""
+        if self._vagas.acquire(blocking=False):
+            self._contar_execucao(1)
+            return True
+        with self._trava:
+            if self._aguardando >= self.fila:
+                return False
+            self._aguardando += 1
+        try:
+            admitida = self._vagas.acquire(timeout=self.espera_maxima)
+        finally:
+            with self._trava:
+                self._aguardando -= 1
+        if admitida:
+            self._contar_execucao(1)
+        return admitida
+
+    def sair(self):
+        self._contar_execucao(-1)
+        self._vagas.release()
+
+    def _contar_execucao(self, delta):
+        with self._trava:
+            self._em_execucao += delta
+
+    @property
+    def aguardando(self):
+        return self._aguardando
+
+    @property
+    def em_execucao(self):
+        return self._em_execucao
+
@@ -0,0 +1,218 @@
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from database import db
+
+# ----------------------
+# Detecção de anomalias em abastecimentos (NumPy)
+# ----------------------
+# O histórico é lido numa consulta, ordenado por (veículo, data, id), como matriz float64,
+# e cada regra é uma máscara vetorizada sobre ela. "Anterior" é a linha de cima quando for
+# do mesmo veículo. O resultado fica em anomalia_abastecimento (uma linha por abastecimento
+# e regra, com o valor encontrado e a referência usada), que o relatório filtra por SQL.
+#
+# Verificação completa: migração e comando verificar-anomalias (segundos para 1 milhão de
+# abastecimentos). Incremental: cada gravação verifica de novo só o histórico dos veículos
+# atingidos (algumas centenas de linhas cada), porque além do abastecimento seguinte, cujo
+# "anterior" mudou, a mediana do veículo, linha de base do consumo, muda para todos eles.
+
+REGRAS = {
+    'tanque': 'Litros acima da capacidade do tanque',
+    'hodometro': 'Hodômetro menor que o do abastecimento anterior',
+    'intervalo': 'Abastecimentos seguidos em poucas horas',
+    'preco': 'Preço por litro distante do contrato',
+    'consumo': 'km/L fora do padrão do veículo',
+}
+
+TOLERANCIA_TANQUE = 0.05  # fração acima da capacidade nominal aceita sem alerta
+INTERVALO_HORAS = 4.0
+DESVIO_PRECO = 0.10  # fração de diferença para o valor por litro do contrato
+ESCORE_CONSUMO = 3.5  # escore robusto (mediana e MAD do veículo) a partir do qual o km/L é atípico
+MINIMO_TRECHOS = 8  # trechos com km/L válido para o veículo ter linha de base
+
+CONSULTA = """
+    SELECT a.id, a.veiculo_id, julianday(a.data) * 24, a.hodometro, a.litros, a.valor_total,
+           v.capacidade_tanque, ce.preco
+    FROM abastecimento a
+    JOIN veiculo v ON v.id = a.veiculo_id
+    LEFT JOIN (
+        SELECT contrato_id, tipo_combustivel, avg(valor_por_litro) AS preco
+        FROM contrato_efetivo GROUP BY contrato_id, tipo_combustivel
+    ) ce ON ce.contrato_id = a.contrato_id AND ce.tipo_combustivel = COALESCE(a.combustivel, v.combustivel)
+"""
+LOTE_LEITURA = 100_000
+LOTE_EXCLUSAO = 900
+
+
+def _ler(filtro="", parametros=()):
+    """Matriz (id, veículo, horas, hodômetro, litros, valor, capacidade, preço do contrato)."""
+    resultado = db.session.connection().exec_driver_sql(
+        f"{CONSULTA} {filtro} ORDER BY a.veiculo_id, a.data, a.id", parametros
+    )
+    # Tuplas do cursor do sqlite3: o NumPy converte Row do SQLAlchemy umas quatro vezes mais devagar
+    cursor = resultado.cursor
+    partes = []
+    while True:
+        linhas = cursor.fetchmany(LOTE_LEITURA)
+        if not linhas:
+            break
+        partes.append(np.array(linhas, dtype=np.float64))
+    resultado.close()
+    return np.concatenate(partes) if partes else np.empty((0, 8), dtype=np.float64)
+
+
+def _anterior(coluna):
+    deslocada = np.empty_like(coluna)
+    deslocada[:1] = np.nan
+    deslocada[1:] = coluna[:-1]
+    return deslocada
+
+
+def _escore_robusto(grupos, valores):
+    """Mediana do grupo e escore 0,6745 * (x - mediana) / MAD de cada valor (NaN fora da base)."""
+    mediana_saida = np.full(len(valores), np.nan)
+    escore_saida = np.full(len(valores), np.nan)
+    indices = np.flatnonzero(~np.isnan(valores))
+    if not len(indices):
+        return mediana_saida, escore_saida
+    ordem = indices[np.lexsort((valores[indices], grupos[indices]))]
+    ordenados, grupos_ordenados = valores[ordem], grupos[ordem]
+    inicios = np.flatnonzero(np.r_[True, grupos_ordenados[1:] != grupos_ordenados[:-1]])
+    contagens = np.diff(np.r_[inicios, len(ordem)])
+    meio_baixo, meio_alto = inicios + (contagens - 1) // 2, inicios + contagens // 2
+    grupo = np.repeat(np.arange(len(inicios)), contagens)
+    mediana = (ordenados[meio_baixo] + ordenados[meio_alto]) / 2
+    desvios = np.abs(ordenados - mediana[grupo])
+    # Os grupos continuam contíguos ao ordenar os desvios dentro de cada um
+    desvios = desvios[np.lexsort((desvios, grupo))]
+    mad = (desvios[meio_baixo] + desvios[meio_alto]) / 2
+    base = (contagens >= MINIMO_TRECHOS) & (mad > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        escore = np.where(base[grupo], 0.6745 * (ordenados - mediana[grupo]) / mad[grupo], np.nan)
+    mediana_saida[ordem] = mediana[grupo]
+    escore_saida[ordem] = escore
+    return mediana_saida, escore_saida
+
+
+def avaliar(matriz):
+    """Aplica as regras; retorna [(posições, regra, valores, referências)] sobre as linhas da matriz."""
+    _, veiculo, horas, hodometro, litros, valor, capacidade, preco_contrato = matriz.T
+    mesmo_veiculo = veiculo == _anterior(veiculo)
+    hodometro_anterior = np.where(mesmo_veiculo, _anterior(hodometro), np.nan)
+    km = hodometro - hodometro_anterior
+    intervalo = horas - np.where(mesmo_veiculo, _anterior(horas), np.nan)
+    resultado = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        preco = valor / litros
+        km_por_litro = np.where((km > 0) & (litros > 0), km / litros, np.nan)
+        mediana, escore = _escore_robusto(veiculo, km_por_litro)
+        # Comparações com NaN (capacidade ou contrato ausentes, primeiro abastecimento) dão False
+        regras = (
+            ('tanque', litros > capacidade * (1 + TOLERANCIA_TANQUE), litros, capacidade),
+            ('hodometro', km < 0, hodometro, hodometro_anterior),
+            ('intervalo', intervalo < INTERVALO_HORAS, intervalo, np.full(len(matriz), INTERVALO_HORAS)),
+            ('preco', np.abs(preco / preco_contrato - 1) > DESVIO_PRECO, preco, preco_contrato),
+            ('consumo', np.abs(escore) > ESCORE_CONSUMO, km_por_litro, mediana),
+        )
+    for regra, mascara, valores, referencias in regras:
+        posicoes = np.flatnonzero(mascara)
+        resultado.append((posicoes, regra, valores[posicoes], referencias[posicoes]))
+    return resultado
+
+
+def _gravar(matriz, resultado, ids_verificados=None):
+    """Substitui as anomalias dos ids verificados (todas, com None) pelas encontradas."""
+    conexao = db.session.connection()
+    if ids_verificados is None:
+        conexao.exec_driver_sql("DELETE FROM anomalia_abastecimento")
+    else:
+        ids_verificados = list(ids_verificados)
+        for inicio in range(0, len(ids_verificados), LOTE_EXCLUSAO):
+            parte = ids_verificados[inicio:inicio + LOTE_EXCLUSAO]
+            conexao.exec_driver_sql(
+                f"DELETE FROM anomalia_abastecimento WHERE abastecimento_id IN ({','.join('?' * len(parte))})",
+                tuple(parte)
+            )
+    linhas = []
+    for posicoes, regra, valores, referencias in resultado:
+        linhas.extend(zip(matriz[posicoes, 0].astype(np.int64).tolist(), [regra] * len(posicoes),
+                          valores.tolist(), referencias.tolist()))
+    if linhas:
+        conexao.exec_driver_sql(
+            "INSERT INTO anomalia_abastecimento (abastecimento_id, regra, valor, referencia) VALUES (?, ?, ?, ?)", linhas
+        )
+    return len(linhas)
+
+
+def verificar_tudo():
+    """Verifica o histórico inteiro; retorna a quantidade de anomalias."""
+    matriz = _ler()
+    return _gravar(matriz, avaliar(matriz))
+
+
+def verificar_ids(ids):
+    """Verifica de novo o histórico dos veículos dos abastecimentos gravados."""
+    ids = [int(id_) for id_ in ids]
+    if not ids:
+        return 0
+    db.session.flush()
+    veiculos = db.session.execute(
+        text("SELECT DISTINCT veiculo_id FROM abastecimento WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+        {'ids': ids}
+    ).scalars().all()
+    if not veiculos:
+        return _gravar(np.empty((0, 8)), [], ids)
+    matriz = _ler(f"WHERE a.veiculo_id IN ({','.join('?' * len(veiculos))})", tuple(veiculos))
+    # Ids pedidos que não existem mais (excluídos) também perdem as anomalias
+    return _gravar(matriz, avaliar(matriz), set(ids) | set(matriz[:, 0].astype(np.int64).tolist()))
+
+
+def verificar_contrato(contrato_id):
+    """O valor por litro do contrato mudou (itens ou aditivos): verifica de novo os abastecimentos dele."""
+    db.session.flush()
+    ids = db.session.execute(
+        text("SELECT id FROM abastecimento WHERE contrato_id = :contrato_id"), {'contrato_id': contrato_id}
+    ).scalars().all()
+    return verificar_ids(ids)
+
+
+def verificar_veiculo(veiculo_id):
+    """Capacidade do tanque ou combustível do veículo mudou: verifica o histórico dele."""
+    db.session.flush()
+    matriz = _ler("WHERE a.veiculo_id = ?", (veiculo_id,))
+    return _gravar(matriz, avaliar(matriz), matriz[:, 0].astype(np.int64).tolist())
+
+
+def verificar_seguinte(veiculo_id, data, abastecimento_id):
+    """Abastecimento que saiu de (veiculo_id, data): verifica o seguinte, que ganhou outro anterior."""
+    db.session.flush()
+    seguinte = db.session.execute(
+        text("SELECT id FROM abastecimento WHERE veiculo_id = :veiculo_id AND id != :id "
+             "AND (data > :data OR (data = :data AND id > :id)) ORDER BY data, id LIMIT 1"
+             ).bindparams(bindparam('data', type_=db.DateTime)),
+        {'veiculo_id': veiculo_id, 'data': data, 'id': abastecimento_id}
+    ).scalar()
+    if seguinte is not None:
+        verificar_ids([seguinte])
+
+
+def remover(abastecimento_id, veiculo_id, data):
+    db.session.execute(
+        text("DELETE FROM anomalia_abastecimento WHERE abastecimento_id = :id"), {'id': abastecimento_id}
+    )
+    verificar_seguinte(veiculo_id, data, abastecimento_id)
+
+
+def descrever(regra, valor, referencia):
+    """Texto curto com o valor encontrado e a referência de cada regra."""
+    if regra == 'tanque':
+        return f"{valor:.2f} L num tanque de {referencia:.0f} L"
+    if regra == 'hodometro':
+        return f"{valor:.0f} km depois de {referencia:.0f} km"
+    if regra == 'intervalo':
+        return f"{valor:.1f} h depois do abastecimento anterior"
+    if regra == 'preco':
+        return f"R$ {valor:.3f}/L; contrato R$ {referencia:.3f}/L ({(valor / referencia - 1) * 100:+.0f}%)"
+    if regra == 'consumo':
+        return f"{valor:.2f} km/L; mediana do veículo {referencia:.2f} km/L"
+    return ""
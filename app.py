@@ -1,13 +1,38 @@
 
-from flask import Flask, render_template, request, redirect, url_for, session, Response, flash, make_response
-from datetime import datetime, date
+from flask import Flask, render_template, request, redirect, url_for, session, Response, flash, make_response, jsonify, g
+from datetime import datetime, date, timedelta
 import os
 import csv
 import io
-from database import db, Veiculo, Motorista, Abastecimento, ContratoCombustivel, ContratoCombustivelItem, AditivoContratoCombustivel, User
+import hashlib
+import time
+import json
+import threading
+import click
+from database import db, Veiculo, Motorista, Abastecimento, ContratoCombustivel, ContratoCombustivelItem, AditivoContratoCombustivel, ContratoEfetivo, User, LoteApi, EficienciaAbastecimento, AnomaliaAbastecimento, chave_nota, emitente_chave_nota, NOTA_SEM_FORNECEDOR
 from werkzeug.security import check_password_hash, generate_password_hash
-from weasyprint import HTML
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from consultas import listar_abastecimentos, consulta_abastecimentos
+import cache_colunar
+from config import PERFIS, perfil_atual, CacheBytecodeTemplates
+from jinja2 import TemplateSyntaxError
+from admissao import FaixaPesada
+import desempenho
+import detector_n1
+import metricas
+from importacao import ImportadorAbastecimentos, ImportadorNFe, ler_planilha, relatorio_erros_csv, INDICES_NORMALIZADOS
+import nfe
+import eficiencia
+import anomalias
+import previsao
+import tabela_dinamica
+import comparativo
+import precos
+import busca
+import autocompletar
+import versoes
 from collections import defaultdict
 
 # ----------------------
@@ -16,18 +41,42 @@ from collections import defaultdict
 app = Flask(__name__, instance_relative_config=True)
 app.config['SECRET_KEY'] = 'troque-esta-chave-por-uma-segura'
 
-app.config['TEMPLATES_AUTO_RELOAD'] = True
+# Perfil (desenvolvimento/produção): auto-reload e cache de bytecode dos templates
+app.config.from_object(PERFIS[perfil_atual()])
 
 # Define o caminho do banco na pasta instance, ao lado do executável
 instance_path = os.path.join(os.getcwd(), 'instance')
 os.makedirs(instance_path, exist_ok=True)
+
+if app.config['TEMPLATES_BYTECODE_CACHE']:
+    # Precisa ser definido antes do primeiro acesso a app.jinja_env (registro dos filtros abaixo)
+    pasta_bytecode = os.path.join(instance_path, app.config['TEMPLATES_BYTECODE_CACHE'])
+    os.makedirs(pasta_bytecode, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': CacheBytecodeTemplates(pasta_bytecode)}
 DB_PATH = os.path.join(instance_path, "database.db")
 
 # Configuração do banco de dados
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': app.config['SQLITE_TIMEOUT']}}
 db.init_app(app)
 
+# Cache colunar (NumPy) para dashboard e relatórios analíticos; habilite com CACHE_COLUNAR=1
+# (é por processo: com vários processos as gravações de um não chegariam aos outros)
+app.config['CACHE_COLUNAR'] = os.environ.get('CACHE_COLUNAR', '0') == '1' and app.config['SERVIDOR_PROCESSOS'] == 1
+# Snapshot Arrow do cache em instance/cache_colunar, aberto com memory map na inicialização
+app.config['CACHE_SNAPSHOT'] = os.environ.get('CACHE_SNAPSHOT', '1') == '1'
+app.config['CACHE_SNAPSHOT_DIR'] = os.path.join(instance_path, 'cache_colunar')
+# Início rápido (executável): o cache é carregado em segundo plano depois que o servidor sobe
+# (não combina com pré-fork: threads não sobrevivem ao fork)
+app.config['INICIO_RAPIDO'] = os.environ.get('INICIO_RAPIDO', '0') == '1' and app.config['SERVIDOR_PROCESSOS'] == 1
+# Os demais caches em memória (autocompletar, previsão...) ficam ligados e, com vários processos,
+# conferem os contadores de versoes para ver as gravações dos outros
+versoes.ativo = app.config['SERVIDOR_PROCESSOS'] > 1
+
+# Versão do esquema gravada em PRAGMA user_version; create_all e migrações só rodam quando ela muda
+VERSAO_ESQUEMA = 10
+
 # ----------------------
 # Filtros Jinja2
 # ----------------------
@@ -81,55 +130,182 @@ TIPOS_COMBUSTIVEL = [
 ]
 
 # ----------------------
-# Função Auxiliar: Cálculo do Relatório
+# Função Auxiliar: Contrato efetivo (contrato + aditivos)
 # ----------------------
-def calcular_dados_relatorio_contratos():
-    """Calcula os dados do relatório de contratos de combustível."""
-    contratos = ContratoCombustivel.query.filter_by(ativo=True).order_by(ContratoCombustivel.data_inicio_contrato).all()
-    dados_relatorio = []
+def _como_data(valor):
+    """Os formulários de aditivo gravam datetime em colunas Date; normaliza para date."""
+    return valor.date() if isinstance(valor, datetime) else valor
 
-    total_contratos_ativos = len(contratos)
-    total_valor_contratado = 0
-    total_valor_consumido = 0
-    total_valor_restante = 0
+def recalcular_contrato_efetivo(contrato):
+    """Recalcula as linhas de contrato_efetivo de um contrato aplicando seus aditivos.
 
-    for contrato in contratos:
-        for item in contrato.itens:
-            quantidade_contratada = item.quantidade
-            valor_total_contratado = item.valor_total
+    O último aditivo (por data) que informa cada campo prevalece. Novos totais de
+    quantidade e valor são do contrato inteiro e são rateados entre os itens na
+    proporção dos valores originais.
+    """
+    db.session.flush()
+    ContratoEfetivo.query.filter_by(contrato_id=contrato.id).delete(synchronize_session=False)
+
+    aditivos = AditivoContratoCombustivel.query.filter_by(contrato_id=contrato.id).order_by(
+        AditivoContratoCombustivel.data_aditivo, AditivoContratoCombustivel.id
+    ).all()
+    data_fim = contrato.data_fim_contrato
+    nova_quantidade_total = None
+    novo_valor_total = None
+    for aditivo in aditivos:
+        if aditivo.nova_data_fim:
+            data_fim = _como_data(aditivo.nova_data_fim)
+        if aditivo.nova_quantidade_total is not None:
+            nova_quantidade_total = aditivo.nova_quantidade_total
+        if aditivo.novo_valor_total is not None:
+            novo_valor_total = aditivo.novo_valor_total
+
+    itens = list(contrato.itens)
+    quantidade_original = sum(item.quantidade for item in itens)
+    valor_original = sum(item.valor_total for item in itens)
+    for item in itens:
+        quantidade = item.quantidade
+        if nova_quantidade_total is not None:
+            if quantidade_original > 0:
+                quantidade = nova_quantidade_total * item.quantidade / quantidade_original
+            else:
+                quantidade = nova_quantidade_total / len(itens)
+        valor_total = item.valor_total
+        if novo_valor_total is not None:
+            if valor_original > 0:
+                valor_total = novo_valor_total * item.valor_total / valor_original
+            else:
+                valor_total = novo_valor_total / len(itens)
+        db.session.add(ContratoEfetivo(
+            item_id=item.id,
+            contrato_id=contrato.id,
+            tipo_combustivel=item.tipo_combustivel,
+            data_inicio=_como_data(contrato.data_inicio_contrato),
+            data_fim=data_fim,
+            quantidade=quantidade,
+            valor_total=valor_total,
+            valor_por_litro=valor_total / quantidade if quantidade > 0 else 0
+        ))
+    # A regra de preço das anomalias compara com o valor por litro vigente
+    anomalias.verificar_contrato(contrato.id)
+    previsao.cache.marcar_contrato(contrato.id)
+
+def sincronizar_contratos_efetivos():
+    """Materializa contrato_efetivo para contratos que ainda não possuem linhas (bancos antigos)."""
+    pendentes = ContratoCombustivel.query.filter(
+        ContratoCombustivel.itens.any(),
+        ~ContratoCombustivel.id.in_(db.session.query(ContratoEfetivo.contrato_id))
+    ).all()
+    for contrato in pendentes:
+        recalcular_contrato_efetivo(contrato)
+    if pendentes:
+        db.session.commit()
 
-            inicio_contrato = datetime.combine(contrato.data_inicio_contrato, datetime.min.time())
-            fim_contrato = datetime.combine(contrato.data_fim_contrato, datetime.max.time())
+# ----------------------
+# Função Auxiliar: Cálculo do Relatório
+# ----------------------
+def usar_cache_colunar():
+    """Se a consulta pode ser respondida pelo cache colunar (acerto/falta vão para /metrics)."""
+    ativo = cache_colunar.cache.ativo
+    if coletor_metricas:
+        coletor_metricas.contar_cache('colunar', ativo)
+    return ativo
+
+def previsoes_contratos(efetivos, setor=None):
+    """Previsão de esgotamento dos itens (cache por setor e item; acerto/falta vão para /metrics)."""
+    previsoes, acerto = previsao.cache.obter(efetivos, setor)
+    if coletor_metricas:
+        coletor_metricas.contar_cache('previsao', acerto)
+    return previsoes
+
+def selecionados_autocompletar(veiculo_id=None, motorista_id=None):
+    """Veículo e motorista já escolhidos num filtro (texto inicial dos campos de autocompletar)."""
+    veiculo = db.session.get(Veiculo, int(veiculo_id)) if str(veiculo_id or "").isdigit() else None
+    motorista = db.session.get(Motorista, int(motorista_id)) if str(motorista_id or "").isdigit() else None
+    return veiculo, motorista
+
+def calcular_consumo_itens(efetivos, setor=None):
+    """Consumo (litros, valor) de cada item de contrato em uma única consulta agrupada.
+
+    Conta os abastecimentos dentro da vigência efetiva que são do mesmo combustível
+    do item ou que foram vinculados ao contrato; cada abastecimento entra uma vez por item.
+    """
+    if not efetivos:
+        return {}
+    if usar_cache_colunar():
+        return cache_colunar.consumo_itens(efetivos, setor)
+    item_ids = [efetivo.item_id for efetivo in efetivos]
+    query = db.session.query(
+        ContratoEfetivo.item_id,
+        func.sum(Abastecimento.litros),
+        func.sum(Abastecimento.valor_total)
+    ).join(Abastecimento, and_(
+        Abastecimento.data >= ContratoEfetivo.data_inicio,
+        Abastecimento.data < func.date(ContratoEfetivo.data_fim, '+1 day')
+    )).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).filter(
+        ContratoEfetivo.item_id.in_(item_ids),
+        or_(
+            Veiculo.combustivel == ContratoEfetivo.tipo_combustivel,
+            Abastecimento.contrato_id == ContratoEfetivo.contrato_id
+        )
+    )
+    if setor:
+        query = query.filter(Veiculo.tipo == setor)
+    consumo = query.group_by(ContratoEfetivo.item_id).all()
+    return {item_id: (litros or 0, valor or 0) for item_id, litros, valor in consumo}
 
-            abastecimentos_tipo = Abastecimento.query.join(Veiculo).filter(
-                Veiculo.combustivel == item.tipo_combustivel,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
+def calcular_dados_relatorio_contratos(setor_contrato=None, setor_abastecimentos=None, mais_recentes_primeiro=False):
+    """Calcula os dados do relatório de contratos de combustível.
 
-            abastecimentos_contrato = Abastecimento.query.filter(
-                Abastecimento.contrato_id == contrato.id,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
+    Lê a vigência, a quantidade e o valor de contrato_efetivo, de modo que o número
+    de consultas não cresce com a quantidade de contratos.
+    """
+    query = ContratoCombustivel.query.options(
+        selectinload(ContratoCombustivel.itens), selectinload(ContratoCombustivel.aditivos)
+    ).filter_by(ativo=True)
+    if setor_contrato:
+        query = query.filter(ContratoCombustivel.setor == setor_contrato)
+    if mais_recentes_primeiro:
+        ordem = desc(ContratoCombustivel.data_criacao)
+    else:
+        ordem = ContratoCombustivel.data_inicio_contrato
+    contratos = query.order_by(ordem).all()
+
+    contratos_por_id = {contrato.id: contrato for contrato in contratos}
+    efetivos = ContratoEfetivo.query.filter(
+        ContratoEfetivo.contrato_id.in_(list(contratos_por_id))
+    ).order_by(ContratoEfetivo.item_id).all() if contratos_por_id else []
+    efetivos_por_contrato = defaultdict(list)
+    for efetivo in efetivos:
+        efetivos_por_contrato[efetivo.contrato_id].append(efetivo)
+    consumo = calcular_consumo_itens(efetivos, setor_abastecimentos)
 
-            todos_abastecimentos = list(set(abastecimentos_tipo + abastecimentos_contrato))
+    dados_relatorio = []
+    total_valor_contratado = 0
+    total_valor_consumido = 0
+    total_valor_restante = 0
 
-            quantidade_consumida = sum(a.litros for a in todos_abastecimentos)
-            valor_usado = sum(a.valor_total for a in todos_abastecimentos)
+    for contrato in contratos:
+        for efetivo in efetivos_por_contrato[contrato.id]:
+            quantidade_contratada = efetivo.quantidade
+            valor_total_contratado = efetivo.valor_total
+            quantidade_consumida, valor_usado = consumo.get(efetivo.item_id, (0, 0))
 
             quantidade_restante = max(0, quantidade_contratada - quantidade_consumida)
             valor_restante = max(0, valor_total_contratado - valor_usado)
             percentual_consumido = (quantidade_consumida / quantidade_contratada * 100) if quantidade_contratada > 0 else 0
 
             dados_relatorio.append({
-                'tipo_combustivel': item.tipo_combustivel,
+                'item_id': efetivo.item_id,
+                'tipo_combustivel': efetivo.tipo_combustivel,
                 'fornecedor': contrato.fornecedor,
-                'data_inicio_contrato': contrato.data_inicio_contrato,
-                'data_fim_contrato': contrato.data_fim_contrato,
+                'numero_contrato': contrato.numero_contrato,
+                'ano_contrato': contrato.ano_contrato,
+                'data_inicio_contrato': efetivo.data_inicio,
+                'data_fim_contrato': efetivo.data_fim,
                 'quantidade_contratada': quantidade_contratada,
                 'valor_total': valor_total_contratado,
-                'valor_por_litro': item.valor_por_litro,
+                'valor_por_litro': efetivo.valor_por_litro,
                 'quantidade_consumida': quantidade_consumida,
                 'valor_usado': valor_usado,
                 'quantidade_restante': quantidade_restante,
@@ -142,23 +318,409 @@ def calcular_dados_relatorio_contratos():
             total_valor_restante += valor_restante
 
     return {
+        'contratos': contratos,
+        'efetivos': efetivos,
         'dados_relatorio': dados_relatorio,
-        'total_contratos_ativos': total_contratos_ativos,
+        'total_contratos_ativos': len(contratos),
         'total_valor_contratado': total_valor_contratado,
         'total_valor_consumido': total_valor_consumido,
         'total_valor_restante': total_valor_restante
     }
 
+# ----------------------
+# Função Auxiliar: Relatórios por veículo e por motorista
+# ----------------------
+def filtros_colunares(*chaves):
+    """Filtros da requisição atual no formato de cache_colunar (setor conforme o perfil do usuário).
+
+    `chaves` limita os filtros opcionais aos que a rota realmente aplica.
+    """
+    filtros = {}
+    if session.get("usuario_tipo") == "admin":
+        filtros['setor'] = request.args.get("setor") or None
+    else:
+        filtros['setor'] = session.get("usuario_setor") or None
+    conversores = {
+        'data_inicio': datetime.fromisoformat,
+        'data_fim': datetime.fromisoformat,
+        'veiculo_id': int,
+        'motorista_id': int,
+        'combustivel': str,
+        'min_litros': float,
+        'max_litros': float,
+    }
+    for chave in chaves:
+        valor = request.args.get(chave, "")
+        if valor:
+            try:
+                filtros[chave] = conversores[chave](valor)
+            except (ValueError, TypeError):
+                pass
+    return filtros
+
+def estimar_linhas_relatorio():
+    """Quantidade de abastecimentos que o relatório da requisição atual vai ler (custo estimado)."""
+    filtros = filtros_colunares('data_inicio', 'data_fim', 'veiculo_id', 'motorista_id', 'combustivel', 'min_litros', 'max_litros')
+    if usar_cache_colunar():
+        colunas = cache_colunar.cache.colunas()
+        return int(cache_colunar.cache.mascara(colunas, **filtros).sum())
+    query = consulta_abastecimentos()
+    if filtros['setor']:
+        query = query.filter(Veiculo.tipo == filtros['setor'])
+    if 'data_inicio' in filtros:
+        query = query.filter(Abastecimento.data >= filtros['data_inicio'])
+    if 'data_fim' in filtros:
+        query = query.filter(Abastecimento.data < filtros['data_fim'] + timedelta(days=1))
+    if 'veiculo_id' in filtros:
+        query = query.filter(Abastecimento.veiculo_id == filtros['veiculo_id'])
+    if 'motorista_id' in filtros:
+        query = query.filter(Abastecimento.motorista_id == filtros['motorista_id'])
+    if 'combustivel' in filtros:
+        query = query.filter(Veiculo.combustivel == filtros['combustivel'])
+    if 'min_litros' in filtros:
+        query = query.filter(Abastecimento.litros >= filtros['min_litros'])
+    if 'max_litros' in filtros:
+        query = query.filter(Abastecimento.litros <= filtros['max_litros'])
+    return query.count()
+
+def resumir_abastecimentos_por_grupo(query, coluna_grupo, coluna_secundaria, modelo_grupo, modelo_secundario, limite=5, filtros=None):
+    """Totais por grupo, ranking dos `limite` itens secundários e os `limite` abastecimentos
+    mais recentes de cada grupo, calculados no banco com ROW_NUMBER() OVER (PARTITION BY ...).
+
+    `query` é a consulta de abastecimentos já filtrada pela rota; apenas as linhas exibidas
+    no relatório são carregadas. Com o cache colunar ativo, `filtros` (os mesmos da consulta,
+    ver filtros_colunares) é avaliado em memória no lugar do SQL.
+    """
+    if filtros is not None and usar_cache_colunar():
+        totais, mais_utilizados, ids_recentes = cache_colunar.resumir_por_grupo(
+            'veiculo' if modelo_grupo is Veiculo else 'motorista', limite, **filtros
+        )
+    else:
+        filtrados = query.with_entities(
+            Abastecimento.id.label('id'),
+            Abastecimento.data.label('data'),
+            Abastecimento.litros.label('litros'),
+            Abastecimento.valor_total.label('valor_total'),
+            coluna_grupo.label('grupo_id'),
+            coluna_secundaria.label('secundario_id')
+        ).order_by(None).subquery()
+
+        # Totais por grupo, na ordem do abastecimento mais recente (como a listagem original)
+        totais = db.session.query(
+            filtrados.c.grupo_id,
+            func.sum(filtrados.c.litros),
+            func.sum(filtrados.c.valor_total),
+            func.count(filtrados.c.id)
+        ).group_by(filtrados.c.grupo_id).order_by(desc(func.max(filtrados.c.data))).all()
+
+        # Top N de itens secundários por grupo
+        ranking = db.session.query(
+            filtrados.c.grupo_id,
+            filtrados.c.secundario_id,
+            func.sum(filtrados.c.litros).label('litros'),
+            func.sum(filtrados.c.valor_total).label('valor'),
+            func.row_number().over(
+                partition_by=filtrados.c.grupo_id,
+                order_by=desc(func.sum(filtrados.c.litros))
+            ).label('posicao')
+        ).group_by(filtrados.c.grupo_id, filtrados.c.secundario_id).subquery()
+        mais_utilizados = db.session.query(
+            ranking.c.grupo_id, ranking.c.secundario_id, ranking.c.litros, ranking.c.valor
+        ).filter(ranking.c.posicao <= limite).order_by(ranking.c.grupo_id, ranking.c.posicao).all()
+
+        # N abastecimentos mais recentes por grupo
+        recentes = db.session.query(
+            filtrados.c.id,
+            func.row_number().over(
+                partition_by=filtrados.c.grupo_id,
+                order_by=(desc(filtrados.c.data), desc(filtrados.c.id))
+            ).label('posicao')
+        ).subquery()
+        ids_recentes = db.session.query(recentes.c.id).filter(recentes.c.posicao <= limite)
+
+    if not totais:
+        return {}
+    abastecimentos = listar_abastecimentos(consulta_abastecimentos().filter(
+        Abastecimento.id.in_(ids_recentes)
+    ).order_by(desc(Abastecimento.data), desc(Abastecimento.id)))
+
+    grupos = {obj.id: obj for obj in modelo_grupo.query.filter(modelo_grupo.id.in_([t[0] for t in totais]))}
+    secundarios = {obj.id: obj for obj in modelo_secundario.query.filter(
+        modelo_secundario.id.in_({linha[1] for linha in mais_utilizados})
+    )}
+
+    dados = {}
+    por_id = {}
+    for grupo_id, total_litros, total_valor, total_abastecimentos in totais:
+        por_id[grupo_id] = dados[grupos[grupo_id]] = {
+            'total_litros': total_litros,
+            'total_valor': total_valor,
+            'total_abastecimentos': total_abastecimentos,
+            'media_litros': total_litros / total_abastecimentos if total_abastecimentos > 0 else 0,
+            'mais_utilizados': {},
+            'abastecimentos': []
+        }
+    for grupo_id, secundario_id, litros, valor in mais_utilizados:
+        por_id[grupo_id]['mais_utilizados'][secundarios[secundario_id]] = {
+            'litros': litros,
+            'valor': valor
+        }
+    for abastecimento in abastecimentos:
+        grupo_id = abastecimento.veiculo_id if modelo_grupo is Veiculo else abastecimento.motorista_id
+        por_id[grupo_id]['abastecimentos'].append(abastecimento)
+    return dados
+
+def calcular_dados_veiculos(query):
+    """Dados do relatório por veículo: totais, top 5 motoristas e últimos 5 abastecimentos."""
+    dados_veiculos = resumir_abastecimentos_por_grupo(
+        query, Abastecimento.veiculo_id, Abastecimento.motorista_id, Veiculo, Motorista,
+        filtros=filtros_colunares('data_inicio', 'data_fim', 'veiculo_id', 'combustivel')
+    )
+    for dados in dados_veiculos.values():
+        dados['motoristas_mais_utilizados'] = dados.pop('mais_utilizados')
+    return dados_veiculos
+
+def calcular_dados_motoristas(query):
+    """Dados do relatório por motorista: totais, top 5 veículos e últimos 5 abastecimentos."""
+    dados_motoristas = resumir_abastecimentos_por_grupo(
+        query, Abastecimento.motorista_id, Abastecimento.veiculo_id, Motorista, Veiculo,
+        filtros=filtros_colunares('data_inicio', 'data_fim', 'motorista_id', 'combustivel')
+    )
+    for dados in dados_motoristas.values():
+        dados['veiculos_mais_utilizados'] = dados.pop('mais_utilizados')
+    return dados_motoristas
+
+# ----------------------
+# Exportação em PDF
+# ----------------------
+def HTML(*args, **kwargs):
+    """Importa o WeasyPrint (árvore de dependências pesada) só na primeira exportação em PDF."""
+    from weasyprint import HTML as HTMLWeasyPrint
+    return HTMLWeasyPrint(*args, **kwargs)
+
+def gerar_pdf(html):
+    """Renderiza o HTML em PDF, registrando a duração nas métricas."""
+    inicio = time.perf_counter()
+    try:
+        pdf = HTML(string=html).write_pdf()
+    except Exception:
+        if coletor_metricas:
+            coletor_metricas.registrar_pdf(time.perf_counter() - inicio, erro=True)
+        raise
+    if coletor_metricas:
+        coletor_metricas.registrar_pdf(time.perf_counter() - inicio)
+    return pdf
+
 # ----------------------
 # Inicialização do banco
 # ----------------------
-with app.app_context():
+def migrar_chave_nota():
+    """Versão 2: coluna abastecimento.chave_nota (com índice) preenchida para o histórico."""
+    conexao = db.session.connection()
+    colunas = {linha[1] for linha in conexao.exec_driver_sql("PRAGMA table_info(abastecimento)")}
+    if 'chave_nota' not in colunas:
+        conexao.exec_driver_sql("ALTER TABLE abastecimento ADD COLUMN chave_nota VARCHAR(80)")
+    conexao.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_abastecimento_chave_nota ON abastecimento (chave_nota)")
+    pendentes = db.session.query(Abastecimento.id, Abastecimento.contrato_id, Abastecimento.numero_nota).filter(
+        Abastecimento.chave_nota == None
+    ).all()
+    if pendentes:
+        db.session.execute(
+            update(Abastecimento),
+            [{'id': id_, 'chave_nota': chave_nota(contrato_id, numero)} for id_, contrato_id, numero in pendentes]
+        )
+
+def migrar_eficiencia():
+    """Versão 4: índice (veiculo_id, data) e eficiencia_abastecimento calculada para o histórico."""
+    conexao = db.session.connection()
+    conexao.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_abastecimento_veiculo_data ON abastecimento (veiculo_id, data)")
+    if not conexao.exec_driver_sql("SELECT 1 FROM eficiencia_abastecimento LIMIT 1").first():
+        eficiencia.recalcular_tudo()
+
+def migrar_anomalias():
+    """Versão 5: anomalia_abastecimento verificada para o histórico (refeita a cada nova versão do esquema)."""
+    anomalias.verificar_tudo()
+
+def migrar_busca():
+    """Versão 6: tabela FTS5 busca_abastecimento, gatilhos e índice do histórico."""
+    if not busca.criar():
+        app.logger.warning("SQLite sem FTS5: a busca de abastecimentos usará LIKE (lenta em bancos grandes)")
+
+def migrar_versoes():
+    """Versões 7, 8 e 10: contadores de versoes e seus gatilhos, um por tabela e evento.
+
+    Na versão 10 o contador próprio do snapshot colunar (contador_alteracoes) virou o grupo
+    'colunar': o valor é levado junto, para o snapshot já gravado continuar válido.
+    """
+    versoes.instalar()
+    conexao = db.session.connection()
+    if conexao.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'contador_alteracoes'").first():
+        conexao.exec_driver_sql(
+            f"UPDATE {versoes.TABELA} SET versao = (SELECT versao FROM contador_alteracoes WHERE id = 1) "
+            "WHERE grupo = 'colunar'"
+        )
+        for (nome,) in conexao.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB 'contador_*'"
+        ).all():
+            conexao.exec_driver_sql(f"DROP TRIGGER {nome}")
+        conexao.exec_driver_sql("DROP TABLE contador_alteracoes")
+
+def migrar_indices_normalizados():
+    """Versão 9: índices de placa e documento sem pontuação (cadastros consultados por lote na importação)."""
+    conexao = db.session.connection()
+    for nome, (tabela, expressao) in INDICES_NORMALIZADOS.items():
+        conexao.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({expressao})")
+
+def nota_registrada(chave, ignorar_id=None):
+    """Abastecimento já lançado com a mesma chave de nota (busca pelo índice), ou None."""
+    consulta = Abastecimento.query.filter(Abastecimento.chave_nota == chave)
+    if ignorar_id is not None:
+        consulta = consulta.filter(Abastecimento.id != ignorar_id)
+    return consulta.first()
+
+def preparar_banco():
+    """Cria tabelas e materializações pendentes apenas quando o esquema gravado no banco é antigo."""
+    versao = db.session.connection().exec_driver_sql("PRAGMA user_version").scalar()
+    if versao >= VERSAO_ESQUEMA:
+        return
     db.create_all()
+    migrar_chave_nota()
+    migrar_eficiencia()
+    sincronizar_contratos_efetivos()
+    # Depois de contrato_efetivo: a regra de preço compara com o valor por litro vigente
+    migrar_anomalias()
+    migrar_busca()
+    migrar_versoes()
+    migrar_indices_normalizados()
+    db.session.connection().exec_driver_sql(f"PRAGMA user_version = {VERSAO_ESQUEMA}")
+    db.session.commit()
+
+def precompilar_templates():
+    """Compila todos os templates de uma vez (e grava o bytecode no cache, se habilitado)."""
+    for nome in app.jinja_env.list_templates(extensions=['html']):
+        try:
+            app.jinja_env.get_template(nome)
+        except TemplateSyntaxError:
+            # Um template quebrado falha só na própria página, como sem a pré-compilação
+            app.logger.exception("Erro ao pré-compilar o template %s", nome)
+
+@app.cli.command('precompilar-templates')
+def precompilar_templates_comando():
+    """Preenche o cache de bytecode dos templates (uso no build/deploy)."""
+    precompilar_templates()
+
+def carregar_cache_colunar():
+    """Monta o cache colunar, pelo snapshot em disco quando habilitado."""
+    with app.app_context():
+        if app.config['CACHE_SNAPSHOT']:
+            import snapshot_colunar  # pyarrow só é importado quando o snapshot está ligado
+            snapshot_colunar.iniciar(cache_colunar.cache, app.config['CACHE_SNAPSHOT_DIR'])
+        else:
+            cache_colunar.cache.construir()
+
+with app.app_context():
+    if app.config['SQLITE_WAL']:
+        # O modo fica gravado no arquivo; só precisa ser pedido fora de uma transação
+        db.session.connection().exec_driver_sql("PRAGMA journal_mode=WAL")
+        db.session.commit()
+    preparar_banco()
+
+if app.config['PRECOMPILAR_TEMPLATES']:
+    if app.config['INICIO_RAPIDO']:
+        threading.Thread(target=precompilar_templates, daemon=True).start()
+    else:
+        precompilar_templates()
+
+if app.config['CACHE_COLUNAR']:
+    if app.config['INICIO_RAPIDO']:
+        # Até o cache ficar ativo as rotas usam o caminho SQL
+        threading.Thread(target=carregar_cache_colunar, daemon=True).start()
+    else:
+        carregar_cache_colunar()
+
+# ----------------------
+# Instrumentação por requisição (DESEMPENHO=1; antes da admissão para contar também os 503),
+# métricas do Prometheus em /metrics e detector N+1
+# ----------------------
+monitor_desempenho = desempenho.instalar(app, db)
+coletor_metricas = metricas.instalar(app, db, DB_PATH)
+detector_consultas_n1 = detector_n1.instalar(app)
+
+# ----------------------
+# Controle de admissão (exportações e visualizações de relatório)
+# ----------------------
+ENDPOINTS_PESADOS = ('export_', 'visualizar_')
+
+faixa_pesada = FaixaPesada(
+    app.config['EXPORTACAO_SIMULTANEAS'], app.config['EXPORTACAO_FILA'], app.config['EXPORTACAO_ESPERA_MAXIMA']
+)
+if coletor_metricas:
+    coletor_metricas.faixa_pesada = faixa_pesada
+
+@app.before_request
+def admitir_requisicao_pesada():
+    endpoint = request.endpoint or ""
+    if not endpoint.startswith(ENDPOINTS_PESADOS) or "usuario" not in session:
+        return None
+    # Listas de cadastro (veículos, motoristas) e relatórios com poucas linhas seguem direto
+    if "relatorio" not in endpoint or estimar_linhas_relatorio() < app.config['EXPORTACAO_LIMIAR_LINHAS']:
+        return None
+    if not faixa_pesada.entrar():
+        resposta = make_response("Há muitas exportações em andamento. Tente novamente em alguns segundos.", 503)
+        resposta.headers['Retry-After'] = str(app.config['EXPORTACAO_RETRY_AFTER'])
+        return resposta
+    g.faixa_pesada = True
+
+@app.teardown_request
+def liberar_requisicao_pesada(erro=None):
+    if g.pop('faixa_pesada', False):
+        faixa_pesada.sair()
 
 # ----------------------
 # Rotas
 # ----------------------
 
+@app.route("/admin/desempenho")
+def admin_desempenho():
+    """Latência, SQL e renderização por endpoint (janela recente) e perfis das requisições lentas."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if session.get("usuario_tipo") != "admin":
+        return redirect(url_for("dashboard"))
+    resumo = monitor_desempenho.resumo() if monitor_desempenho else None
+    return render_template("admin_desempenho.html", resumo=resumo)
+
+@app.route("/admin/desempenho.json")
+def admin_desempenho_json():
+    if "usuario" not in session or session.get("usuario_tipo") != "admin":
+        return jsonify(erro="acesso restrito a administradores"), 403
+    if not monitor_desempenho:
+        return jsonify(erro="instrumentação desligada (DESEMPENHO=1)"), 404
+    return jsonify(monitor_desempenho.resumo())
+
+@app.route("/admin/desempenho/perfis/<int:indice>")
+def admin_desempenho_perfil(indice):
+    if "usuario" not in session or session.get("usuario_tipo") != "admin":
+        return redirect(url_for("login"))
+    if not monitor_desempenho or indice >= len(monitor_desempenho.perfis):
+        return Response("Perfil não encontrado.", 404, mimetype="text/plain")
+    perfil = monitor_desempenho.perfis[indice]
+    cabecalho = f"{perfil['metodo']} {perfil['url']} ({perfil['total_ms']:.1f} ms em {perfil['data']:%d/%m/%Y %H:%M:%S})\n\n"
+    return Response(cabecalho + perfil['relatorio'], mimetype="text/plain; charset=utf-8")
+
+@app.route("/admin/desempenho/limpar", methods=["POST"])
+def admin_desempenho_limpar():
+    if "usuario" not in session or session.get("usuario_tipo") != "admin":
+        return redirect(url_for("login"))
+    if monitor_desempenho:
+        monitor_desempenho.limpar()
+    return redirect(url_for("admin_desempenho"))
+
+@app.route("/saude")
+def saude():
+    """Verificação de prontidão usada pelo main.py antes de abrir a janela."""
+    return jsonify(status="ok", cache_colunar=cache_colunar.cache.ativo)
+
 @app.route("/")
 def index():
     if "usuario" in session:
@@ -227,68 +789,84 @@ def dashboard():
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
 
-    # Executar a consulta
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
+    if usar_cache_colunar():
+        # Agregações vetorizadas sobre o cache colunar; só os 10 mais recentes vêm do banco
+        resumo = cache_colunar.resumo_dashboard(
+            agrupamento, **filtros_colunares('data_inicio', 'data_fim', 'veiculo_id', 'motorista_id', 'combustivel')
+        )
+        abastecimentos = listar_abastecimentos(consulta_abastecimentos().filter(
+            Abastecimento.id.in_(resumo['ids_recentes'])
+        ).order_by(desc(Abastecimento.data), desc(Abastecimento.id)))
+        total_litros = resumo['total_litros']
+        valor_total = resumo['valor_total']
+        media_litros = total_litros / resumo['quantidade'] if resumo['quantidade'] else 0
+        litros_por_periodo_ordenado = resumo['litros_por_periodo']
+
+        placas = dict(db.session.query(Veiculo.id, Veiculo.placa).filter(
+            Veiculo.id.in_([veiculo_id for veiculo_id, _ in resumo['top_veiculos']])
+        ))
+        litros_por_veiculo_top10 = defaultdict(float)
+        for veiculo_id_top, litros in resumo['top_veiculos']:
+            litros_por_veiculo_top10[placas.get(veiculo_id_top, f"Veículo {veiculo_id_top}")] += litros
+
+        nomes = dict(db.session.query(Motorista.id, Motorista.nome_completo).filter(
+            Motorista.id.in_([motorista_id for motorista_id, _ in resumo['top_motoristas']])
+        ))
+        litros_por_motorista_top10 = defaultdict(float)
+        for motorista_id_top, litros in resumo['top_motoristas']:
+            litros_por_motorista_top10[nomes.get(motorista_id_top, f"Motorista {motorista_id_top}")] += litros
+
+        litros_por_combustivel = dict(resumo['litros_por_combustivel'])
+    else:
+        # Executar a consulta
+        abastecimentos = listar_abastecimentos(query.order_by(desc(Abastecimento.data)))
+
+        # Indicadores
+        total_litros = sum(a.litros for a in abastecimentos) if abastecimentos else 0
+        valor_total = sum(a.valor_total for a in abastecimentos) if abastecimentos else 0
+        media_litros = total_litros / len(abastecimentos) if abastecimentos else 0
+
+        # Gráfico: Litros por período (dia, semana, mês)
+        litros_por_periodo = defaultdict(float)
+        for a in abastecimentos:
+            if agrupamento == "semana":
+                key = a.data.strftime('%Y-W%U')  # Ano-Semana
+            elif agrupamento == "mes":
+                key = a.data.strftime('%Y-%m')  # Ano-Mês
+            else:
+                key = a.data.strftime('%Y-%m-%d')  # Dia
+            litros_por_periodo[key] += a.litros
+        litros_por_periodo_ordenado = dict(sorted(litros_por_periodo.items()))
+
+        # Gráfico: Top 10 Veículos
+        litros_por_veiculo = defaultdict(float)
+        for a in abastecimentos:
+            placa = a.veiculo.placa if a.veiculo else f"Veículo {a.veiculo_id}"
+            litros_por_veiculo[placa] += a.litros
+        top_veiculos_items = sorted(litros_por_veiculo.items(), key=lambda x: x[1], reverse=True)[:10]
+        litros_por_veiculo_top10 = dict(top_veiculos_items)
+
+        # Gráfico: Top 10 Motoristas
+        litros_por_motorista = defaultdict(float)
+        for a in abastecimentos:
+            nome = a.motorista.nome_completo if a.motorista else f"Motorista {a.motorista_id}"
+            litros_por_motorista[nome] += a.litros
+        top_motoristas_items = sorted(litros_por_motorista.items(), key=lambda x: x[1], reverse=True)[:10]
+        litros_por_motorista_top10 = dict(top_motoristas_items)
+
+        # Gráfico: Litros por combustível
+        litros_por_combustivel = defaultdict(float)
+        for a in abastecimentos:
+            tipo = a.veiculo.combustivel if a.veiculo else "Não informado"
+            litros_por_combustivel[tipo] += a.litros
 
-    # Indicadores
-    total_litros = sum(a.litros for a in abastecimentos) if abastecimentos else 0
-    valor_total = sum(a.valor_total for a in abastecimentos) if abastecimentos else 0
-    media_litros = total_litros / len(abastecimentos) if abastecimentos else 0
     if usuario_tipo != "admin" and usuario_setor:
         total_veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).count()
     else:
         total_veiculos = Veiculo.query.count()
 
-    # Gráfico: Litros por período (dia, semana, mês)
-    litros_por_periodo = defaultdict(float)
-    for a in abastecimentos:
-        if agrupamento == "semana":
-            key = a.data.strftime('%Y-W%U')  # Ano-Semana
-        elif agrupamento == "mes":
-            key = a.data.strftime('%Y-%m')  # Ano-Mês
-        else:
-            key = a.data.strftime('%Y-%m-%d')  # Dia
-        litros_por_periodo[key] += a.litros
-    litros_por_periodo_ordenado = dict(sorted(litros_por_periodo.items()))
-
-    # Gráfico: Top 10 Veículos
-    litros_por_veiculo = defaultdict(float)
-    for a in abastecimentos:
-        placa = a.veiculo.placa if a.veiculo else f"Veículo {a.veiculo_id}"
-        litros_por_veiculo[placa] += a.litros
-    top_veiculos_items = sorted(litros_por_veiculo.items(), key=lambda x: x[1], reverse=True)[:10]
-    litros_por_veiculo_top10 = dict(top_veiculos_items)
-
-    # Gráfico: Top 10 Motoristas
-    litros_por_motorista = defaultdict(float)
-    for a in abastecimentos:
-        nome = a.motorista.nome_completo if a.motorista else f"Motorista {a.motorista_id}"
-        litros_por_motorista[nome] += a.litros
-    top_motoristas_items = sorted(litros_por_motorista.items(), key=lambda x: x[1], reverse=True)[:10]
-    litros_por_motorista_top10 = dict(top_motoristas_items)
-
-    # Gráfico: Litros por combustível
-    litros_por_combustivel = defaultdict(float)
-    for a in abastecimentos:
-        tipo = a.veiculo.combustivel if a.veiculo else "Não informado"
-        litros_por_combustivel[tipo] += a.litros
-
-    # Dados para os filtros no template
-
-    # Filtrar veículos e motoristas pelo setor selecionado (admin) ou setor do usuário
-    if usuario_tipo == "admin":
-        if setor_filtro:
-            veiculos = Veiculo.query.filter(Veiculo.tipo == setor_filtro).order_by(Veiculo.placa).all()
-            motoristas = Motorista.query.join(Abastecimento).join(Veiculo).filter(Veiculo.tipo == setor_filtro).order_by(Motorista.nome_completo).distinct().all()
-        else:
-            veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-            motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
-    elif usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-        motoristas = Motorista.query.join(Abastecimento).join(Veiculo).filter(Veiculo.tipo == usuario_setor).order_by(Motorista.nome_completo).distinct().all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-        motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
+    # Veículo e motorista escolhidos (os filtros buscam os demais por autocompletar)
+    veiculo_selecionado, motorista_selecionado = selecionados_autocompletar(veiculo_id, motorista_id)
 
     # Filtros aplicados para badges
     filtros_aplicados = {}
@@ -305,11 +883,23 @@ def dashboard():
         except Exception:
             filtros_aplicados["data_fim"] = data_fim
     if veiculo_id:
-        veiculo = Veiculo.query.get(veiculo_id)
-        filtros_aplicados["veiculo_id"] = veiculo.placa if veiculo else veiculo_id
+        filtros_aplicados["veiculo_id"] = veiculo_selecionado.placa if veiculo_selecionado else veiculo_id
     if combustivel:
         filtros_aplicados["combustivel"] = combustivel
 
+    # Comparação com o período anterior e o mesmo período do ano anterior (opcional)
+    comparacao = None
+    if request.args.get("comparar"):
+        inicio, fim = intervalo_comparativo(data_inicio, data_fim)
+        limites, _, total = comparativo.comparar(
+            inicio, fim,
+            setor=setor_filtro if usuario_tipo == "admin" else usuario_setor,
+            veiculo_id=int(veiculo_id) if veiculo_id else None,
+            motorista_id=int(motorista_id) if motorista_id else None,
+            combustivel=combustivel or None
+        )
+        comparacao = {'periodos': limites, 'total': total, 'nomes': comparativo.PERIODOS}
+
     # Renderizar template com todos os dados
     # Listar setores disponíveis para o filtro (admin)
     setores = []
@@ -319,8 +909,8 @@ def dashboard():
     return render_template(
         "dashboard.html",
         abastecimentos=abastecimentos,
-        veiculos=veiculos,
-        motoristas=motoristas,
+        veiculo_selecionado=veiculo_selecionado,
+        motorista_selecionado=motorista_selecionado,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros={
             'data_inicio': data_inicio,
@@ -329,8 +919,10 @@ def dashboard():
             'motorista_id': motorista_id,
             'combustivel': combustivel,
             'agrupamento': agrupamento,
-            'setor': setor_filtro
+            'setor': setor_filtro,
+            'comparar': bool(comparacao)
         },
+        comparacao=comparacao,
         setores=setores,
         indicadores={
             'total_litros': round(total_litros, 2),
@@ -420,6 +1012,7 @@ def veiculos():
             novo_veiculo = Veiculo(placa=placa, tipo=tipo, combustivel=combustivel, capacidade_tanque=capacidade_tanque)
             db.session.add(novo_veiculo)
             db.session.commit()
+            autocompletar.indice.atualizar_veiculo(novo_veiculo)
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("veiculos"))
@@ -452,7 +1045,13 @@ def editar_veiculo(veiculo_id):
                 veiculo.tipo = request.form["setor"]
             else:
                 veiculo.tipo = request.form["type"]
+            # Capacidade do tanque e combustível entram nas regras de anomalia
+            anomalias.verificar_veiculo(veiculo.id)
+            # Combustível e setor decidem a que itens de contrato os abastecimentos contam
+            previsao.cache.marcar_tudo()
             db.session.commit()
+            cache_colunar.cache.atualizar_veiculo(veiculo)
+            autocompletar.indice.atualizar_veiculo(veiculo)
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("veiculos"))
@@ -469,7 +1068,10 @@ def excluir_veiculo(veiculo_id):
     veiculo = Veiculo.query.get_or_404(veiculo_id)
     try:
         db.session.delete(veiculo)
+        previsao.cache.marcar_tudo()
         db.session.commit()
+        cache_colunar.cache.remover_por('veiculo', veiculo_id)
+        autocompletar.indice.remover_veiculo(veiculo_id)
     except Exception as e:
         db.session.rollback()
     return redirect(url_for("veiculos"))
@@ -515,6 +1117,7 @@ def motoristas():
             novo_motorista = Motorista(nome_completo=nome_completo, documento=documento, observacoes=observacoes, setor=setor)
             db.session.add(novo_motorista)
             db.session.commit()
+            autocompletar.indice.atualizar_motorista(novo_motorista, novo=True)
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("motoristas"))
@@ -549,6 +1152,7 @@ def editar_motorista(motorista_id):
             if usuario_tipo == "admin":
                 motorista.setor = request.form.get("setor")
             db.session.commit()
+            autocompletar.indice.atualizar_motorista(motorista)
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("motoristas"))
@@ -564,7 +1168,10 @@ def excluir_motorista(motorista_id):
     motorista = Motorista.query.get_or_404(motorista_id)
     try:
         db.session.delete(motorista)
+        previsao.cache.marcar_tudo()
         db.session.commit()
+        cache_colunar.cache.remover_por('motorista', motorista_id)
+        autocompletar.indice.remover_motorista(motorista_id)
     except Exception as e:
         db.session.rollback()
     return redirect(url_for("motoristas"))
@@ -612,6 +1219,20 @@ def abastecimentos_view():
             veiculo = Veiculo.query.get(veiculo_id)
             if not veiculo:
                 return redirect(url_for("abastecimentos_view"))
+            chave = chave_nota(contrato_id, numero_nota)
+            if chave is None:
+                flash(f"Número de nota inválido: {numero_nota}.", "error")
+                return redirect(url_for("abastecimentos_view"))
+            existente = nota_registrada(chave)
+            aviso = None
+            if existente:
+                mensagem = (f"A nota {numero_nota} já foi lançada em {existente.data.strftime('%d/%m/%Y')} "
+                            f"(abastecimento #{existente.id}).")
+                if not chave.startswith(NOTA_SEM_FORNECEDOR):
+                    flash(mensagem, "error")
+                    return redirect(url_for("abastecimentos_view"))
+                # Sem contrato não se sabe o fornecedor: outro pode ter usado o mesmo número
+                aviso = mensagem + " Sem contrato não é possível saber se é do mesmo fornecedor; confira."
 
             novo_abastecimento = Abastecimento(
                 data=data,
@@ -623,10 +1244,19 @@ def abastecimentos_view():
                 numero_nota=numero_nota,
                 observacoes=observacoes,
                 combustivel=veiculo.combustivel,
-                contrato_id=contrato_id
+                contrato_id=contrato_id,
+                chave_nota=chave
             )
             db.session.add(novo_abastecimento)
+            db.session.flush()
+            eficiencia.recalcular_ids([novo_abastecimento.id])
+            anomalias.verificar_ids([novo_abastecimento.id])
+            previsao.cache.marcar_ids([novo_abastecimento.id])
             db.session.commit()
+            cache_colunar.cache.registrar(novo_abastecimento)
+            autocompletar.indice.vincular_ids([novo_abastecimento.id])
+            if aviso:
+                flash(aviso, "warning")
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("abastecimentos_view"))
@@ -636,29 +1266,27 @@ def abastecimentos_view():
     setores = []
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
-        setor_selecionado = request.form.get("setor") if request.method == "POST" else None
-        if setor_selecionado:
-            veiculos = Veiculo.query.filter(Veiculo.tipo == setor_selecionado).order_by(Veiculo.placa).all()
-        else:
-            veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    elif usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    # Motoristas e abastecimentos permanecem como antes
+    # Veículo e motorista são escolhidos por autocompletar; aqui só se há algum para escolher
+    veiculos = db.session.query(Veiculo.id)
+    motoristas = db.session.query(Motorista.id)
     if usuario_tipo != "admin" and usuario_setor:
-        motoristas = Motorista.query.join(Abastecimento).join(Veiculo).filter(Veiculo.tipo == usuario_setor).order_by(Motorista.nome_completo).distinct().all()
-        abastecimentos_lista = Abastecimento.query.join(Veiculo).filter(Veiculo.tipo == usuario_setor).order_by(Abastecimento.data.desc()).all()
+        veiculos = veiculos.filter(Veiculo.tipo == usuario_setor)
+        # Mesmo escopo do autocompletar: setor do cadastro ou de um veículo já abastecido
+        motoristas = motoristas.outerjoin(Abastecimento).outerjoin(Veiculo).filter(
+            or_(Motorista.setor == usuario_setor, Veiculo.tipo == usuario_setor)
+        )
+        consulta = consulta_abastecimentos().filter(Veiculo.tipo == usuario_setor)
     else:
-        motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
-        abastecimentos_lista = Abastecimento.query.order_by(Abastecimento.data.desc()).all()
+        consulta = consulta_abastecimentos()
+    # Sem a lista completa de motoristas na sessão, placa e nome vêm na mesma consulta
+    abastecimentos_lista = listar_abastecimentos(consulta.order_by(Abastecimento.data.desc()))
     contratos_ativos = ContratoCombustivel.query.filter_by(ativo=True).all()
 
     return render_template(
         "abastecimento.html",
         items=abastecimentos_lista,
-        vehicles=veiculos,
-        drivers=motoristas,
+        sem_veiculos=veiculos.first() is None,
+        sem_motoristas=motoristas.first() is None,
         contratos_ativos=contratos_ativos,
         setores=setores
     )
@@ -669,22 +1297,12 @@ def editar_abastecimento(abastecimento_id):
         return redirect(url_for("login"))
     abastecimento = Abastecimento.query.get_or_404(abastecimento_id)
     usuario_tipo = session.get("usuario_tipo")
-    usuario_setor = session.get("usuario_setor")
     setores = []
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
-        setor_selecionado = request.form.get("setor") if request.method == "POST" else (abastecimento.veiculo.tipo if abastecimento.veiculo else None)
-        if setor_selecionado:
-            veiculos = Veiculo.query.filter(Veiculo.tipo == setor_selecionado).order_by(Veiculo.placa).all()
-        else:
-            veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    elif usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
     if request.method == "POST":
         try:
+            posicao_anterior = (abastecimento.veiculo_id, abastecimento.data)
             abastecimento.data = datetime.fromisoformat(request.form["date"])
             abastecimento.veiculo_id = int(request.form["vehicle_id"])
             abastecimento.motorista_id = int(request.form["driver_id"])
@@ -693,11 +1311,158 @@ def editar_abastecimento(abastecimento_id):
             abastecimento.valor_total = float(request.form["total_value"])
             abastecimento.numero_nota = request.form["invoice_number"]
             abastecimento.observacoes = request.form["observations"]
+            # Sem contrato, mantém o emitente da NF-e que a importação gravou na chave
+            abastecimento.chave_nota = chave_nota(
+                abastecimento.contrato_id, abastecimento.numero_nota, emitente_chave_nota(abastecimento.chave_nota)
+            )
+            if abastecimento.chave_nota is None:
+                db.session.rollback()
+                flash(f"Número de nota inválido: {request.form['invoice_number']}.", "error")
+                return redirect(url_for("editar_abastecimento", abastecimento_id=abastecimento_id))
+            existente = nota_registrada(abastecimento.chave_nota, ignorar_id=abastecimento.id)
+            aviso = None
+            if existente:
+                mensagem = f"A nota {request.form['invoice_number']} já foi lançada no abastecimento #{existente.id}."
+                if not abastecimento.chave_nota.startswith(NOTA_SEM_FORNECEDOR):
+                    db.session.rollback()
+                    flash(mensagem, "error")
+                    return redirect(url_for("editar_abastecimento", abastecimento_id=abastecimento_id))
+                aviso = mensagem + " Sem contrato não é possível saber se é do mesmo fornecedor; confira."
+            # Vizinho seguinte da posição antiga e da nova (o veículo ou a data podem ter mudado)
+            eficiencia.recalcular_posicao(*posicao_anterior)
+            eficiencia.recalcular_ids([abastecimento.id])
+            anomalias.verificar_seguinte(*posicao_anterior, abastecimento.id)
+            anomalias.verificar_ids([abastecimento.id])
+            previsao.cache.marcar_veiculo(posicao_anterior[0], abastecimento.contrato_id)
+            previsao.cache.marcar_ids([abastecimento.id])
             db.session.commit()
+            cache_colunar.cache.registrar(abastecimento)
+            autocompletar.indice.vincular_ids([abastecimento.id])
+            if aviso:
+                flash(aviso, "warning")
         except Exception as e:
             db.session.rollback()
         return redirect(url_for("abastecimentos_view"))
-    return render_template("editar_abastecimento.html", abastecimento=abastecimento, vehicles=veiculos, drivers=motoristas, setores=setores)
+    return render_template("editar_abastecimento.html", abastecimento=abastecimento, setores=setores)
+
+@app.route("/abastecimentos/importar", methods=["GET", "POST"])
+def importar_abastecimentos():
+    """Importa abastecimentos de uma planilha CSV/XLSX, com relatório de erros por linha."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    resultado = None
+    erro_arquivo = None
+    if request.method == "POST":
+        arquivo = request.files.get("arquivo")
+        if not arquivo or not arquivo.filename:
+            erro_arquivo = "Selecione um arquivo CSV ou XLSX."
+        else:
+            # Usuários de setor só importam abastecimentos dos veículos do próprio setor
+            setor = None if session.get("usuario_tipo") == "admin" else session.get("usuario_setor")
+            try:
+                linhas = ler_planilha(arquivo.read(), arquivo.filename)
+                resultado = ImportadorAbastecimentos(setor).importar(linhas)
+            except Exception as e:
+                db.session.rollback()
+                erro_arquivo = f"Não foi possível importar a planilha: {e}"
+            if resultado:
+                # Numa interrupção, os blocos anteriores à falha já estão gravados
+                cache_colunar.cache.registrar_ids(resultado.ids)
+                autocompletar.indice.vincular_ids(resultado.ids)
+                if resultado.falha and not resultado.importados:
+                    erro_arquivo = f"Não foi possível importar a planilha: {resultado.falha}"
+                    resultado = None
+    return render_template(
+        "importar_abastecimentos.html",
+        resultado=resultado,
+        erro_arquivo=erro_arquivo,
+        relatorio_erros=relatorio_erros_csv(resultado.erros) if resultado and resultado.erros else None
+    )
+
+@app.cli.command('importar-abastecimentos')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--setor', default=None, help='Aceita apenas veículos deste setor.')
+@click.option('--erros', 'arquivo_erros', type=click.Path(dir_okay=False), help='Grava o relatório de erros (CSV) neste arquivo.')
+def importar_abastecimentos_comando(arquivo, setor, arquivo_erros):
+    """Importa abastecimentos de uma planilha CSV/XLSX."""
+    with open(arquivo, 'rb') as entrada:
+        conteudo = entrada.read()
+    resultado = ImportadorAbastecimentos(setor).importar(ler_planilha(conteudo, arquivo))
+    cache_colunar.cache.registrar_ids(resultado.ids)
+    autocompletar.indice.vincular_ids(resultado.ids)
+    click.echo(f"{resultado.importados} abastecimentos importados, {len(resultado.erros)} linhas com erro.")
+    if arquivo_erros and resultado.erros:
+        with open(arquivo_erros, 'w', encoding='utf-8-sig', newline='') as saida:
+            saida.write(relatorio_erros_csv(resultado.erros))
+    else:
+        for linha, mensagem in resultado.erros[:50]:
+            click.echo(f"  linha {linha}: {mensagem}")
+    if resultado.falha:
+        click.echo(f"Importação interrompida (as linhas seguintes não foram gravadas): {resultado.falha}", err=True)
+        raise click.exceptions.Exit(1)
+
+@app.route("/abastecimentos/importar-nfe", methods=["POST"])
+def importar_nfe():
+    """Importa abastecimentos de NF-e de combustível (XMLs avulsos ou um ZIP)."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    resultado = None
+    erro_arquivo = None
+    origens = []
+    try:
+        for arquivo in request.files.getlist("arquivos_nfe"):
+            if not arquivo or not arquivo.filename:
+                continue
+            if arquivo.filename.lower().endswith('.zip'):
+                origens.extend(nfe.origens_zip(arquivo.read()))
+            else:
+                origens.append((arquivo.filename, arquivo.read()))
+    except Exception as e:
+        erro_arquivo = f"Não foi possível abrir o arquivo: {e}"
+    if not origens and not erro_arquivo:
+        erro_arquivo = "Selecione os XMLs das notas ou um arquivo ZIP."
+    if origens:
+        setor = None if session.get("usuario_tipo") == "admin" else session.get("usuario_setor")
+        try:
+            resultado = ImportadorNFe(setor).importar(nfe.ler_lote(origens))
+        except Exception as e:
+            db.session.rollback()
+            erro_arquivo = f"Não foi possível importar as notas: {e}"
+        if resultado:
+            cache_colunar.cache.registrar_ids(resultado.ids)
+            autocompletar.indice.vincular_ids(resultado.ids)
+            if resultado.falha and not resultado.importados:
+                erro_arquivo = f"Não foi possível importar as notas: {resultado.falha}"
+                resultado = None
+    return render_template(
+        "importar_abastecimentos.html",
+        resultado=resultado,
+        erro_nfe=erro_arquivo,
+        origem_erros="Arquivo",
+        relatorio_erros=relatorio_erros_csv(resultado.erros, "Arquivo") if resultado and resultado.erros else None
+    )
+
+@app.cli.command('importar-nfe')
+@click.argument('caminho', type=click.Path(exists=True))
+@click.option('--setor', default=None, help='Aceita apenas veículos deste setor.')
+@click.option('--processos', type=int, default=None, help='Processos de leitura dos XMLs (padrão: núcleos da máquina).')
+@click.option('--erros', 'arquivo_erros', type=click.Path(dir_okay=False), help='Grava o relatório de erros (CSV) neste arquivo.')
+def importar_nfe_comando(caminho, setor, processos, arquivo_erros):
+    """Importa abastecimentos das NF-e de uma pasta ou de um ZIP."""
+    origens = nfe.listar_origens(caminho)
+    resultado = ImportadorNFe(setor).importar(nfe.ler_lote(origens, processos))
+    cache_colunar.cache.registrar_ids(resultado.ids)
+    autocompletar.indice.vincular_ids(resultado.ids)
+    click.echo(f"{resultado.importados} de {len(origens)} notas importadas, {len(resultado.erros)} com erro.")
+    if arquivo_erros and resultado.erros:
+        with open(arquivo_erros, 'w', encoding='utf-8-sig', newline='') as saida:
+            saida.write(relatorio_erros_csv(resultado.erros, "Arquivo"))
+    else:
+        for nome, mensagem in resultado.erros[:50]:
+            click.echo(f"  {nome}: {mensagem}")
+    if resultado.falha:
+        click.echo(f"Importação interrompida (as notas seguintes não foram gravadas): {resultado.falha}", err=True)
+        raise click.exceptions.Exit(1)
 
 @app.route("/abastecimentos/<int:abastecimento_id>/excluir", methods=["POST"])
 def excluir_abastecimento(abastecimento_id):
@@ -705,12 +1470,94 @@ def excluir_abastecimento(abastecimento_id):
         return redirect(url_for("login"))
     abastecimento = Abastecimento.query.get_or_404(abastecimento_id)
     try:
+        posicao = (abastecimento.veiculo_id, abastecimento.data)
+        previsao.cache.marcar_ids([abastecimento_id])
         db.session.delete(abastecimento)
+        eficiencia.remover(abastecimento_id, *posicao)
+        anomalias.remover(abastecimento_id, *posicao)
         db.session.commit()
+        cache_colunar.cache.remover(abastecimento_id)
     except Exception as e:
         db.session.rollback()
     return redirect(url_for("abastecimentos_view"))
 
+# ----------------------
+# API DE LOTES DE ABASTECIMENTOS (integração com terminais de cartão combustível)
+# ----------------------
+def usuario_api():
+    """(id, tipo, setor) do usuário da sessão ou do HTTP Basic (e-mail e senha cadastrados), ou None."""
+    if "usuario" in session:
+        return session["usuario_id"], session.get("usuario_tipo"), session.get("usuario_setor")
+    credenciais = request.authorization
+    if credenciais and credenciais.type == "basic":
+        user = User.query.filter_by(email=(credenciais.username or "").strip().lower()).first()
+        if user and check_password_hash(user.senha_hash, credenciais.password or ""):
+            return user.id, user.tipo, user.setor
+    return None
+
+def lote_repetido(anterior, hash_conteudo):
+    if anterior.hash_conteudo != hash_conteudo:
+        return jsonify(erro="chave de idempotência já usada em um lote com outro conteúdo"), 409
+    return app.response_class(anterior.resposta, status=201, mimetype="application/json",
+                              headers={"Idempotent-Replayed": "true"})
+
+@app.route("/api/abastecimentos/lote", methods=["POST"])
+def api_abastecimentos_lote():
+    """Grava uma lista JSON de abastecimentos numa única transação: todos ou nenhum.
+
+    Os campos de cada item são os da importação de planilhas (data, placa, documento,
+    hodometro, litros, valor_total, numero_nota, observacoes, contrato). O cabeçalho
+    Idempotency-Key permite reenviar um lote sem duplicá-lo.
+    """
+    usuario = usuario_api()
+    if usuario is None:
+        return jsonify(erro="autenticação necessária"), 401, {"WWW-Authenticate": 'Basic realm="gestao-combustivel"'}
+    usuario_id, usuario_tipo, usuario_setor = usuario
+    dados = request.get_json(silent=True)
+    itens = dados.get("abastecimentos") if isinstance(dados, dict) else dados
+    if not isinstance(itens, list) or not itens:
+        return jsonify(erro='envie uma lista de abastecimentos ou {"abastecimentos": [...]}'), 400
+    if len(itens) > app.config['API_LOTE_MAXIMO']:
+        return jsonify(erro=f"no máximo {app.config['API_LOTE_MAXIMO']} abastecimentos por lote"), 413
+
+    chave = (request.headers.get("Idempotency-Key") or "").strip()[:100] or None
+    hash_conteudo = hashlib.sha256(request.get_data()).hexdigest()
+    if chave:
+        anterior = db.session.get(LoteApi, (usuario_id, chave))
+        if anterior:
+            return lote_repetido(anterior, hash_conteudo)
+
+    setor = None if usuario_tipo == "admin" else usuario_setor
+    try:
+        ids, erros = ImportadorAbastecimentos(setor).gravar_tudo_ou_nada(itens)
+        if erros:
+            db.session.rollback()
+            return jsonify(importados=0, erros=[{"indice": indice, "erro": mensagem} for indice, mensagem in erros]), 422
+        eficiencia.recalcular_ids(ids)
+        anomalias.verificar_ids(ids)
+        previsao.cache.marcar_ids(ids)
+        resposta = {"importados": len(ids), "itens": [{"indice": indice, "id": id_} for indice, id_ in enumerate(ids)]}
+        if chave:
+            # Na mesma transação dos abastecimentos: ou os dois ficam gravados, ou nenhum
+            resposta["lote"] = chave
+            db.session.add(LoteApi(usuario_id=usuario_id, chave=chave, hash_conteudo=hash_conteudo,
+                                   resposta=json.dumps(resposta)))
+        db.session.commit()
+    except IntegrityError:
+        # O mesmo lote foi reenviado em paralelo e a outra requisição gravou primeiro
+        db.session.rollback()
+        anterior = db.session.get(LoteApi, (usuario_id, chave)) if chave else None
+        if anterior is None:
+            return jsonify(erro="não foi possível gravar o lote"), 500
+        return lote_repetido(anterior, hash_conteudo)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(erro=f"não foi possível gravar o lote: {e}"), 500
+    # Cache colunar (e o delta do snapshot) atualizado uma vez para o lote inteiro
+    cache_colunar.cache.registrar_ids(ids)
+    autocompletar.indice.vincular_ids(ids)
+    return jsonify(resposta), 201
+
 # ----------------------
 # ROTAS PARA CONTRATOS DE COMBUSTÍVEL
 # ----------------------
@@ -760,6 +1607,7 @@ def contratos_combustivel():
                 )
                 db.session.add(item)
 
+            recalcular_contrato_efetivo(novo_contrato)
             db.session.commit()
             flash("Contrato de combustível cadastrado com sucesso!", "success")
         except Exception as e:
@@ -775,81 +1623,28 @@ def contratos_combustivel():
     usuario_tipo = session.get("usuario_tipo")
     usuario_setor = session.get("usuario_setor")
     setor_filtro = request.args.get('setor')
-    query = ContratoCombustivel.query.filter_by(ativo=True)
+    setor_abastecimentos = None
     if usuario_tipo != "admin" and usuario_setor:
-        query = query.filter(ContratoCombustivel.setor == usuario_setor)
+        setor_abastecimentos = usuario_setor
+        relatorio = calcular_dados_relatorio_contratos(usuario_setor, usuario_setor, mais_recentes_primeiro=True)
     elif usuario_tipo == "admin" and setor_filtro:
-        query = query.filter(ContratoCombustivel.setor == setor_filtro)
-    contratos = query.order_by(desc(ContratoCombustivel.data_criacao)).all()
-    dados_relatorio = []
-    total_contratos_ativos = len(contratos)
-    total_valor_contratado = 0
-    total_valor_consumido = 0
-    total_valor_restante = 0
-    
-    for contrato in contratos:
-        for item in contrato.itens:
-            quantidade_contratada = item.quantidade
-            valor_total_contratado = item.valor_total
-            
-            inicio_contrato = datetime.combine(contrato.data_inicio_contrato, datetime.min.time())
-            fim_contrato = datetime.combine(contrato.data_fim_contrato, datetime.max.time())
-            
-            # Filtro de setor para abastecimentos
-            if usuario_tipo != "admin" and usuario_setor:
-                abastecimentos_tipo = Abastecimento.query.join(Veiculo).filter(
-                    Veiculo.combustivel == item.tipo_combustivel,
-                    Veiculo.tipo == usuario_setor,
-                    Abastecimento.data >= inicio_contrato,
-                    Abastecimento.data <= fim_contrato
-                ).all()
-                abastecimentos_contrato = Abastecimento.query.join(Veiculo).filter(
-                    Abastecimento.contrato_id == contrato.id,
-                    Veiculo.tipo == usuario_setor,
-                    Abastecimento.data >= inicio_contrato,
-                    Abastecimento.data <= fim_contrato
-                ).all()
-            else:
-                abastecimentos_tipo = Abastecimento.query.join(Veiculo).filter(
-                    Veiculo.combustivel == item.tipo_combustivel,
-                    Abastecimento.data >= inicio_contrato,
-                    Abastecimento.data <= fim_contrato
-                ).all()
-                abastecimentos_contrato = Abastecimento.query.filter(
-                    Abastecimento.contrato_id == contrato.id,
-                    Abastecimento.data >= inicio_contrato,
-                    Abastecimento.data <= fim_contrato
-                ).all()
-            todos_abastecimentos = list(set(abastecimentos_tipo + abastecimentos_contrato))
-            quantidade_consumida = sum(a.litros for a in todos_abastecimentos)
-            valor_usado = sum(a.valor_total for a in todos_abastecimentos)
-            
-            quantidade_restante = max(0, quantidade_contratada - quantidade_consumida)
-            valor_restante = max(0, valor_total_contratado - valor_usado)
-            
-            percentual_consumido = (quantidade_consumida / quantidade_contratada * 100) if quantidade_contratada > 0 else 0
-            
-            dados_relatorio.append({
-                'tipo_combustivel': item.tipo_combustivel,
-                'fornecedor': contrato.fornecedor,
-                'numero_contrato': contrato.numero_contrato,
-                'ano_contrato': contrato.ano_contrato,
-                'data_inicio_contrato': contrato.data_inicio_contrato,
-                'data_fim_contrato': contrato.data_fim_contrato,
-                'quantidade_contratada': quantidade_contratada,
-                'valor_total': valor_total_contratado,
-                'valor_por_litro': item.valor_por_litro,
-                'quantidade_consumida': quantidade_consumida,
-                'valor_usado': valor_usado,
-                'quantidade_restante': quantidade_restante,
-                'valor_restante': valor_restante,
-                'percentual_consumido': percentual_consumido
-            })
-            
-            total_valor_contratado += valor_total_contratado
-            total_valor_consumido += valor_usado
-            total_valor_restante += valor_restante
-    
+        relatorio = calcular_dados_relatorio_contratos(setor_filtro, mais_recentes_primeiro=True)
+    else:
+        relatorio = calcular_dados_relatorio_contratos(mais_recentes_primeiro=True)
+    # Itens que, no ritmo recente, esgotam antes do fim do contrato (o mais próximo primeiro)
+    previsoes = previsoes_contratos(relatorio['efetivos'], setor_abastecimentos)
+    itens_em_risco = sorted(
+        ({**linha, **previsoes[linha['item_id']]} for linha in relatorio['dados_relatorio']
+         if previsoes[linha['item_id']]['em_risco']),
+        key=lambda linha: linha['data_esgotamento']
+    )
+    contratos = relatorio['contratos']
+    dados_relatorio = relatorio['dados_relatorio']
+    total_contratos_ativos = relatorio['total_contratos_ativos']
+    total_valor_contratado = relatorio['total_valor_contratado']
+    total_valor_consumido = relatorio['total_valor_consumido']
+    total_valor_restante = relatorio['total_valor_restante']
+
     hoje = date.today()
     agora = datetime.now()  # Definido aqui para uso no template
     
@@ -863,6 +1658,8 @@ def contratos_combustivel():
         total_valor_contratado=total_valor_contratado,
         total_valor_consumido=total_valor_consumido,
         total_valor_restante=total_valor_restante,
+        itens_em_risco=itens_em_risco,
+        janela_previsao=previsao.JANELA_DIAS,
         items=contratos,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         hoje=hoje,
@@ -907,6 +1704,7 @@ def editar_contrato_combustivel(contrato_id):
                 )
                 contrato.itens.append(item)
 
+            recalcular_contrato_efetivo(contrato)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -926,6 +1724,8 @@ def excluir_contrato_combustivel(contrato_id):
     contrato = ContratoCombustivel.query.get_or_404(contrato_id)
     try:
         contrato.ativo = False
+        # Contratos inativos deixam de concorrer pelos abastecimentos na conciliação de preços
+        previsao.cache.marcar_contrato(contrato.id)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -980,6 +1780,7 @@ def novo_aditivo(contrato_id):
             nova_data_fim=datetime.strptime(nova_data_fim, "%Y-%m-%d") if nova_data_fim else None
         )
         db.session.add(aditivo)
+        recalcular_contrato_efetivo(contrato)
         db.session.commit()
         flash("Aditivo cadastrado com sucesso!", "success")
         return redirect(url_for("listar_aditivos", contrato_id=contrato_id))
@@ -1023,6 +1824,7 @@ def editar_aditivo(contrato_id, aditivo_id):
         dias_adicionais = request.form.get("dias_adicionais")
         aditivo.dias_adicionais = int(dias_adicionais) if dias_adicionais else None
 
+        recalcular_contrato_efetivo(contrato)
         db.session.commit()
         flash("Aditivo atualizado com sucesso!", "success")
         return redirect(url_for("listar_aditivos", contrato_id=contrato_id))
@@ -1036,7 +1838,9 @@ def excluir_aditivo(contrato_id, aditivo_id):
     if "usuario" not in session:
         return redirect(url_for("login"))
     aditivo = AditivoContratoCombustivel.query.get_or_404(aditivo_id)
+    contrato = aditivo.contrato
     db.session.delete(aditivo)
+    recalcular_contrato_efetivo(contrato)
     db.session.commit()
     flash("Aditivo excluído com sucesso!", "success")
     return redirect(url_for("listar_aditivos", contrato_id=contrato_id))
@@ -1170,46 +1974,7 @@ def relatorio_veiculos():
             veiculo_id = ""
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-    # Calcular dados para o relatório
-    dados_veiculos = {}
-    for abastecimento in abastecimentos:
-        veiculo = abastecimento.veiculo
-        motorista = abastecimento.motorista
-        if veiculo not in dados_veiculos:
-            dados_veiculos[veiculo] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'motoristas_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        dados_veiculos[veiculo]['total_litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['total_valor'] += abastecimento.valor_total
-        dados_veiculos[veiculo]['total_abastecimentos'] += 1
-        dados_veiculos[veiculo]['abastecimentos'].append(abastecimento)
-        if motorista not in dados_veiculos[veiculo]['motoristas_mais_utilizados']:
-            dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista] = {
-                'litros': 0,
-                'valor': 0
-            }
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['valor'] += abastecimento.valor_total
-    # Calcular média e preparar dados para gráfico
-    for veiculo, dados in dados_veiculos.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        motoristas_ordenados = sorted(
-            dados['motoristas_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['motoristas_mais_utilizados'] = dict(motoristas_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-    dados_veiculos = {k: v for k, v in dados_veiculos.items() if v['total_abastecimentos'] > 0}
+    dados_veiculos = calcular_dados_veiculos(query)
     filtros_aplicados = {}
     if data_inicio:
         filtros_aplicados['data_inicio'] = datetime.fromisoformat(data_inicio).strftime('%d/%m/%Y')
@@ -1225,15 +1990,10 @@ def relatorio_veiculos():
     setores = []
     if session.get("usuario_tipo") == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
-    if usuario_tipo != "admin" and usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
     agora = datetime.now()
     return render_template(
         "relatorio_veiculos.html",
         dados_veiculos=dados_veiculos,
-        veiculos=veiculos,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         setores=setores,
@@ -1288,55 +2048,7 @@ def export_csv_relatorio_veiculos():
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
     
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-    
-    # Calcular dados para o relatório
-    dados_veiculos = {}
-    for abastecimento in abastecimentos:
-        veiculo = abastecimento.veiculo
-        motorista = abastecimento.motorista
-        
-        if veiculo not in dados_veiculos:
-            dados_veiculos[veiculo] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'motoristas_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        
-        dados_veiculos[veiculo]['total_litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['total_valor'] += abastecimento.valor_total
-        dados_veiculos[veiculo]['total_abastecimentos'] += 1
-        dados_veiculos[veiculo]['abastecimentos'].append(abastecimento)
-        
-        if motorista not in dados_veiculos[veiculo]['motoristas_mais_utilizados']:
-            dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista] = {
-                'litros': 0,
-                'valor': 0
-            }
-        
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['valor'] += abastecimento.valor_total
-    
-    # Calcular médias e preparar dados
-    for veiculo, dados in dados_veiculos.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        
-        motoristas_ordenados = sorted(
-            dados['motoristas_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['motoristas_mais_utilizados'] = dict(motoristas_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-    
-    # Filtrar apenas veículos com abastecimentos
-    dados_veiculos = {k: v for k, v in dados_veiculos.items() if v['total_abastecimentos'] > 0}
+    dados_veiculos = calcular_dados_veiculos(query)
     
     # Criar CSV profissional
     output = io.StringIO()
@@ -1485,46 +2197,7 @@ def export_pdf_relatorio_veiculos():
             veiculo_id = ""
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-    # Calcular dados para o relatório
-    dados_veiculos = {}
-    for abastecimento in abastecimentos:
-        veiculo = abastecimento.veiculo
-        motorista = abastecimento.motorista
-        if veiculo not in dados_veiculos:
-            dados_veiculos[veiculo] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'motoristas_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        dados_veiculos[veiculo]['total_litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['total_valor'] += abastecimento.valor_total
-        dados_veiculos[veiculo]['total_abastecimentos'] += 1
-        dados_veiculos[veiculo]['abastecimentos'].append(abastecimento)
-        if motorista not in dados_veiculos[veiculo]['motoristas_mais_utilizados']:
-            dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista] = {
-                'litros': 0,
-                'valor': 0
-            }
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['valor'] += abastecimento.valor_total
-    # Calcular média e preparar dados para gráfico
-    for veiculo, dados in dados_veiculos.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        motoristas_ordenados = sorted(
-            dados['motoristas_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['motoristas_mais_utilizados'] = dict(motoristas_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-    dados_veiculos = {k: v for k, v in dados_veiculos.items() if v['total_abastecimentos'] > 0}
+    dados_veiculos = calcular_dados_veiculos(query)
     filtros_aplicados = {}
     if data_inicio:
         filtros_aplicados['data_inicio'] = datetime.fromisoformat(data_inicio).strftime('%d/%m/%Y')
@@ -1540,22 +2213,17 @@ def export_pdf_relatorio_veiculos():
     setores = []
     if session.get("usuario_tipo") == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
-    if usuario_tipo != "admin" and usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
     agora = datetime.now()
     html = render_template(
         "relatorio_veiculos_print.html",
         dados_veiculos=dados_veiculos,
-        veiculos=veiculos,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         setores=setores,
         agora=agora,
         total_registros=len(dados_veiculos)
     )
-    pdf = HTML(string=html).write_pdf()
+    pdf = gerar_pdf(html)
     return Response(pdf, mimetype='application/pdf', headers={"Content-Disposition": "attachment;filename=relatorio_veiculos.pdf"})
 
 @app.route("/relatorios/veiculos/visualizar", endpoint="visualizar_relatorio_veiculos")
@@ -1596,49 +2264,7 @@ def visualizar_relatorio_veiculos():
             pass
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
-    abastecimentos = query.order_by(Abastecimento.data.desc()).all()
-    dados_veiculos = {}
-    for abastecimento in abastecimentos:
-        veiculo = abastecimento.veiculo
-        motorista = abastecimento.motorista
-        if veiculo not in dados_veiculos:
-            dados_veiculos[veiculo] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'motoristas_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        dados_veiculos[veiculo]['total_litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['total_valor'] += abastecimento.valor_total
-        dados_veiculos[veiculo]['total_abastecimentos'] += 1
-        dados_veiculos[veiculo]['abastecimentos'].append(abastecimento)
-        if motorista not in dados_veiculos[veiculo]['motoristas_mais_utilizados']:
-            dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista] = {
-                'litros': 0,
-                'valor': 0
-            }
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['litros'] += abastecimento.litros
-        dados_veiculos[veiculo]['motoristas_mais_utilizados'][motorista]['valor'] += abastecimento.valor_total
-    # Calcular média e preparar dados para gráfico
-    for veiculo, dados in dados_veiculos.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        motoristas_ordenados = sorted(
-            dados['motoristas_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['motoristas_mais_utilizados'] = dict(motoristas_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-    dados_veiculos = {k: v for k, v in dados_veiculos.items() if v['total_abastecimentos'] > 0}
-    if usuario_tipo != "admin" and usuario_setor:
-        veiculos = Veiculo.query.filter(Veiculo.tipo == usuario_setor).order_by(Veiculo.placa).all()
-    else:
-        veiculos = Veiculo.query.order_by(Veiculo.placa).all()
+    dados_veiculos = calcular_dados_veiculos(query)
     filtros_aplicados = {}
     if data_inicio:
         filtros_aplicados['data_inicio'] = datetime.fromisoformat(data_inicio).strftime('%d/%m/%Y')
@@ -1653,7 +2279,6 @@ def visualizar_relatorio_veiculos():
     return render_template(
         "relatorio_veiculos_print.html",
         dados_veiculos=dados_veiculos,
-        veiculos=veiculos,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         agora=agora,
@@ -1704,51 +2329,7 @@ def relatorio_motoristas():
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
 
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-
-    # Calcular dados para o relatório
-    dados_motoristas = {}
-    for abastecimento in abastecimentos:
-        motorista = abastecimento.motorista
-        veiculo = abastecimento.veiculo
-        if not motorista or not veiculo:
-            continue
-        if motorista not in dados_motoristas:
-            dados_motoristas[motorista] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'veiculos_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        dados_motoristas[motorista]['total_litros'] += abastecimento.litros
-        dados_motoristas[motorista]['total_valor'] += abastecimento.valor_total
-        dados_motoristas[motorista]['total_abastecimentos'] += 1
-        dados_motoristas[motorista]['abastecimentos'].append(abastecimento)
-        if veiculo not in dados_motoristas[motorista]['veiculos_mais_utilizados']:
-            dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo] = {
-                'litros': 0,
-                'valor': 0
-            }
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['litros'] += abastecimento.litros
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['valor'] += abastecimento.valor_total
-
-    # Calcular média e preparar dados para gráfico
-    for motorista, dados in dados_motoristas.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        veiculos_ordenados = sorted(
-            dados['veiculos_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['veiculos_mais_utilizados'] = dict(veiculos_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-
-    dados_motoristas = {k: v for k, v in dados_motoristas.items() if v['total_abastecimentos'] > 0}
+    dados_motoristas = calcular_dados_motoristas(query)
 
     # Filtros aplicados para badges
     filtros_aplicados = {}
@@ -1774,12 +2355,10 @@ def relatorio_motoristas():
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
 
-    motoristas_lista = Motorista.query.order_by(Motorista.nome_completo).all()
     agora = datetime.now()
     return render_template(
         "relatorio_motoristas.html",
         dados_motoristas=dados_motoristas,
-        motoristas=motoristas_lista,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         setores=setores,
@@ -1833,54 +2412,7 @@ def export_csv_relatorio_motoristas():
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
 
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-
-    # Calcular dados para o relatório
-    dados_motoristas = {}
-    for abastecimento in abastecimentos:
-        motorista = abastecimento.motorista
-        veiculo = abastecimento.veiculo
-        
-        if motorista not in dados_motoristas:
-            dados_motoristas[motorista] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'veiculos_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        
-        dados_motoristas[motorista]['total_litros'] += abastecimento.litros
-        dados_motoristas[motorista]['total_valor'] += abastecimento.valor_total
-        dados_motoristas[motorista]['total_abastecimentos'] += 1
-        dados_motoristas[motorista]['abastecimentos'].append(abastecimento)
-        
-        if veiculo not in dados_motoristas[motorista]['veiculos_mais_utilizados']:
-            dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo] = {
-                'litros': 0,
-                'valor': 0
-            }
-        
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['litros'] += abastecimento.litros
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['valor'] += abastecimento.valor_total
-
-    # Calcular média e preparar dados
-    for motorista, dados in dados_motoristas.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        
-        veiculos_ordenados = sorted(
-            dados['veiculos_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['veiculos_mais_utilizados'] = dict(veiculos_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-
-    dados_motoristas = {k: v for k, v in dados_motoristas.items() if v['total_abastecimentos'] > 0}
+    dados_motoristas = calcular_dados_motoristas(query)
 
     # Criar CSV profissional
     output = io.StringIO()
@@ -2082,49 +2614,7 @@ def export_pdf_relatorio_motoristas():
     if combustivel:
         query = query.filter(Veiculo.combustivel == combustivel)
 
-    abastecimentos = query.order_by(desc(Abastecimento.data)).all()
-
-    # Calcular dados para o relatório
-    dados_motoristas = {}
-    for abastecimento in abastecimentos:
-        motorista = abastecimento.motorista
-        veiculo = abastecimento.veiculo
-        if motorista not in dados_motoristas:
-            dados_motoristas[motorista] = {
-                'total_litros': 0,
-                'total_valor': 0,
-                'total_abastecimentos': 0,
-                'media_litros': 0,
-                'veiculos_mais_utilizados': {},
-                'abastecimentos': []
-            }
-        dados_motoristas[motorista]['total_litros'] += abastecimento.litros
-        dados_motoristas[motorista]['total_valor'] += abastecimento.valor_total
-        dados_motoristas[motorista]['total_abastecimentos'] += 1
-        dados_motoristas[motorista]['abastecimentos'].append(abastecimento)
-        if veiculo not in dados_motoristas[motorista]['veiculos_mais_utilizados']:
-            dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo] = {
-                'litros': 0,
-                'valor': 0
-            }
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['litros'] += abastecimento.litros
-        dados_motoristas[motorista]['veiculos_mais_utilizados'][veiculo]['valor'] += abastecimento.valor_total
-
-    # Calcular média e preparar dados para gráfico
-    for motorista, dados in dados_motoristas.items():
-        if dados['total_abastecimentos'] > 0:
-            dados['media_litros'] = dados['total_litros'] / dados['total_abastecimentos']
-        else:
-            dados['media_litros'] = 0
-        veiculos_ordenados = sorted(
-            dados['veiculos_mais_utilizados'].items(),
-            key=lambda x: x[1]['litros'],
-            reverse=True
-        )[:5]
-        dados['veiculos_mais_utilizados'] = dict(veiculos_ordenados)
-        dados['abastecimentos'] = dados['abastecimentos'][:5]
-
-    dados_motoristas = {k: v for k, v in dados_motoristas.items() if v['total_abastecimentos'] > 0}
+    dados_motoristas = calcular_dados_motoristas(query)
 
     # Filtros aplicados para badges
     filtros_aplicados = {}
@@ -2150,19 +2640,17 @@ def export_pdf_relatorio_motoristas():
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
 
-    motoristas_lista = Motorista.query.order_by(Motorista.nome_completo).all()
     agora = datetime.now()
     html = render_template(
         "relatorio_motoristas_print.html",
         dados_motoristas=dados_motoristas,
-        motoristas=motoristas_lista,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         setores=setores,
         agora=agora,
         total_registros=len(dados_motoristas)
     )
-    pdf = HTML(string=html).write_pdf()
+    pdf = gerar_pdf(html)
     return Response(pdf, mimetype='application/pdf', headers={"Content-Disposition": "attachment;filename=relatorio_motoristas.pdf"})
 
 @app.route("/relatorios/motoristas/visualizar", endpoint="visualizar_relatorio_motoristas")
@@ -2242,14 +2730,13 @@ def relatorio_abastecimentos():
         except Exception:
             pass
 
-    abastecimentos = query.order_by(Abastecimento.data.desc()).all()
+    abastecimentos = listar_abastecimentos(query.order_by(Abastecimento.data.desc()))
     total_litros = sum(a.litros for a in abastecimentos) if abastecimentos else 0
     valor_total = sum(a.valor_total for a in abastecimentos) if abastecimentos else 0
     media_litros = total_litros / len(abastecimentos) if abastecimentos else 0
 
-    # Listas para selects
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
+    # Veículo e motorista escolhidos (os filtros buscam os demais por autocompletar)
+    veiculo_selecionado, motorista_selecionado = selecionados_autocompletar(veiculo_id, motorista_id)
     setores = []
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
@@ -2269,11 +2756,9 @@ def relatorio_abastecimentos():
         except Exception:
             filtros_aplicados["data_fim"] = data_fim
     if veiculo_id:
-        veiculo = Veiculo.query.get(veiculo_id)
-        filtros_aplicados["veiculo_id"] = veiculo.placa if veiculo else veiculo_id
+        filtros_aplicados["veiculo_id"] = veiculo_selecionado.placa if veiculo_selecionado else veiculo_id
     if motorista_id:
-        motorista = Motorista.query.get(motorista_id)
-        filtros_aplicados["motorista_id"] = motorista.nome_completo if motorista else motorista_id
+        filtros_aplicados["motorista_id"] = motorista_selecionado.nome_completo if motorista_selecionado else motorista_id
     if combustivel:
         filtros_aplicados["combustivel"] = combustivel
     if min_litros:
@@ -2286,8 +2771,8 @@ def relatorio_abastecimentos():
     return render_template(
         "relatorio_abastecimentos.html",
         dados=abastecimentos,
-        veiculos=veiculos,
-        motoristas=motoristas,
+        veiculo_selecionado=veiculo_selecionado,
+        motorista_selecionado=motorista_selecionado,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         total_registros=len(abastecimentos),
@@ -2362,7 +2847,7 @@ def relatorio_abastecimentos_csv():
         except Exception:
             pass
 
-    abastecimentos = query.order_by(Abastecimento.data.desc()).all()
+    abastecimentos = listar_abastecimentos(query.order_by(Abastecimento.data.desc()))
 
     # Criar CSV profissional
     output = io.StringIO()
@@ -2442,12 +2927,8 @@ def relatorio_abastecimentos_csv():
         total_litros += abastecimento.litros
         total_valor += abastecimento.valor_total
         
-        # Obter informações do contrato se existir
-        contrato_info = ""
-        if abastecimento.contrato_id:
-            contrato = ContratoCombustivel.query.get(abastecimento.contrato_id)
-            if contrato:
-                contrato_info = f"{contrato.numero_contrato}/{contrato.ano_contrato}"
+        # Contrato já vem projetado na mesma consulta
+        contrato_info = abastecimento.contrato_descricao
         
         writer.writerow([
             abastecimento.data.strftime('%d/%m/%Y'),
@@ -2582,44 +3063,9 @@ def relatorio_abastecimentos_csv():
 def relatorio_contratos():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    contratos = ContratoCombustivel.query.filter_by(ativo=True).order_by(ContratoCombustivel.data_inicio_contrato).all()
-    dados_relatorio = []
-    for contrato in contratos:
-        for item in contrato.itens:
-            inicio_contrato = datetime.combine(contrato.data_inicio_contrato, datetime.min.time())
-            fim_contrato = datetime.combine(contrato.data_fim_contrato, datetime.max.time())
-            abastecimentos_tipo = Abastecimento.query.join(Veiculo).filter(
-                Veiculo.combustivel == item.tipo_combustivel,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
-            abastecimentos_contrato = Abastecimento.query.filter(
-                Abastecimento.contrato_id == contrato.id,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
-            todos_abastecimentos = list(set(abastecimentos_tipo + abastecimentos_contrato))
-            quantidade_consumida = sum(a.litros for a in todos_abastecimentos)
-            valor_usado = sum(a.valor_total for a in todos_abastecimentos)
-            quantidade_restante = max(0, item.quantidade - quantidade_consumida)
-            valor_restante = max(0, item.valor_total - valor_usado)
-            percentual_consumido = (quantidade_consumida / item.quantidade * 100) if item.quantidade > 0 else 0
-            dados_relatorio.append({
-                'tipo_combustivel': item.tipo_combustivel,
-                'fornecedor': contrato.fornecedor,
-                'numero_contrato': contrato.numero_contrato,
-                'ano_contrato': contrato.ano_contrato,
-                'data_inicio_contrato': contrato.data_inicio_contrato,
-                'data_fim_contrato': contrato.data_fim_contrato,
-                'quantidade_contratada': item.quantidade,
-                'valor_total': item.valor_total,
-                'valor_por_litro': item.valor_por_litro,
-                'quantidade_consumida': quantidade_consumida,
-                'valor_usado': valor_usado,
-                'quantidade_restante': quantidade_restante,
-                'valor_restante': valor_restante,
-                'percentual_consumido': percentual_consumido
-            })
+    relatorio = calcular_dados_relatorio_contratos()
+    contratos = relatorio['contratos']
+    dados_relatorio = relatorio['dados_relatorio']
     agora = datetime.now()
     is_admin = session.get("usuario_tipo") == "admin"
     return render_template(
@@ -2634,44 +3080,9 @@ def relatorio_contratos():
 def visualizar_relatorio_contratos():
     if "usuario" not in session:
         return redirect(url_for("login"))
-    contratos = ContratoCombustivel.query.filter_by(ativo=True).order_by(ContratoCombustivel.data_inicio_contrato).all()
-    dados_relatorio = []
-    for contrato in contratos:
-        for item in contrato.itens:
-            inicio_contrato = datetime.combine(contrato.data_inicio_contrato, datetime.min.time())
-            fim_contrato = datetime.combine(contrato.data_fim_contrato, datetime.max.time())
-            abastecimentos_tipo = Abastecimento.query.join(Veiculo).filter(
-                Veiculo.combustivel == item.tipo_combustivel,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
-            abastecimentos_contrato = Abastecimento.query.filter(
-                Abastecimento.contrato_id == contrato.id,
-                Abastecimento.data >= inicio_contrato,
-                Abastecimento.data <= fim_contrato
-            ).all()
-            todos_abastecimentos = list(set(abastecimentos_tipo + abastecimentos_contrato))
-            quantidade_consumida = sum(a.litros for a in todos_abastecimentos)
-            valor_usado = sum(a.valor_total for a in todos_abastecimentos)
-            quantidade_restante = max(0, item.quantidade - quantidade_consumida)
-            valor_restante = max(0, item.valor_total - valor_usado)
-            percentual_consumido = (quantidade_consumida / item.quantidade * 100) if item.quantidade > 0 else 0
-            dados_relatorio.append({
-                'tipo_combustivel': item.tipo_combustivel,
-                'fornecedor': contrato.fornecedor,
-                'numero_contrato': contrato.numero_contrato,
-                'ano_contrato': contrato.ano_contrato,
-                'data_inicio_contrato': contrato.data_inicio_contrato,
-                'data_fim_contrato': contrato.data_fim_contrato,
-                'quantidade_contratada': item.quantidade,
-                'valor_total': item.valor_total,
-                'valor_por_litro': item.valor_por_litro,
-                'quantidade_consumida': quantidade_consumida,
-                'valor_usado': valor_usado,
-                'quantidade_restante': quantidade_restante,
-                'valor_restante': valor_restante,
-                'percentual_consumido': percentual_consumido
-            })
+    relatorio = calcular_dados_relatorio_contratos()
+    contratos = relatorio['contratos']
+    dados_relatorio = relatorio['dados_relatorio']
     agora = datetime.now()
     is_admin = session.get("usuario_tipo") == "admin"
     return render_template(
@@ -2681,6 +3092,774 @@ def visualizar_relatorio_contratos():
         agora=agora,
         is_admin=is_admin
     )
+
+@app.route("/relatorios/notas-duplicadas", endpoint="relatorio_notas_duplicadas")
+def relatorio_notas_duplicadas():
+    """Grupos de abastecimentos com a mesma chave de nota (fornecedor + número normalizado)."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    usuario_tipo = session.get("usuario_tipo")
+    usuario_setor = session.get("usuario_setor")
+    setor_filtro = request.args.get("setor", "")
+
+    # Um único GROUP BY ... HAVING sobre o índice da chave, sem comparar pares de linhas
+    consulta = db.session.query(
+        Abastecimento.chave_nota,
+        func.count(Abastecimento.id).label('quantidade'),
+        func.sum(Abastecimento.litros).label('litros'),
+        func.sum(Abastecimento.valor_total).label('valor'),
+        func.group_concat(Abastecimento.id).label('ids')
+    ).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).filter(Abastecimento.chave_nota != None)
+    if usuario_tipo == "admin" and setor_filtro:
+        consulta = consulta.filter(Veiculo.tipo == setor_filtro)
+    elif usuario_tipo != "admin" and usuario_setor:
+        consulta = consulta.filter(Veiculo.tipo == usuario_setor)
+    grupos = consulta.group_by(Abastecimento.chave_nota).having(func.count(Abastecimento.id) > 1).order_by(
+        desc('quantidade'), Abastecimento.chave_nota
+    ).all()
+
+    ids = [int(id_) for grupo in grupos for id_ in grupo.ids.split(',')]
+    abastecimentos = {}
+    for inicio in range(0, len(ids), 500):
+        for abastecimento in Abastecimento.query.options(
+            selectinload(Abastecimento.veiculo), selectinload(Abastecimento.motorista), selectinload(Abastecimento.contrato)
+        ).filter(Abastecimento.id.in_(ids[inicio:inicio + 500])):
+            abastecimentos[abastecimento.id] = abastecimento
+    duplicadas = [{
+        'chave': grupo.chave_nota,
+        'quantidade': grupo.quantidade,
+        'litros': grupo.litros or 0,
+        'valor': grupo.valor or 0,
+        'abastecimentos': sorted((abastecimentos[int(id_)] for id_ in grupo.ids.split(',')), key=lambda a: (a.data, a.id)),
+    } for grupo in grupos]
+
+    setores = []
+    if usuario_tipo == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    return render_template(
+        "relatorio_notas_duplicadas.html",
+        duplicadas=duplicadas,
+        total_excedente=sum(grupo['quantidade'] - 1 for grupo in duplicadas),
+        setores=setores,
+        setor_filtro=setor_filtro,
+        agora=datetime.now()
+    )
+
+# ----------------------
+# Relatório de eficiência (km/L)
+# ----------------------
+def filtros_relatorio_eficiencia():
+    """Agrupamento, período e setor da requisição (usuários de setor só veem o próprio)."""
+    agrupamento = request.args.get("agrupamento", "veiculo")
+    if agrupamento not in eficiencia.AGRUPAMENTOS:
+        agrupamento = "veiculo"
+    filtros = {'agrupamento': agrupamento, 'data_inicio': None, 'data_fim': None, 'setor': None}
+    try:
+        if request.args.get("data_inicio"):
+            filtros['data_inicio'] = datetime.fromisoformat(request.args["data_inicio"])
+        if request.args.get("data_fim"):
+            filtros['data_fim'] = datetime.fromisoformat(request.args["data_fim"]).replace(hour=23, minute=59, second=59)
+    except ValueError:
+        pass
+    if session.get("usuario_tipo") == "admin":
+        filtros['setor'] = request.args.get("setor") or None
+    else:
+        filtros['setor'] = session.get("usuario_setor") or None
+    return filtros
+
+def dados_relatorio_eficiencia():
+    filtros = filtros_relatorio_eficiencia()
+    linhas = eficiencia.agregar(**filtros)
+    return filtros, linhas, eficiencia.totais(linhas)
+
+@app.route("/relatorios/eficiencia", endpoint="relatorio_eficiencia")
+def relatorio_eficiencia():
+    """km rodados e km/L por veículo, motorista, setor ou mês, a partir do hodômetro."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, linhas, totais = dados_relatorio_eficiencia()
+    setores = []
+    if session.get("usuario_tipo") == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    return render_template(
+        "relatorio_eficiencia.html",
+        linhas=linhas,
+        totais=totais,
+        filtros=filtros,
+        agrupamentos=eficiencia.AGRUPAMENTOS,
+        setores=setores,
+        agora=datetime.now()
+    )
+
+@app.route("/relatorios/eficiencia/csv", endpoint="export_csv_relatorio_eficiencia")
+def export_csv_relatorio_eficiencia():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, linhas, totais = dados_relatorio_eficiencia()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["RELATÓRIO DE EFICIÊNCIA (KM/L) - SISTEMA DE GESTÃO DE COMBUSTÍVEL"])
+    writer.writerow([])
+    writer.writerow(["Data de geração:", datetime.now().strftime('%d/%m/%Y %H:%M')])
+    writer.writerow(["Usuário:", session.get("usuario_nome", "N/A")])
+    writer.writerow(["Agrupamento:", eficiencia.AGRUPAMENTOS[filtros['agrupamento']]])
+    if filtros['data_inicio'] or filtros['data_fim']:
+        periodo = " a ".join(data.strftime('%d/%m/%Y') for data in (filtros['data_inicio'], filtros['data_fim']) if data)
+        writer.writerow(["Período:", periodo])
+    if filtros['setor']:
+        writer.writerow(["Setor:", filtros['setor']])
+    writer.writerow([])
+    writer.writerow([
+        eficiencia.AGRUPAMENTOS[filtros['agrupamento']].upper(), "TRECHOS", "DESCARTADOS", "KM", "LITROS",
+        "KM/L", "KM/L MÍN.", "KM/L MÁX.", "VALOR (R$)", "CUSTO POR KM (R$)"
+    ])
+    def formatar(valor, casas=2):
+        return "" if valor is None else f"{valor:.{casas}f}"
+    for linha in linhas + [dict(totais, grupo="TOTAL")]:
+        writer.writerow([
+            linha['grupo'], linha['trechos'], linha['descartados'], linha['km'], formatar(linha['litros']),
+            formatar(linha['km_por_litro']), formatar(linha['km_por_litro_min']), formatar(linha['km_por_litro_max']),
+            formatar(linha['valor']), formatar(linha['custo_km'], 4)
+        ])
+    filename = f"relatorio_eficiencia_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+@app.route("/relatorios/eficiencia/pdf", endpoint="export_pdf_relatorio_eficiencia")
+def export_pdf_relatorio_eficiencia():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, linhas, totais = dados_relatorio_eficiencia()
+    html = render_template(
+        "relatorio_eficiencia_print.html",
+        linhas=linhas,
+        totais=totais,
+        filtros=filtros,
+        agrupamentos=eficiencia.AGRUPAMENTOS,
+        agora=datetime.now()
+    )
+    pdf = gerar_pdf(html)
+    return Response(pdf, mimetype='application/pdf', headers={"Content-Disposition": "attachment;filename=relatorio_eficiencia.pdf"})
+
+@app.cli.command('recalcular-eficiencia')
+def recalcular_eficiencia_comando():
+    """Recalcula km e km/L de todos os abastecimentos (após correções direto no banco)."""
+    eficiencia.recalcular_tudo()
+    db.session.commit()
+    click.echo(f"{EficienciaAbastecimento.query.count()} abastecimentos recalculados.")
+
+# ----------------------
+# Relatório de anomalias
+# ----------------------
+ANOMALIAS_POR_PAGINA = 100
+
+def consulta_anomalias():
+    """Anomalias com os filtros da requisição (regra, período, veículo, setor) e (filtros, consulta sem a regra)."""
+    filtros = {
+        'regra': request.args.get("regra", ""),
+        'data_inicio': request.args.get("data_inicio", ""),
+        'data_fim': request.args.get("data_fim", ""),
+        'veiculo_id': request.args.get("veiculo_id", type=int),
+        'setor': request.args.get("setor", "") if session.get("usuario_tipo") == "admin" else session.get("usuario_setor"),
+    }
+    consulta = db.session.query(AnomaliaAbastecimento).join(
+        Abastecimento, Abastecimento.id == AnomaliaAbastecimento.abastecimento_id
+    ).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id)
+    try:
+        if filtros['data_inicio']:
+            consulta = consulta.filter(Abastecimento.data >= datetime.fromisoformat(filtros['data_inicio']))
+        if filtros['data_fim']:
+            consulta = consulta.filter(Abastecimento.data <= datetime.fromisoformat(filtros['data_fim']).replace(hour=23, minute=59, second=59))
+    except ValueError:
+        pass
+    if filtros['veiculo_id']:
+        consulta = consulta.filter(Abastecimento.veiculo_id == filtros['veiculo_id'])
+    if filtros['setor']:
+        consulta = consulta.filter(Veiculo.tipo == filtros['setor'])
+    return filtros, consulta
+
+def linhas_anomalias(consulta, pagina=None):
+    linhas = consulta.join(Motorista, Abastecimento.motorista_id == Motorista.id).with_entities(
+        AnomaliaAbastecimento.regra, AnomaliaAbastecimento.valor, AnomaliaAbastecimento.referencia,
+        Abastecimento.id, Abastecimento.data, Abastecimento.litros, Abastecimento.valor_total,
+        Abastecimento.numero_nota, Veiculo.placa, Veiculo.tipo, Motorista.nome_completo
+    ).order_by(desc(Abastecimento.data), Abastecimento.id, AnomaliaAbastecimento.regra)
+    if pagina is not None:
+        linhas = linhas.limit(ANOMALIAS_POR_PAGINA).offset((pagina - 1) * ANOMALIAS_POR_PAGINA)
+    return [{
+        'regra': linha.regra,
+        'descricao': anomalias.descrever(linha.regra, linha.valor, linha.referencia),
+        'abastecimento_id': linha.id,
+        'data': linha.data,
+        'placa': linha.placa,
+        'setor': linha.tipo,
+        'motorista': linha.nome_completo,
+        'litros': linha.litros,
+        'valor_total': linha.valor_total,
+        'numero_nota': linha.numero_nota,
+    } for linha in linhas]
+
+@app.route("/relatorios/anomalias", endpoint="relatorio_anomalias")
+def relatorio_anomalias():
+    """Abastecimentos suspeitos por regra (tanque, hodômetro, intervalo, preço, consumo), paginados."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, consulta = consulta_anomalias()
+    contagens = dict(consulta.with_entities(AnomaliaAbastecimento.regra, func.count()).group_by(AnomaliaAbastecimento.regra).all())
+    if filtros['regra']:
+        consulta = consulta.filter(AnomaliaAbastecimento.regra == filtros['regra'])
+    total = contagens.get(filtros['regra'], 0) if filtros['regra'] else sum(contagens.values())
+    paginas = max(1, -(-total // ANOMALIAS_POR_PAGINA))
+    pagina = min(max(request.args.get("pagina", 1, type=int), 1), paginas)
+    linhas = linhas_anomalias(consulta, pagina)
+
+    usuario_tipo = session.get("usuario_tipo")
+    setores = []
+    if usuario_tipo == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    veiculo_selecionado, _ = selecionados_autocompletar(filtros['veiculo_id'])
+    return render_template(
+        "relatorio_anomalias.html",
+        linhas=linhas,
+        contagens=contagens,
+        regras=anomalias.REGRAS,
+        intervalo_horas=anomalias.INTERVALO_HORAS,
+        filtros=filtros,
+        total=total,
+        pagina=pagina,
+        paginas=paginas,
+        setores=setores,
+        veiculo_selecionado=veiculo_selecionado,
+        is_admin=usuario_tipo == "admin"
+    )
+
+@app.route("/relatorios/anomalias/csv", endpoint="export_csv_relatorio_anomalias")
+def export_csv_relatorio_anomalias():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, consulta = consulta_anomalias()
+    if filtros['regra']:
+        consulta = consulta.filter(AnomaliaAbastecimento.regra == filtros['regra'])
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["Data", "Abastecimento", "Placa", "Setor", "Motorista", "Nota", "Litros", "Valor (R$)", "Regra", "Detalhe"])
+    for linha in linhas_anomalias(consulta):
+        writer.writerow([
+            linha['data'].strftime('%d/%m/%Y %H:%M'), linha['abastecimento_id'], linha['placa'], linha['setor'],
+            linha['motorista'], linha['numero_nota'], f"{linha['litros']:.2f}", f"{linha['valor_total']:.2f}",
+            anomalias.REGRAS[linha['regra']], linha['descricao']
+        ])
+    filename = f"anomalias_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+@app.route("/relatorios/anomalias/verificar", methods=["POST"])
+def verificar_anomalias():
+    """Verificação completa do histórico (após mudar capacidades de tanque, por exemplo)."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    if session.get("usuario_tipo") != "admin":
+        return redirect(url_for("relatorio_anomalias"))
+    try:
+        quantidade = anomalias.verificar_tudo()
+        db.session.commit()
+        flash(f"Histórico verificado: {quantidade} anomalias.")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Não foi possível verificar o histórico: {e}", "error")
+    return redirect(url_for("relatorio_anomalias"))
+
+@app.cli.command('verificar-anomalias')
+def verificar_anomalias_comando():
+    """Verifica todas as regras de anomalia sobre o histórico inteiro."""
+    quantidade = anomalias.verificar_tudo()
+    db.session.commit()
+    click.echo(f"{quantidade} anomalias encontradas.")
+
+# ----------------------
+# Relatório: tabela dinâmica (dimensão x período)
+# ----------------------
+def filtros_tabela_dinamica():
+    """Dimensão, período, medida, intervalo (padrão: ano corrente) e setor da requisição."""
+    def escolha(nome, opcoes, padrao):
+        valor = request.args.get(nome, padrao)
+        return valor if valor in opcoes else padrao
+    hoje = date.today()
+    filtros = {
+        'dimensao': escolha("dimensao", tabela_dinamica.DIMENSOES, "veiculo"),
+        'periodo': escolha("periodo", tabela_dinamica.PERIODOS, "mes"),
+        'medida': escolha("medida", tabela_dinamica.MEDIDAS, "litros"),
+        'data_inicio': datetime(hoje.year, 1, 1),
+        'data_fim': datetime(hoje.year, 12, 31, 23, 59, 59),
+    }
+    try:
+        if request.args.get("data_inicio"):
+            filtros['data_inicio'] = datetime.fromisoformat(request.args["data_inicio"])
+        if request.args.get("data_fim"):
+            filtros['data_fim'] = datetime.fromisoformat(request.args["data_fim"]).replace(hour=23, minute=59, second=59)
+    except ValueError:
+        pass
+    if filtros['data_fim'] < filtros['data_inicio']:
+        filtros['data_fim'] = filtros['data_inicio'].replace(hour=23, minute=59, second=59)
+    if session.get("usuario_tipo") == "admin":
+        filtros['setor'] = request.args.get("setor") or None
+    else:
+        filtros['setor'] = session.get("usuario_setor") or None
+    return filtros
+
+def dados_tabela_dinamica():
+    filtros = filtros_tabela_dinamica()
+    tabela = tabela_dinamica.calcular(
+        filtros['dimensao'], filtros['periodo'], filtros['data_inicio'], filtros['data_fim'], filtros['setor'],
+        colunar=usar_cache_colunar()
+    )
+    return filtros, tabela
+
+def descricao_tabela_dinamica(filtros):
+    """Linhas de identificação usadas no CSV e no XLSX."""
+    informacoes = [
+        f"Linhas: {tabela_dinamica.DIMENSOES[filtros['dimensao']]}",
+        f"Colunas: {tabela_dinamica.PERIODOS[filtros['periodo']]}",
+        f"Período: {filtros['data_inicio'].strftime('%d/%m/%Y')} a {filtros['data_fim'].strftime('%d/%m/%Y')}",
+    ]
+    if filtros['setor']:
+        informacoes.append(f"Setor: {filtros['setor']}")
+    return informacoes
+
+@app.route("/relatorios/tabela-dinamica", endpoint="relatorio_tabela_dinamica")
+def relatorio_tabela_dinamica():
+    """Litros ou valor por veículo, motorista, setor ou combustível em cada mês, trimestre, semana ou ano."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, tabela = dados_tabela_dinamica()
+    setores = []
+    if session.get("usuario_tipo") == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    medida = filtros['medida']
+    return render_template(
+        "relatorio_tabela_dinamica.html",
+        filtros=filtros,
+        linhas=list(zip(tabela['linhas'], tabela['matrizes'][medida].tolist(), tabela['total_linhas'][medida].tolist())),
+        colunas=tabela['colunas'],
+        total_colunas=tabela['total_colunas'][medida].tolist(),
+        total=tabela['total'][medida],
+        dimensoes=tabela_dinamica.DIMENSOES,
+        periodos=tabela_dinamica.PERIODOS,
+        medidas=tabela_dinamica.MEDIDAS,
+        setores=setores,
+        agora=datetime.now()
+    )
+
+@app.route("/relatorios/tabela-dinamica/csv", endpoint="export_csv_relatorio_tabela_dinamica")
+def export_csv_relatorio_tabela_dinamica():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, tabela = dados_tabela_dinamica()
+    medida = filtros['medida']
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([f"TABELA DINÂMICA - {tabela_dinamica.MEDIDAS[medida].upper()} - SISTEMA DE GESTÃO DE COMBUSTÍVEL"])
+    writer.writerow([])
+    writer.writerow(["Data de geração:", datetime.now().strftime('%d/%m/%Y %H:%M')])
+    writer.writerow(["Usuário:", session.get("usuario_nome", "N/A")])
+    for informacao in descricao_tabela_dinamica(filtros):
+        writer.writerow(informacao.split(": ", 1))
+    writer.writerow([])
+    writer.writerow([tabela_dinamica.DIMENSOES[filtros['dimensao']].upper()] + tabela['colunas'] + ["TOTAL"])
+    for rotulo, valores, total in zip(tabela['linhas'], tabela['matrizes'][medida].tolist(), tabela['total_linhas'][medida].tolist()):
+        writer.writerow([rotulo] + [f"{valor:.2f}" for valor in valores] + [f"{total:.2f}"])
+    writer.writerow(["TOTAL"] + [f"{valor:.2f}" for valor in tabela['total_colunas'][medida].tolist()] + [f"{tabela['total'][medida]:.2f}"])
+    filename = f"tabela_dinamica_{medida}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+@app.route("/relatorios/tabela-dinamica/xlsx", endpoint="export_xlsx_relatorio_tabela_dinamica")
+def export_xlsx_relatorio_tabela_dinamica():
+    """Planilha com as duas medidas (abas Litros e Valor)."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, tabela = dados_tabela_dinamica()
+    informacoes = [f"Gerado em {datetime.now().strftime('%d/%m/%Y %H:%M')}", f"Usuário: {session.get('usuario_nome', 'N/A')}"]
+    conteudo = tabela_dinamica.para_xlsx(tabela, "Tabela dinâmica - Sistema de Gestão de Combustível",
+                                         informacoes + descricao_tabela_dinamica(filtros),
+                                         tabela_dinamica.DIMENSOES[filtros['dimensao']])
+    filename = f"tabela_dinamica_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+    return Response(
+        conteudo,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+# ----------------------
+# Relatório: comparação com o período anterior e com o ano anterior
+# ----------------------
+def intervalo_comparativo(data_inicio, data_fim):
+    """(início, fim) como date a partir dos textos ISO; sem início, o mês da data final até ela."""
+    try:
+        fim = date.fromisoformat(data_fim) if data_fim else None
+    except ValueError:
+        fim = None
+    try:
+        inicio = date.fromisoformat(data_inicio) if data_inicio else None
+    except ValueError:
+        inicio = None
+    if inicio is None:
+        inicio, fim = comparativo.intervalo_padrao(fim)
+    elif fim is None or fim < inicio:
+        fim = max(inicio, date.today())
+    return inicio, fim
+
+def dados_comparativo():
+    filtros = {
+        'dimensao': request.args.get("dimensao") if request.args.get("dimensao") in comparativo.DIMENSOES else "veiculo",
+        'combustivel': request.args.get("combustivel") or None,
+    }
+    filtros['data_inicio'], filtros['data_fim'] = intervalo_comparativo(
+        request.args.get("data_inicio", ""), request.args.get("data_fim", "")
+    )
+    if session.get("usuario_tipo") == "admin":
+        filtros['setor'] = request.args.get("setor") or None
+    else:
+        filtros['setor'] = session.get("usuario_setor") or None
+    limites, linhas, total = comparativo.comparar(
+        filtros['data_inicio'], filtros['data_fim'], filtros['dimensao'],
+        setor=filtros['setor'], combustivel=filtros['combustivel']
+    )
+    return filtros, limites, linhas, total
+
+@app.route("/relatorios/comparativo", endpoint="relatorio_comparativo")
+def relatorio_comparativo():
+    """Litros, valor e abastecimentos do período contra o período anterior e o mesmo período do ano anterior."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, limites, linhas, total = dados_comparativo()
+    setores = []
+    if session.get("usuario_tipo") == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    return render_template(
+        "relatorio_comparativo.html",
+        filtros=filtros,
+        periodos=limites,
+        nomes_periodos=comparativo.PERIODOS,
+        linhas=linhas,
+        total=total,
+        dimensoes=comparativo.DIMENSOES,
+        tipos_combustivel=TIPOS_COMBUSTIVEL,
+        setores=setores,
+        agora=datetime.now()
+    )
+
+@app.route("/relatorios/comparativo/csv", endpoint="export_csv_relatorio_comparativo")
+def export_csv_relatorio_comparativo():
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros, limites, linhas, total = dados_comparativo()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["COMPARATIVO DE PERÍODOS - SISTEMA DE GESTÃO DE COMBUSTÍVEL"])
+    writer.writerow([])
+    writer.writerow(["Data de geração:", datetime.now().strftime('%d/%m/%Y %H:%M')])
+    writer.writerow(["Usuário:", session.get("usuario_nome", "N/A")])
+    for periodo, nome in comparativo.PERIODOS.items():
+        primeiro, ultimo = limites[periodo]
+        writer.writerow([f"{nome}:", f"{primeiro.strftime('%d/%m/%Y')} a {ultimo.strftime('%d/%m/%Y')}"])
+    if filtros['setor']:
+        writer.writerow(["Setor:", filtros['setor']])
+    if filtros['combustivel']:
+        writer.writerow(["Combustível:", filtros['combustivel']])
+    writer.writerow([])
+
+    def percentual(variacao):
+        return "" if variacao[1] is None else f"{variacao[1]:.1f}"
+
+    cabecalho = [comparativo.DIMENSOES[filtros['dimensao']].upper()]
+    for medida in ("LITROS", "VALOR", "ABASTECIMENTOS"):
+        cabecalho += [f"{medida} PERÍODO", f"{medida} PERÍODO ANTERIOR", f"{medida} VAR. %",
+                      f"{medida} ANO ANTERIOR", f"{medida} VAR. % ANO"]
+    writer.writerow(cabecalho)
+    for linha in linhas + [total]:
+        valores = [linha['grupo'] if linha is not total else "TOTAL"]
+        for medida, formato in (('litros', "{:.2f}"), ('valor', "{:.2f}"), ('quantidade', "{}")):
+            valores += [
+                formato.format(linha['atual'][medida]),
+                formato.format(linha['anterior'][medida]),
+                percentual(linha['variacao_anterior'][medida]),
+                formato.format(linha['ano_anterior'][medida]),
+                percentual(linha['variacao_ano_anterior'][medida]),
+            ]
+        writer.writerow(valores)
+    filename = f"comparativo_{filtros['dimensao']}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+# ----------------------
+# Relatório: preço por litro e conciliação com os contratos
+# ----------------------
+def conciliacoes_contratos(contrato_ids, setor=None):
+    """Conciliação de preços por contrato (cache por setor e contrato; acerto/falta vão para /metrics)."""
+    conciliacoes, acerto = precos.cache.obter(contrato_ids, setor)
+    if coletor_metricas:
+        coletor_metricas.contar_cache('conciliacao', acerto)
+    return conciliacoes
+
+def filtros_precos():
+    """Intervalo da série (padrão: últimos 12 meses), combustível, setor e contrato detalhado."""
+    hoje = date.today()
+    indice = hoje.year * 12 + hoje.month - 1 - 11
+    filtros = {
+        'data_inicio': date(indice // 12, indice % 12 + 1, 1),
+        'data_fim': hoje,
+        'combustivel': request.args.get("combustivel") or None,
+        'contrato_id': request.args.get("contrato_id", type=int),
+    }
+    try:
+        if request.args.get("data_inicio"):
+            filtros['data_inicio'] = date.fromisoformat(request.args["data_inicio"])
+        if request.args.get("data_fim"):
+            filtros['data_fim'] = date.fromisoformat(request.args["data_fim"])
+    except ValueError:
+        pass
+    if filtros['data_fim'] < filtros['data_inicio']:
+        filtros['data_fim'] = filtros['data_inicio']
+    # Como na página de contratos: o usuário de setor vê os contratos e abastecimentos do setor;
+    # o administrador filtra os contratos pelo setor, conciliando com todos os abastecimentos
+    if session.get("usuario_tipo") == "admin":
+        filtros['setor'] = request.args.get("setor") or None
+        filtros['setor_abastecimentos'] = None
+    else:
+        filtros['setor'] = filtros['setor_abastecimentos'] = session.get("usuario_setor") or None
+    return filtros
+
+def dados_conciliacao(filtros):
+    """[(contrato, conciliação)] dos contratos ativos, os de maior diferença (em módulo) primeiro."""
+    query = ContratoCombustivel.query.filter_by(ativo=True)
+    if filtros['setor']:
+        query = query.filter(ContratoCombustivel.setor == filtros['setor'])
+    contratos = query.order_by(ContratoCombustivel.data_inicio_contrato).all()
+    conciliacoes = conciliacoes_contratos([contrato.id for contrato in contratos], filtros['setor_abastecimentos'])
+    return sorted(((contrato, conciliacoes[contrato.id]) for contrato in contratos),
+                  key=lambda par: -abs(par[1]['diferenca']))
+
+@app.route("/relatorios/precos", endpoint="relatorio_precos")
+def relatorio_precos():
+    """Preço por litro por combustível e fornecedor, e valor cobrado contra o preço de cada contrato."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros = filtros_precos()
+    serie = precos.serie_precos(filtros['data_inicio'], filtros['data_fim'], filtros['setor_abastecimentos'])
+
+    # Combustível do gráfico: o escolhido ou o de mais litros no período
+    litros_por_combustivel = defaultdict(float)
+    for _, combustivel, _, litros, _, _ in serie:
+        litros_por_combustivel[combustivel] += litros
+    combustiveis = sorted(litros_por_combustivel, key=lambda nome: -litros_por_combustivel[nome])
+    combustivel = filtros['combustivel'] if filtros['combustivel'] in litros_por_combustivel else (combustiveis[0] if combustiveis else None)
+
+    meses = sorted({mes for mes, *_ in serie})
+    por_fornecedor = {}
+    for mes, nome_combustivel, fornecedor, litros, valor, valor_contrato in serie:
+        if nome_combustivel != combustivel:
+            continue
+        resumo = por_fornecedor.setdefault(fornecedor, {'litros': 0.0, 'valor': 0.0, 'valor_contrato': None, 'meses': {}})
+        resumo['litros'] += litros
+        resumo['valor'] += valor
+        if valor_contrato is not None:
+            resumo['valor_contrato'] = (resumo['valor_contrato'] or 0) + valor_contrato
+        resumo['meses'][mes] = valor / litros if litros else None
+    fornecedores = sorted(por_fornecedor.items(), key=lambda par: -par[1]['litros'])
+    grafico = {
+        'labels': [f"{mes[5:]}/{mes[:4]}" for mes in meses],
+        'datasets': [
+            {'label': fornecedor, 'data': [resumo['meses'].get(mes) for mes in meses]}
+            for fornecedor, resumo in fornecedores
+        ],
+    }
+
+    conciliacao = dados_conciliacao(filtros)
+    detalhe = None
+    for contrato, dados in conciliacao:
+        if contrato.id == filtros['contrato_id']:
+            abastecimentos = {
+                abastecimento.id: abastecimento
+                for abastecimento in listar_abastecimentos(consulta_abastecimentos().filter(
+                    Abastecimento.id.in_([abastecimento_id for abastecimento_id, _, _ in dados['maiores']])
+                ))
+            }
+            detalhe = {
+                'contrato': contrato,
+                'itens': dados['itens'],
+                'maiores': [(abastecimentos.get(abastecimento_id), diferenca) for abastecimento_id, _, diferenca in dados['maiores']],
+            }
+    setores = []
+    if session.get("usuario_tipo") == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    return render_template(
+        "relatorio_precos.html",
+        filtros=filtros,
+        combustiveis=combustiveis,
+        combustivel=combustivel,
+        fornecedores=fornecedores,
+        grafico=grafico,
+        conciliacao=conciliacao,
+        totais={chave: sum(dados[chave] for _, dados in conciliacao)
+                for chave in ('litros', 'valor_cobrado', 'valor_contrato', 'diferenca', 'acima', 'abaixo', 'divergentes')},
+        detalhe=detalhe,
+        tolerancia=precos.TOLERANCIA_POR_LITRO,
+        setores=setores,
+        agora=datetime.now()
+    )
+
+@app.route("/relatorios/precos/csv", endpoint="export_csv_relatorio_precos")
+def export_csv_relatorio_precos():
+    """Série mensal de preço por litro por combustível e fornecedor."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros = filtros_precos()
+    serie = precos.serie_precos(filtros['data_inicio'], filtros['data_fim'], filtros['setor_abastecimentos'], filtros['combustivel'])
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["PREÇO POR LITRO - SISTEMA DE GESTÃO DE COMBUSTÍVEL"])
+    writer.writerow([])
+    writer.writerow(["Data de geração:", datetime.now().strftime('%d/%m/%Y %H:%M')])
+    writer.writerow(["Usuário:", session.get("usuario_nome", "N/A")])
+    writer.writerow(["Período:", f"{filtros['data_inicio'].strftime('%d/%m/%Y')} a {filtros['data_fim'].strftime('%d/%m/%Y')}"])
+    if filtros['setor_abastecimentos']:
+        writer.writerow(["Setor:", filtros['setor_abastecimentos']])
+    writer.writerow([])
+    writer.writerow(["MÊS", "COMBUSTÍVEL", "FORNECEDOR", "LITROS", "VALOR", "PREÇO MÉDIO (R$/L)", "PREÇO DO CONTRATO (R$/L)"])
+    for mes, combustivel, fornecedor, litros, valor, valor_contrato in serie:
+        writer.writerow([
+            f"{mes[5:]}/{mes[:4]}", combustivel or "Não informado", fornecedor, f"{litros:.2f}", f"{valor:.2f}",
+            f"{valor / litros:.4f}" if litros else "",
+            f"{valor_contrato / litros:.4f}" if valor_contrato is not None and litros else "",
+        ])
+    filename = f"precos_por_litro_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+@app.route("/relatorios/precos/conciliacao/csv", endpoint="export_csv_conciliacao_precos")
+def export_csv_conciliacao_precos():
+    """Conciliação por contrato e item: cobrado, valor pelo contrato e diferenças."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    filtros = filtros_precos()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["CONCILIAÇÃO DE PREÇOS POR CONTRATO - SISTEMA DE GESTÃO DE COMBUSTÍVEL"])
+    writer.writerow([])
+    writer.writerow(["Data de geração:", datetime.now().strftime('%d/%m/%Y %H:%M')])
+    writer.writerow(["Usuário:", session.get("usuario_nome", "N/A")])
+    writer.writerow(["Tolerância por litro:", f"{precos.TOLERANCIA_POR_LITRO:.2f}"])
+    if filtros['setor']:
+        writer.writerow(["Setor:", filtros['setor']])
+    writer.writerow([])
+    writer.writerow(["CONTRATO", "FORNECEDOR", "COMBUSTÍVEL", "PREÇO DO CONTRATO (R$/L)", "ABASTECIMENTOS", "LITROS",
+                     "VALOR COBRADO", "VALOR PELO CONTRATO", "DIFERENÇA", "ACIMA DO CONTRATO", "ABAIXO DO CONTRATO",
+                     "ABASTECIMENTOS DIVERGENTES"])
+    for contrato, dados in dados_conciliacao(filtros):
+        for item in dados['itens'].values():
+            writer.writerow([
+                f"{contrato.numero_contrato}/{contrato.ano_contrato}", contrato.fornecedor, item['tipo_combustivel'],
+                f"{item['valor_por_litro']:.4f}", item['quantidade'], f"{item['litros']:.2f}", f"{item['valor_cobrado']:.2f}",
+                f"{item['valor_contrato']:.2f}", f"{item['diferenca']:.2f}", f"{item['acima']:.2f}", f"{item['abaixo']:.2f}",
+                item['divergentes'],
+            ])
+    filename = f"conciliacao_precos_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv; charset=utf-8',
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
+
+# ----------------------
+# Busca textual (nota, observações, placa e motorista)
+# ----------------------
+@app.route("/busca", endpoint="buscar")
+def buscar():
+    """Abastecimentos que contêm os termos digitados, por relevância, no escopo de setor do usuário."""
+    if "usuario" not in session:
+        return redirect(url_for("login"))
+    texto = request.args.get("q", "").strip()
+    pagina = max(request.args.get("pagina", 1, type=int), 1)
+    if session.get("usuario_tipo") == "admin":
+        setor = request.args.get("setor") or None
+    else:
+        setor = session.get("usuario_setor") or None
+    inicio = time.perf_counter()
+    ids, total, destaques = busca.buscar(texto, setor, pagina)
+    duracao = time.perf_counter() - inicio
+    por_id = {
+        abastecimento.id: abastecimento
+        for abastecimento in listar_abastecimentos(consulta_abastecimentos().filter(Abastecimento.id.in_(ids)))
+    } if ids else {}
+    setores = []
+    if session.get("usuario_tipo") == "admin":
+        setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
+    return render_template(
+        "busca.html",
+        texto=texto,
+        setor=setor,
+        resultados=[(por_id[abastecimento_id], destaques.get(abastecimento_id, {})) for abastecimento_id in ids if abastecimento_id in por_id],
+        total=total,
+        pagina=pagina,
+        paginas=(total + busca.POR_PAGINA - 1) // busca.POR_PAGINA,
+        duracao_ms=duracao * 1000,
+        setores=setores
+    )
+
+@app.cli.command('reindexar-busca')
+def reindexar_busca_comando():
+    """Refaz o índice da busca textual (após restaurar um backup feito sem a tabela FTS5)."""
+    if busca.disponivel():
+        busca.reindexar()
+    elif not busca.criar():
+        click.echo("Este SQLite não tem FTS5; a busca usa LIKE.")
+        return
+    db.session.commit()
+    click.echo(f"{Abastecimento.query.count()} abastecimentos indexados.")
+
+# ----------------------
+# Autocompletar de veículos e motoristas (formulários e filtros)
+# ----------------------
+def setor_autocompletar():
+    """Setor do usuário; o admin escolhe pelo parâmetro setor (vazio = todos)."""
+    if session.get("usuario_tipo") == "admin":
+        return request.args.get("setor") or None
+    return session.get("usuario_setor") or None
+
+def resposta_autocompletar(buscar_itens):
+    if "usuario" not in session:
+        return jsonify(erro="autenticação necessária"), 401
+    limite = min(max(request.args.get("limite", autocompletar.LIMITE_PADRAO, type=int), 1), autocompletar.LIMITE_MAXIMO)
+    itens, acerto = buscar_itens(request.args.get("q", ""), setor_autocompletar(), limite)
+    if coletor_metricas:
+        coletor_metricas.contar_cache('autocompletar', acerto)
+    return jsonify(itens=itens)
+
+@app.route("/veiculos/autocompletar")
+def autocompletar_veiculos():
+    """Veículos cuja placa começa com o texto digitado (JSON)."""
+    return resposta_autocompletar(autocompletar.indice.buscar_veiculos)
+
+@app.route("/motoristas/autocompletar")
+def autocompletar_motoristas():
+    """Motoristas com nome (qualquer palavra) ou documento começando com o texto digitado (JSON)."""
+    return resposta_autocompletar(autocompletar.indice.buscar_motoristas)
 # ...existing code...
 
 # ----------------------
@@ -2742,13 +3921,11 @@ def visualizar_relatorio_abastecimentos():
         except Exception:
             pass
 
-    abastecimentos = query.order_by(Abastecimento.data.desc()).all()
+    abastecimentos = listar_abastecimentos(query.order_by(Abastecimento.data.desc()))
     total_litros = sum(a.litros for a in abastecimentos) if abastecimentos else 0
     valor_total = sum(a.valor_total for a in abastecimentos) if abastecimentos else 0
     media_litros = total_litros / len(abastecimentos) if abastecimentos else 0
 
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
     setores = []
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
@@ -2783,8 +3960,6 @@ def visualizar_relatorio_abastecimentos():
     return render_template(
         "relatorio_abastecimentos_print.html",
         abastecimentos=abastecimentos,
-        veiculos=veiculos,
-        motoristas=motoristas,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         total_registros=len(abastecimentos),
@@ -2851,13 +4026,11 @@ def export_pdf_relatorio_abastecimentos():
         except Exception:
             pass
 
-    abastecimentos = query.order_by(Abastecimento.data.desc()).all()
+    abastecimentos = listar_abastecimentos(query.order_by(Abastecimento.data.desc()))
     total_litros = sum(a.litros for a in abastecimentos) if abastecimentos else 0
     valor_total = sum(a.valor_total for a in abastecimentos) if abastecimentos else 0
     media_litros = total_litros / len(abastecimentos) if abastecimentos else 0
 
-    veiculos = Veiculo.query.order_by(Veiculo.placa).all()
-    motoristas = Motorista.query.order_by(Motorista.nome_completo).all()
     setores = []
     if usuario_tipo == "admin":
         setores = [s[0] for s in db.session.query(User.setor).filter(User.setor != None).distinct().order_by(User.setor).all() if s[0]]
@@ -2892,8 +4065,6 @@ def export_pdf_relatorio_abastecimentos():
     html = render_template(
         "relatorio_abastecimentos_print.html",
         abastecimentos=abastecimentos,
-        veiculos=veiculos,
-        motoristas=motoristas,
         tipos_combustivel=TIPOS_COMBUSTIVEL,
         filtros_aplicados=filtros_aplicados,
         total_registros=len(abastecimentos),
@@ -2903,7 +4074,7 @@ def export_pdf_relatorio_abastecimentos():
         valor_total=valor_total,
         media_litros=media_litros
     )
-    pdf = HTML(string=html).write_pdf()
+    pdf = gerar_pdf(html)
     return Response(pdf, mimetype='application/pdf', headers={"Content-Disposition": "attachment;filename=relatorio_abastecimentos.pdf"})
 
 # ----------------------
@@ -2966,4 +4137,8 @@ def get_veiculos_report_data(request_args):
 # Execução
 # ----------------------
 if __name__ == "__main__":
-    app.run(debug=True, port=5000, host='0.0.0.0')
+    if perfil_atual() == 'producao':
+        import servidor
+        servidor.servir(app)
+    else:
+        app.run(debug=True, port=app.config['SERVIDOR_PORTA'], host='0.0.0.0')
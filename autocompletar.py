@@ -0,0 +1,317 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+from sqlalchemy import func, select
+
+from database import db, Veiculo, Motorista, Abastecimento
+import versoes
+
+# ----------------------
+# Autocompletar de placas e motoristas (índice de prefixos em memória)
+# ----------------------
+# Os formulários de abastecimento e os filtros dos relatórios pedem veículo e motorista
+# digitando parte da placa, do nome ou do documento, em vez de carregar a frota inteira
+# num <select>. Cada lista guarda pares (chave normalizada, id) ordenados e a busca por
+# prefixo é um bisect seguido da varredura das chaves que começam com o texto digitado.
+#
+# Chaves: a placa sem pontuação (ABC1D23); cada sufixo do nome a partir de um início de
+# palavra ("JOSE PEDRO SILVA", "PEDRO SILVA", "SILVA"), sem acentos; e o documento só com
+# letras e dígitos. Há uma lista com todos os cadastros e uma por setor: o do veículo
+# (Veiculo.tipo) e, para o motorista, o do cadastro mais os setores dos veículos que ele
+# já abasteceu (o mesmo critério das listas que os formulários usavam).
+#
+# O índice é montado na primeira consulta e atualizado nas gravações (cadastro, edição e
+# exclusão de veículos e motoristas, novos abastecimentos); a troca de setor de um veículo
+# muda os vínculos dos motoristas e descarta o índice, refeito na consulta seguinte.
+# Essas atualizações só alcançam o processo que gravou: com SERVIDOR_PROCESSOS > 1 cada
+# consulta confere antes o contador de cadastros (versoes) e refaz o índice quando outro
+# processo cadastrou, editou ou excluiu; abastecimentos lançados por outros processos
+# (ids acima do último visto) só acrescentam vínculos motorista/setor.
+
+LIMITE_PADRAO = 20
+LIMITE_MAXIMO = 50
+
+
+def normalizar(texto):
+    """Palavras do texto em maiúsculas, sem acentos e sem pontuação ("578.019.643-57" vira uma palavra só)."""
+    decomposto = unicodedata.normalize('NFKD', re.sub(r"(?<=\d)[.\-/](?=\d)", "", texto or ''))
+    limpo = ''.join(
+        caractere if caractere.isalnum() else ' '
+        for caractere in decomposto if not unicodedata.combining(caractere)
+    )
+    return limpo.upper().split()
+
+
+def chave_placa(placa):
+    return ''.join(normalizar(placa))
+
+
+class ListaPrefixos:
+    """Pares (chave, id) ordenados; busca por prefixo com bisect."""
+
+    def __init__(self, pares=()):
+        self._pares = sorted(pares)
+
+    def __len__(self):
+        return len(self._pares)
+
+    def inserir(self, chaves, registro_id):
+        for chave in chaves:
+            insort(self._pares, (chave, registro_id))
+
+    def remover(self, chaves, registro_id):
+        for chave in chaves:
+            posicao = bisect_left(self._pares, (chave, registro_id))
+            if posicao < len(self._pares) and self._pares[posicao] == (chave, registro_id):
+                del self._pares[posicao]
+
+    def buscar(self, prefixo):
+        """Ids das chaves que começam com o prefixo, na ordem das chaves (pode repetir id)."""
+        # (prefixo,) vem antes de qualquer (prefixo..., id)
+        posicao = bisect_left(self._pares, (prefixo,))
+        while posicao < len(self._pares) and self._pares[posicao][0].startswith(prefixo):
+            yield self._pares[posicao][1]
+            posicao += 1
+
+
+class Entidade:
+    """Registros de um tipo (veículos ou motoristas) e suas listas por setor (None = todos)."""
+
+    def __init__(self, juntar_termos):
+        # Placas não têm espaços: "abc 1d" é o prefixo ABC1D
+        self.juntar_termos = juntar_termos
+        self.registros = {}  # id -> (chaves, palavras, setores, item)
+        self.listas = {None: ListaPrefixos()}
+
+    def carregar(self, registros):
+        """Monta todas as listas de uma vez (uma ordenação por lista em vez de inserções)."""
+        self.registros = dict(registros)
+        pares = {None: []}
+        for registro_id, (chaves, _, setores, _) in self.registros.items():
+            for setor in (None, *setores):
+                pares.setdefault(setor, []).extend((chave, registro_id) for chave in chaves)
+        self.listas = {setor: ListaPrefixos(lista) for setor, lista in pares.items()}
+
+    def colocar(self, registro_id, chaves, palavras, setores, item):
+        self.tirar(registro_id)
+        self.registros[registro_id] = (chaves, palavras, setores, item)
+        for setor in (None, *setores):
+            self.listas.setdefault(setor, ListaPrefixos()).inserir(chaves, registro_id)
+
+    def tirar(self, registro_id):
+        registro = self.registros.pop(registro_id, None)
+        if registro is None:
+            return None
+        chaves, _, setores, _ = registro
+        for setor in (None, *setores):
+            self.listas[setor].remover(chaves, registro_id)
+        return registro
+
+    def vincular(self, registro_id, setor):
+        registro = self.registros.get(registro_id)
+        if registro is None or not setor or setor in registro[2]:
+            return
+        chaves, palavras, setores, item = registro
+        self.registros[registro_id] = (chaves, palavras, setores | {setor}, item)
+        self.listas.setdefault(setor, ListaPrefixos()).inserir(chaves, registro_id)
+
+    def buscar(self, texto, setor=None, limite=LIMITE_PADRAO):
+        termos = normalizar(texto)
+        if not termos:
+            return []
+        if self.juntar_termos:
+            termos = [''.join(termos)]
+        lista = self.listas.get(setor)
+        if lista is None:
+            return []
+        # O termo mais longo restringe mais a varredura; os demais precisam iniciar alguma palavra
+        principal = max(termos, key=len)
+        outros = [termo for termo in termos if termo is not principal]
+        vistos, itens = set(), []
+        for registro_id in lista.buscar(principal):
+            if registro_id in vistos:
+                continue
+            vistos.add(registro_id)
+            palavras = self.registros[registro_id][1]
+            if all(any(palavra.startswith(termo) for palavra in palavras) for termo in outros):
+                itens.append(self.registros[registro_id][3])
+                if len(itens) >= limite:
+                    break
+        return itens
+
+
+def _registro_veiculo(veiculo_id, placa, tipo, combustivel):
+    chave = chave_placa(placa)
+    item = {
+        'id': veiculo_id, 'texto': f"{placa} ({tipo})", 'detalhe': combustivel,
+        'placa': placa, 'setor': tipo, 'combustivel': combustivel,
+    }
+    return (chave,), (chave,), frozenset([tipo] if tipo else []), item
+
+
+def _registro_motorista(motorista_id, nome, documento, setores):
+    palavras = normalizar(nome)
+    chaves = {' '.join(palavras[inicio:]) for inicio in range(len(palavras))}
+    partes = normalizar(documento)
+    documento_normalizado = ''.join(partes)
+    # O documento inteiro e cada trecho final dele ("MG 12345678": MG12345678 e 12345678)
+    chaves.update(''.join(partes[inicio:]) for inicio in range(len(partes)))
+    item = {'id': motorista_id, 'texto': nome, 'detalhe': documento, 'nome': nome, 'documento': documento}
+    return (tuple(chaves), (*palavras, *partes, documento_normalizado),
+            frozenset(setor for setor in setores if setor), item)
+
+
+class IndiceAutocompletar:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._geracao = 0
+        self._veiculos = None
+        self._motoristas = None
+        self._ultimo_id = 0  # maior id de abastecimento com vínculos já no índice
+        self.versao = versoes.VersaoCompartilhada('cadastros')
+
+    @property
+    def construido(self):
+        return self._veiculos is not None
+
+    def construir(self):
+        """Lê veículos, motoristas e os setores em que cada motorista já abasteceu."""
+        with self._trava:
+            geracao = self._geracao
+        conexao = db.session.connection()
+        ultimo_id = conexao.execute(select(func.max(Abastecimento.id))).scalar() or 0
+        veiculos = Entidade(juntar_termos=True)
+        veiculos.carregar(
+            (veiculo_id, _registro_veiculo(veiculo_id, placa, tipo, combustivel))
+            for veiculo_id, placa, tipo, combustivel in conexao.execute(
+                select(Veiculo.id, Veiculo.placa, Veiculo.tipo, Veiculo.combustivel)
+            )
+        )
+        setores_motorista = {}
+        for motorista_id, setor in conexao.execute(
+            select(Abastecimento.motorista_id, Veiculo.tipo).join(
+                Veiculo, Veiculo.id == Abastecimento.veiculo_id
+            ).distinct()
+        ):
+            setores_motorista.setdefault(motorista_id, set()).add(setor)
+        motoristas = Entidade(juntar_termos=False)
+        motoristas.carregar(
+            (motorista_id, _registro_motorista(
+                motorista_id, nome, documento, setores_motorista.get(motorista_id, set()) | {setor}
+            ))
+            for motorista_id, nome, documento, setor in conexao.execute(
+                select(Motorista.id, Motorista.nome_completo, Motorista.documento, Motorista.setor)
+            )
+        )
+        with self._trava:
+            # Uma gravação durante a leitura pode ter deixado o índice velho: não guarda
+            if self._geracao == geracao:
+                self._veiculos, self._motoristas = veiculos, motoristas
+                self._ultimo_id = ultimo_id
+        return veiculos, motoristas
+
+    def _sincronizar(self):
+        """Com vários processos, aplica o que outros processos gravaram desde a consulta anterior."""
+        if not versoes.ativo:
+            return
+        if self.versao.mudou():
+            self.invalidar()
+            return
+        with self._trava:
+            if self._veiculos is None:
+                return
+            anterior = self._ultimo_id
+        ultimo = db.session.scalar(select(func.max(Abastecimento.id))) or 0
+        if ultimo > anterior:
+            self.vincular_ids((anterior + 1, ultimo))
+            with self._trava:
+                self._ultimo_id = max(self._ultimo_id, ultimo)
+
+    def _entidades(self):
+        """(veículos, motoristas, acerto); constrói o índice se preciso."""
+        self._sincronizar()
+        with self._trava:
+            veiculos, motoristas = self._veiculos, self._motoristas
+        if veiculos is not None:
+            return veiculos, motoristas, True
+        return (*self.construir(), False)
+
+    def buscar_veiculos(self, texto, setor=None, limite=LIMITE_PADRAO):
+        """([itens], acerto) dos veículos cuja placa começa com o texto."""
+        veiculos, _, acerto = self._entidades()
+        with self._trava:
+            return veiculos.buscar(texto, setor, limite), acerto
+
+    def buscar_motoristas(self, texto, setor=None, limite=LIMITE_PADRAO):
+        """([itens], acerto) dos motoristas com palavras do nome ou documento começando com o texto."""
+        _, motoristas, acerto = self._entidades()
+        with self._trava:
+            return motoristas.buscar(texto, setor, limite), acerto
+
+    # ----------------------
+    # Atualização (chamada depois do commit)
+    # ----------------------
+    def _alterar(self, funcao):
+        with self._trava:
+            self._geracao += 1
+            if self._veiculos is not None:
+                funcao(self._veiculos, self._motoristas)
+
+    def invalidar(self):
+        with self._trava:
+            self._geracao += 1
+            self._veiculos = self._motoristas = None
+
+    def atualizar_veiculo(self, veiculo):
+        """Cadastro ou edição; a troca de setor refaz o índice (vínculos dos motoristas)."""
+        registro = _registro_veiculo(veiculo.id, veiculo.placa, veiculo.tipo, veiculo.combustivel)
+        with self._trava:
+            anterior = self._veiculos.registros.get(veiculo.id) if self._veiculos is not None else None
+        if anterior is not None and anterior[2] != registro[2]:
+            self.invalidar()
+            return
+        self._alterar(lambda veiculos, _: veiculos.colocar(veiculo.id, *registro))
+
+    def remover_veiculo(self, veiculo_id):
+        self._alterar(lambda veiculos, _: veiculos.tirar(veiculo_id))
+
+    def atualizar_motorista(self, motorista, novo=False):
+        """Cadastro ou edição; na edição relê os setores em que ele já abasteceu."""
+        if not self.construido:
+            return
+        setores = {motorista.setor} if novo else setores_abastecidos(motorista.id) | {motorista.setor}
+        registro = _registro_motorista(motorista.id, motorista.nome_completo, motorista.documento, setores)
+        self._alterar(lambda _, motoristas: motoristas.colocar(motorista.id, *registro))
+
+    def remover_motorista(self, motorista_id):
+        self._alterar(lambda _, motoristas: motoristas.tirar(motorista_id))
+
+    def vincular_ids(self, ids):
+        """Novos abastecimentos: o motorista passa a aparecer no setor do veículo."""
+        if not ids or not self.construido:
+            return
+        # Lotes importados têm ids contíguos: uma faixa em vez de um IN com milhares de parâmetros.
+        # Outros abastecimentos da faixa só repetem vínculos que já valem.
+        pares = db.session.execute(
+            select(Abastecimento.motorista_id, Veiculo.tipo).join(
+                Veiculo, Veiculo.id == Abastecimento.veiculo_id
+            ).filter(Abastecimento.id.between(min(ids), max(ids))).distinct()
+        ).all()
+
+        def alterar(_, motoristas):
+            for motorista_id, setor in pares:
+                motoristas.vincular(motorista_id, setor)
+        self._alterar(alterar)
+
+
+def setores_abastecidos(motorista_id):
+    """Setores dos veículos que o motorista já abasteceu."""
+    return set(db.session.scalars(
+        select(Veiculo.tipo).join(Abastecimento, Abastecimento.veiculo_id == Veiculo.id)
+        .filter(Abastecimento.motorista_id == motorista_id).distinct()
+    ))
+
+
+indice = IndiceAutocompletar()
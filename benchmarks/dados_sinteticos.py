@@ -0,0 +1,243 @@
+"""Gerador determinístico de dados sintéticos para benchmarks.
+
+Uso: python benchmarks/dados_sinteticos.py BANCO [--abastecimentos N] [--setores N]
+     [--veiculos N] [--motoristas N] [--contratos-por-setor N] [--semente N]
+
+Cria um banco SQLite novo com setores, usuários, veículos, motoristas, contratos com
+itens e aditivos e de 10 mil a 5 milhões de abastecimentos. Com a mesma semente e os
+mesmos parâmetros o banco gerado é sempre o mesmo.
+
+- Nomes, placas, CPFs e fornecedores vêm do Faker (pt_BR).
+- As colunas dos abastecimentos são geradas com NumPy e gravadas com executemany
+  direto na conexão SQLite.
+- O hodômetro cresce por veículo e os litros seguem o consumo do veículo.
+- Há uma pequena fração de anomalias (tanque excedido, hodômetro voltando) e de notas
+  repetidas, para que os relatórios de auditoria tenham o que mostrar.
+
+Usuários criados (senha "benchmark"): benchmark@local (admin) e setorN@local (um por setor).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+from faker import Faker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+from database import db, chave_nota
+
+SENHA = 'benchmark'
+NOMES_SETORES = [
+    'Saúde', 'Educação', 'Obras', 'Administração', 'Transporte', 'Assistência Social',
+    'Agricultura', 'Meio Ambiente', 'Cultura', 'Esporte', 'Segurança', 'Finanças',
+]
+# Combustível -> (participação na frota, km/L médio, faixa de capacidade do tanque, preço inicial)
+COMBUSTIVEIS = {
+    'Gasolina': (0.35, 10.5, (45, 60), 5.20),
+    'Flex': (0.25, 9.5, (45, 55), 5.00),
+    'Álcool': (0.10, 7.0, (45, 55), 3.60),
+    'Diesel': (0.30, 4.0, (150, 300), 5.60),
+}
+INICIO = datetime(2021, 1, 1)
+ANOS = 5
+TAMANHO_BLOCO = 100_000
+
+
+def proporcoes(abastecimentos, setores=12, veiculos=None, motoristas=None):
+    """Tamanho da frota proporcional ao volume: ~400 abastecimentos por veículo em 5 anos."""
+    veiculos = veiculos or max(25, abastecimentos // 400)
+    motoristas = motoristas or max(30, veiculos * 3 // 2)
+    return setores, veiculos, motoristas
+
+
+def _nomes_setores(quantidade):
+    return [NOMES_SETORES[i] if i < len(NOMES_SETORES) else f'Setor {i + 1}' for i in range(quantidade)]
+
+
+def _unicos(gerar, quantidade):
+    valores, vistos = [], set()
+    while len(valores) < quantidade:
+        valor = gerar()
+        if valor not in vistos:
+            vistos.add(valor)
+            valores.append(valor)
+    return valores
+
+
+def _inserir(conexao, tabela, colunas, linhas):
+    marcadores = ', '.join('?' * len(colunas))
+    conexao.executemany(f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({marcadores})", linhas)
+
+
+def gerar(caminho, abastecimentos=10_000, setores=12, veiculos=None, motoristas=None,
+          contratos_por_setor=ANOS, semente=42):
+    """Cria o banco em `caminho` (substituindo um existente) e retorna um resumo do que foi gerado."""
+    setores, veiculos, motoristas = proporcoes(abastecimentos, setores, veiculos, motoristas)
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    falso = Faker('pt_BR')
+    falso.seed_instance(semente)
+    aleatorio = np.random.default_rng(semente)
+    nomes_setores = _nomes_setores(setores)
+    senha_hash = generate_password_hash(SENHA)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath(caminho)}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.commit()
+        bruta = db.engine.raw_connection()
+    conexao = bruta.driver_connection
+    conexao.execute("PRAGMA synchronous = OFF")
+    conexao.execute("PRAGMA journal_mode = MEMORY")
+    agora = datetime(2026, 1, 1).isoformat(' ')
+
+    # Usuários: um administrador e um por setor
+    _inserir(conexao, 'user', ('nome', 'email', 'senha_hash', 'tipo', 'setor', 'data_criacao'),
+             [('Benchmark', 'benchmark@local', senha_hash, 'admin', None, agora)] +
+             [(f'Usuário {nome}', f'setor{i}@local', senha_hash, 'departamento', nome, agora)
+              for i, nome in enumerate(nomes_setores)])
+
+    # Frota
+    nomes_combustiveis = list(COMBUSTIVEIS)
+    participacao = np.array([COMBUSTIVEIS[c][0] for c in nomes_combustiveis])
+    combustivel_veiculo = aleatorio.choice(len(nomes_combustiveis), size=veiculos, p=participacao)
+    setor_veiculo = aleatorio.integers(0, setores, size=veiculos)
+    capacidade = np.array([aleatorio.uniform(*COMBUSTIVEIS[nomes_combustiveis[c]][2]) for c in combustivel_veiculo]).round(0)
+    km_por_litro = np.array([COMBUSTIVEIS[nomes_combustiveis[c]][1] for c in combustivel_veiculo]) * aleatorio.uniform(0.8, 1.2, veiculos)
+    placas = _unicos(lambda: falso.license_plate().replace('-', ''), veiculos)
+    _inserir(conexao, 'veiculo', ('id', 'placa', 'tipo', 'combustivel', 'capacidade_tanque'), [
+        (i + 1, placas[i], nomes_setores[setor_veiculo[i]], nomes_combustiveis[combustivel_veiculo[i]], float(capacidade[i]))
+        for i in range(veiculos)
+    ])
+
+    # Motoristas, cada um de um setor
+    setor_motorista = aleatorio.integers(0, setores, size=motoristas)
+    documentos = _unicos(falso.cpf, motoristas)
+    _inserir(conexao, 'motorista', ('id', 'nome_completo', 'documento', 'observacoes', 'setor'), [
+        (i + 1, falso.name(), documentos[i], None, nomes_setores[setor_motorista[i]]) for i in range(motoristas)
+    ])
+    motoristas_por_setor = [np.flatnonzero(setor_motorista == s) + 1 for s in range(setores)]
+    for s in range(setores):
+        if not len(motoristas_por_setor[s]):
+            motoristas_por_setor[s] = np.arange(1, motoristas + 1)
+
+    # Contratos anuais por setor, com um item por combustível e aditivos em parte deles
+    litros_anuais = abastecimentos * 45.0 / ANOS / setores
+    contratos, itens, aditivos = [], [], []
+    contrato_por_setor_ano = {}
+    fornecedores = [falso.company() for _ in range(max(3, setores // 2))]
+    for s, nome in enumerate(nomes_setores):
+        for ano in range(contratos_por_setor):
+            contrato_id = len(contratos) + 1
+            inicio = date(INICIO.year + ano, 1, 1)
+            contratos.append((contrato_id, f'{100 + s:03d}{ano:02d}', inicio.year, inicio, date(inicio.year, 12, 31),
+                               fornecedores[(s + ano) % len(fornecedores)], None, nome, 1, agora))
+            contrato_por_setor_ano[(s, ano)] = contrato_id
+            for combustivel in nomes_combustiveis:
+                quantidade = round(litros_anuais * COMBUSTIVEIS[combustivel][0] * aleatorio.uniform(0.8, 1.3))
+                preco = round(COMBUSTIVEIS[combustivel][3] * (1.06 ** ano), 2)
+                itens.append((len(itens) + 1, contrato_id, combustivel, quantidade, round(quantidade * preco, 2), preco))
+            sorteio = aleatorio.random()
+            if sorteio < 0.15:
+                aditivos.append((contrato_id, 'Prorrogação', 'Prorrogação por 3 meses', date(inicio.year, 11, 1),
+                                 None, None, date(inicio.year + 1, 3, 31)))
+            elif sorteio < 0.25:
+                quantidade = sum(item[3] for item in itens if item[1] == contrato_id)
+                aditivos.append((contrato_id, 'Aumento', 'Acréscimo de 25%', date(inicio.year, 9, 1),
+                                 None, round(quantidade * 1.25), None))
+            elif sorteio < 0.35:
+                valor = sum(item[4] for item in itens if item[1] == contrato_id)
+                aditivos.append((contrato_id, 'Reajuste', 'Reajuste de preço', date(inicio.year, 7, 1),
+                                 round(valor * 1.08, 2), None, None))
+    _inserir(conexao, 'contrato_combustivel', ('id', 'numero_contrato', 'ano_contrato', 'data_inicio_contrato',
+             'data_fim_contrato', 'fornecedor', 'observacoes', 'setor', 'ativo', 'data_criacao'),
+             [tuple(str(v) if isinstance(v, date) else v for v in contrato) for contrato in contratos])
+    _inserir(conexao, 'contrato_combustivel_item', ('id', 'contrato_id', 'tipo_combustivel', 'quantidade',
+             'valor_total', 'valor_por_litro'), itens)
+    _inserir(conexao, 'aditivo_contrato_combustivel', ('contrato_id', 'tipo_aditivo', 'descricao', 'data_aditivo',
+             'novo_valor_total', 'nova_quantidade_total', 'nova_data_fim'),
+             [tuple(str(v) if isinstance(v, date) else v for v in aditivo) for aditivo in aditivos])
+
+    # Abastecimentos, em ordem de veículo e data para o hodômetro crescer por veículo
+    segundos = aleatorio.integers(0, ANOS * 365 * 86400, size=abastecimentos)
+    veiculo = aleatorio.integers(0, veiculos, size=abastecimentos)
+    ordem = np.lexsort((segundos, veiculo))
+    segundos, veiculo = segundos[ordem], veiculo[ordem]
+    km = aleatorio.uniform(120, 600, size=abastecimentos)
+    inicio_grupo = np.r_[True, veiculo[1:] != veiculo[:-1]]
+    acumulado = np.cumsum(km)
+    base = np.maximum.accumulate(np.where(inicio_grupo, acumulado - km, 0))
+    hodometro = (aleatorio.integers(5_000, 80_000, size=veiculos)[veiculo] + acumulado - base).astype(np.int64)
+    litros = np.minimum(km / km_por_litro[veiculo] * aleatorio.normal(1, 0.05, abastecimentos), capacidade[veiculo])
+    # Anomalias: ~0,3% acima do tanque e ~0,2% com hodômetro menor que o anterior
+    excesso = aleatorio.random(abastecimentos) < 0.003
+    litros[excesso] = capacidade[veiculo[excesso]] * aleatorio.uniform(1.1, 1.5, int(excesso.sum()))
+    retrocesso = (aleatorio.random(abastecimentos) < 0.002) & ~inicio_grupo
+    hodometro[retrocesso] -= aleatorio.integers(500, 5000, int(retrocesso.sum()))
+    litros = litros.round(2)
+    ano = np.minimum(segundos // (365 * 86400), ANOS - 1)
+    combustivel = combustivel_veiculo[veiculo]
+    preco_base = np.array([COMBUSTIVEIS[c][3] for c in nomes_combustiveis])[combustivel]
+    preco = preco_base * (1.06 ** (segundos / (365 * 86400))) * aleatorio.normal(1, 0.02, abastecimentos)
+    valor = (litros * preco).round(2)
+    setor = setor_veiculo[veiculo]
+    contrato = np.array([contrato_por_setor_ano.get((s, a), 0) for s, a in zip(setor.tolist(), ano.tolist())])
+    contrato[aleatorio.random(abastecimentos) < 0.2] = 0
+    notas = np.arange(100_000, 100_000 + abastecimentos)
+    # ~0,2% de notas lançadas de novo (mesmo número e contrato de um abastecimento anterior)
+    repetidas = np.flatnonzero(aleatorio.random(abastecimentos) < 0.002)
+    repetidas = repetidas[repetidas > 0]
+    notas[repetidas] = notas[repetidas - 1]
+    contrato[repetidas] = contrato[repetidas - 1]
+    motorista = np.empty(abastecimentos, dtype=np.int64)
+    for s in range(setores):
+        linhas_setor = np.flatnonzero(setor == s)
+        motorista[linhas_setor] = aleatorio.choice(motoristas_por_setor[s], size=len(linhas_setor))
+
+    colunas = ('data', 'veiculo_id', 'motorista_id', 'hodometro', 'litros', 'valor_total', 'numero_nota',
+               'observacoes', 'combustivel', 'contrato_id', 'chave_nota')
+    for inicio in range(0, abastecimentos, TAMANHO_BLOCO):
+        fatia = slice(inicio, inicio + TAMANHO_BLOCO)
+        linhas = []
+        for data, v, m, h, l, val, nota, c, comb in zip(
+            (np.datetime64(INICIO, 's') + segundos[fatia]).astype(str).tolist(), (veiculo[fatia] + 1).tolist(), motorista[fatia].tolist(), hodometro[fatia].tolist(),
+            litros[fatia].tolist(), valor[fatia].tolist(), notas[fatia].tolist(), contrato[fatia].tolist(),
+            combustivel[fatia].tolist()
+        ):
+            numero = str(nota)
+            linhas.append((data.replace('T', ' ') + '.000000', v, m, h, l, val, numero, None,
+                           nomes_combustiveis[comb], c or None, chave_nota(c, numero)))
+        _inserir(conexao, 'abastecimento', colunas, linhas)
+    conexao.commit()
+    bruta.close()
+    return {
+        'abastecimentos': abastecimentos, 'setores': setores, 'veiculos': veiculos, 'motoristas': motoristas,
+        'contratos': len(contratos), 'itens': len(itens), 'aditivos': len(aditivos), 'semente': semente,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('banco')
+    parser.add_argument('--abastecimentos', type=int, default=10_000)
+    parser.add_argument('--setores', type=int, default=12)
+    parser.add_argument('--veiculos', type=int)
+    parser.add_argument('--motoristas', type=int)
+    parser.add_argument('--contratos-por-setor', type=int, default=ANOS)
+    parser.add_argument('--semente', type=int, default=42)
+    argumentos = parser.parse_args()
+    inicio = time.perf_counter()
+    resumo = gerar(argumentos.banco, argumentos.abastecimentos, argumentos.setores, argumentos.veiculos,
+                   argumentos.motoristas, argumentos.contratos_por_setor, argumentos.semente)
+    print(f"{resumo} em {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark da ingestão de NF-e: leitura serial x pool de processos e gravação em lote.
+
+Uso: python benchmarks/ingestao_nfe.py [quantidade_de_notas]
+
+Gera um ZIP com NF-e sintéticas (10 mil por padrão, 3% repetidas e 1% de placas
+desconhecidas) sobre um banco SQLite temporário populado como em memoria_relatorio.py,
+lê os XMLs das duas formas e mede a ingestão completa.
+"""
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database import db
+from importacao import ImportadorNFe
+from memoria_relatorio import popular
+import nfe
+
+MODELO = """<?xml version="1.0" encoding="UTF-8"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe><infNFe Id="NFe{numero}" versao="4.00">
+<ide><cUF>35</cUF><nNF>{numero}</nNF><dhEmi>{data}-03:00</dhEmi></ide>
+<emit><CNPJ>12345678000199</CNPJ><xNome>Posto Benchmark Ltda</xNome></emit>
+<dest><CNPJ>98765432000155</CNPJ><xNome>Prefeitura</xNome></dest>
+<det nItem="1"><prod><cProd>1</cProd><xProd>OLEO DIESEL S10</xProd><uCom>L</uCom><qCom>{litros:.4f}</qCom><vUnCom>6.10</vUnCom><vProd>{valor:.2f}</vProd>
+<comb><cProdANP>820101034</cProdANP></comb></prod></det>
+<det nItem="2"><prod><cProd>2</cProd><xProd>ARLA 32</xProd><uCom>UN</uCom><qCom>1</qCom><vProd>35.00</vProd></prod></det>
+<total><ICMSTot><vNF>{total:.2f}</vNF></ICMSTot></total>
+<infAdic><infCpl>PLACA {placa} CPF {cpf} KM: {km}</infCpl></infAdic>
+</infNFe></NFe></nfeProc>"""
+
+
+def gerar_zip(quantidade, veiculos=500, motoristas=800):
+    aleatorio = random.Random(7)
+    inicio = datetime(2024, 1, 1)
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for i in range(quantidade):
+            # Algumas notas repetidas e algumas de veículos fora do cadastro
+            numero = 900000 + (i - 1 if i and i % 33 == 0 else i)
+            placa = f'BEN{aleatorio.randint(1, veiculos):04d}' if i % 100 else 'ZZZ9999'
+            litros = aleatorio.uniform(10, 80)
+            pacote.writestr(f'nfe_{i:06d}.xml', MODELO.format(
+                numero=numero,
+                data=(inicio + timedelta(minutes=aleatorio.randrange(0, 60 * 24 * 365))).isoformat(timespec='seconds'),
+                litros=litros, valor=litros * 6.1, total=litros * 6.1 + 35,
+                placa=placa, cpf=f'{aleatorio.randint(1, motoristas):011d}', km=aleatorio.randint(1000, 400000),
+            ))
+    return saida.getvalue()
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    pasta = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(pasta, 'benchmark.db')}"
+    db.init_app(app)
+
+    inicio = time.perf_counter()
+    conteudo = gerar_zip(quantidade)
+    print(f"ZIP com {quantidade} notas: {len(conteudo) / 2**20:.1f} MiB em {time.perf_counter() - inicio:.2f}s")
+    origens = nfe.origens_zip(conteudo)
+
+    inicio = time.perf_counter()
+    serial = nfe.ler_lote(origens, processos=1)
+    print(f"{'Leitura serial':<26} {time.perf_counter() - inicio:7.2f}s")
+    inicio = time.perf_counter()
+    paralelo = nfe.ler_lote(origens)
+    print(f"{'Leitura em pool':<26} {time.perf_counter() - inicio:7.2f}s  ({os.cpu_count()} núcleos)")
+    assert [dados for _, dados in serial if isinstance(dados, dict)] == \
+           [dados for _, dados in paralelo if isinstance(dados, dict)]
+
+    with app.app_context():
+        db.create_all()
+        popular(20_000)
+        inicio = time.perf_counter()
+        resultado = ImportadorNFe().importar(nfe.ler_lote(origens))
+        print(f"{'Ingestão completa':<26} {time.perf_counter() - inicio:7.2f}s  "
+              f"importadas={resultado.importados}  erros={len(resultado.erros)}")
+
+
+if __name__ == "__main__":
+    main()
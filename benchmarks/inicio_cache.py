@@ -0,0 +1,61 @@
+"""Benchmark de inicialização do cache colunar: montagem via SQL x snapshot Arrow.
+
+Uso: python benchmarks/inicio_cache.py [quantidade_de_abastecimentos]
+
+Cria um banco SQLite temporário com dados sintéticos e mede o tempo para deixar o
+cache pronto lendo a tabela inteira do SQLite e abrindo o snapshot mapeado em memória.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database import db
+from cache_colunar import CacheColunar
+from snapshot_colunar import SnapshotColunar, versao_banco
+import versoes
+from memoria_relatorio import popular
+
+
+def medir(nome, preparar):
+    inicio = time.perf_counter()
+    cache = preparar()
+    duracao = time.perf_counter() - inicio
+    print(f"{nome:<28} linhas={len(cache):>8}  tempo={duracao * 1000:9.1f} ms")
+    return cache
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    pasta = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(pasta, 'benchmark.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        popular(total)
+        versoes.instalar()
+        db.session.commit()
+
+        cache = medir("Montagem via SQL (antes)", lambda: _construir(CacheColunar()))
+        snapshot = SnapshotColunar(os.path.join(pasta, 'cache_colunar'))
+        snapshot.salvar(cache, versao_banco())
+        medir("Snapshot mapeado (depois)", lambda: _abrir(snapshot, CacheColunar()))
+
+
+def _construir(cache):
+    cache.construir()
+    return cache
+
+
+def _abrir(snapshot, cache):
+    if not snapshot.abrir(cache):
+        raise RuntimeError("snapshot desatualizado")
+    return cache
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark de inicialização: tempo de importação do app e tempo até a primeira tela.
+
+Uso: python benchmarks/inicio_rapido.py [executavel] [repeticoes]
+
+Sem argumentos, mede `python main.py`. Para o executável gerado pelo PyInstaller,
+informe o caminho dele (ex.: "dist/Gestão de Combustível.exe"). O programa é iniciado
+com --sem-janela em uma pasta temporária com uma cópia de instance/database.db, e são
+medidos o tempo até /saude responder (servidor pronto) e até /login ser renderizado
+(primeira tela), com o modo de início rápido ligado e desligado.
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from main import URL
+
+
+def preparar_pasta():
+    pasta = tempfile.mkdtemp()
+    os.makedirs(os.path.join(pasta, 'instance'))
+    banco = os.path.join(RAIZ, 'instance', 'database.db')
+    if os.path.exists(banco):
+        shutil.copy(banco, os.path.join(pasta, 'instance', 'database.db'))
+    return pasta
+
+
+def tempo_importacao(ambiente):
+    pasta = preparar_pasta()
+    codigo = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=pasta, env=ambiente,
+                           capture_output=True, text=True, check=True).stdout
+    shutil.rmtree(pasta, ignore_errors=True)
+    return float(saida.strip().splitlines()[-1])
+
+
+def aguardar(caminho, inicio, limite=60):
+    while time.perf_counter() - inicio < limite:
+        try:
+            with urllib.request.urlopen(URL + caminho, timeout=1) as resposta:
+                resposta.read()
+                if resposta.status == 200:
+                    return time.perf_counter() - inicio
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError(f"{caminho} não respondeu em {limite}s")
+
+
+def tempo_primeira_tela(comando, ambiente):
+    pasta = preparar_pasta()
+    inicio = time.perf_counter()
+    processo = subprocess.Popen(comando + ['--sem-janela'], cwd=pasta, env=ambiente,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        pronto = aguardar('/saude', inicio)
+        primeira_tela = aguardar('/login', inicio)
+    finally:
+        processo.terminate()
+        processo.wait()
+        shutil.rmtree(pasta, ignore_errors=True)
+    return pronto, primeira_tela
+
+
+def main():
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        comando = [os.path.abspath(sys.argv[1])]
+        repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    else:
+        comando = [sys.executable, os.path.join(RAIZ, 'main.py')]
+        repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    for rapido in ('0', '1'):
+        ambiente = dict(os.environ, CACHE_COLUNAR='1', INICIO_RAPIDO=rapido, PYTHONPATH=RAIZ)
+        importacoes = [tempo_importacao(ambiente) for _ in range(repeticoes)]
+        medicoes = [tempo_primeira_tela(comando, ambiente) for _ in range(repeticoes)]
+        nome = "Início rápido" if rapido == '1' else "Início padrão"
+        print(f"{nome:<16} import app={statistics.median(importacoes) * 1000:8.1f} ms  "
+              f"/saude={statistics.median(m[0] for m in medicoes) * 1000:8.1f} ms  "
+              f"primeira tela={statistics.median(m[1] for m in medicoes) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark de memória do relatório de abastecimentos: entidades ORM x registros leves.
+
+Uso: python benchmarks/memoria_relatorio.py [quantidade_de_abastecimentos]
+
+Cria um banco SQLite temporário com dados sintéticos, carrega o relatório completo
+das duas formas e mede o pico de memória alocada com tracemalloc.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database import db, Veiculo, Motorista, Abastecimento
+from consultas import listar_abastecimentos, consulta_abastecimentos
+
+
+def popular(total, veiculos=500, motoristas=800):
+    aleatorio = random.Random(42)
+    inicio = datetime(2020, 1, 1)
+    db.session.execute(Veiculo.__table__.insert(), [
+        {'id': i, 'placa': f'BEN{i:04d}', 'tipo': f'Setor {i % 12}', 'combustivel': 'Diesel' if i % 3 else 'Gasolina'}
+        for i in range(1, veiculos + 1)
+    ])
+    db.session.execute(Motorista.__table__.insert(), [
+        {'id': i, 'nome_completo': f'Motorista {i}', 'documento': f'{i:011d}', 'setor': f'Setor {i % 12}'}
+        for i in range(1, motoristas + 1)
+    ])
+    lote = []
+    for i in range(1, total + 1):
+        litros = round(aleatorio.uniform(10, 80), 2)
+        lote.append({
+            'id': i,
+            'data': inicio + timedelta(minutes=aleatorio.randrange(0, 60 * 24 * 365 * 5)),
+            'veiculo_id': aleatorio.randint(1, veiculos),
+            'motorista_id': aleatorio.randint(1, motoristas),
+            'hodometro': aleatorio.randint(1000, 400000),
+            'litros': litros,
+            'valor_total': round(litros * 6.1, 2),
+            'numero_nota': str(100000 + i),
+            'observacoes': None,
+            'combustivel': 'Diesel',
+            'contrato_id': None,
+        })
+        if len(lote) == 20000:
+            db.session.execute(Abastecimento.__table__.insert(), lote)
+            lote = []
+    if lote:
+        db.session.execute(Abastecimento.__table__.insert(), lote)
+    db.session.commit()
+
+
+def medir(nome, carregar):
+    db.session.expunge_all()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    linhas = carregar()
+    # Acessa os mesmos atributos que o template do relatório
+    total = 0.0
+    for linha in linhas:
+        total += linha.litros
+        linha.veiculo.placa, linha.motorista.nome_completo, linha.veiculo.combustivel
+    duracao = time.perf_counter() - inicio
+    atual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nome:<28} linhas={len(linhas):>8}  tempo={duracao:7.2f}s  retido={atual / 2**20:8.1f} MiB  pico={pico / 2**20:8.1f} MiB")
+    del linhas
+    db.session.expunge_all()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    pasta = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(pasta, 'benchmark.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        popular(total)
+        consulta = lambda: consulta_abastecimentos().order_by(Abastecimento.data.desc())
+        medir("Entidades ORM (antes)", lambda: consulta().all())
+        medir("Registros leves (depois)", lambda: listar_abastecimentos(consulta()))
+
+
+if __name__ == "__main__":
+    main()
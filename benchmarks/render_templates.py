@@ -0,0 +1,99 @@
+"""Benchmark de renderização por página: primeira requisição x regime, por perfil.
+
+Uso: python benchmarks/render_templates.py [repeticoes]
+
+Para cada perfil (desenvolvimento, produção com cache de bytecode vazio e produção com
+o cache já preenchido) sobe o app em um processo novo, sobre uma cópia de
+instance/database.db, faz login como administrador e mede para cada página GET a
+latência da primeira requisição (compilação dos templates incluída) e a mediana das
+requisições seguintes.
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Exportações (PDF/CSV) não renderizam página e o PDF depende do WeasyPrint
+IGNORAR = ('/pdf', '/csv', '/logout', '/saude', '/static')
+
+
+def medir_paginas(repeticoes):
+    """Executado no processo filho: mede as páginas do app importado com o perfil do ambiente."""
+    sys.path.insert(0, RAIZ)
+    inicio = time.perf_counter()
+    from app import app, db
+    from database import User
+    from werkzeug.security import generate_password_hash
+    importacao = time.perf_counter() - inicio
+
+    with app.app_context():
+        if not User.query.filter_by(email='benchmark@local').first():
+            db.session.add(User(nome='Benchmark', email='benchmark@local', tipo='admin',
+                                senha_hash=generate_password_hash('benchmark')))
+            db.session.commit()
+    cliente = app.test_client()
+    cliente.post('/login', data={'email': 'benchmark@local', 'password': 'benchmark'})
+
+    paginas = {}
+    for regra in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if 'GET' not in regra.methods or regra.arguments - {'veiculo_id', 'motorista_id', 'abastecimento_id'}:
+            continue
+        if any(parte in regra.rule for parte in IGNORAR):
+            continue
+        url = regra.rule
+        for argumento in regra.arguments:
+            url = url.replace(f'<int:{argumento}>', '1')
+        tempos = []
+        for _ in range(repeticoes + 1):
+            inicio = time.perf_counter()
+            resposta = cliente.get(url)
+            tempos.append(time.perf_counter() - inicio)
+        if resposta.status_code == 200:
+            paginas[url] = (tempos[0], statistics.median(tempos[1:]))
+    print(json.dumps({'importacao': importacao, 'paginas': paginas}))
+
+
+def executar(perfil, pasta, repeticoes):
+    ambiente = dict(os.environ, PERFIL=perfil, INICIO_RAPIDO='0', PYTHONPATH=RAIZ)
+    saida = subprocess.run([sys.executable, os.path.abspath(__file__), '--filho', str(repeticoes)],
+                           cwd=pasta, env=ambiente, capture_output=True, text=True, check=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pasta = tempfile.mkdtemp()
+    os.makedirs(os.path.join(pasta, 'instance'))
+    shutil.copy(os.path.join(RAIZ, 'instance', 'database.db'), os.path.join(pasta, 'instance', 'database.db'))
+
+    cenarios = [
+        ('desenvolvimento', 'desenvolvimento'),
+        ('produção (cache vazio)', 'producao'),
+        ('produção (cache pronto)', 'producao'),
+    ]
+    resultados = []
+    for nome, perfil in cenarios:
+        resultados.append((nome, executar(perfil, pasta, repeticoes)))
+    shutil.rmtree(pasta, ignore_errors=True)
+
+    for nome, resultado in resultados:
+        print(f"\n== {nome}: import app {resultado['importacao'] * 1000:.1f} ms")
+        print(f"{'página':<45} {'1ª requisição':>14} {'regime':>10}")
+        for url, (primeira, regime) in resultado['paginas'].items():
+            print(f"{url:<45} {primeira * 1000:11.2f} ms {regime * 1000:7.2f} ms")
+        primeiras = [p for p, _ in resultado['paginas'].values()]
+        regimes = [r for _, r in resultado['paginas'].values()]
+        print(f"{'soma':<45} {sum(primeiras) * 1000:11.2f} ms {sum(regimes) * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == '--filho':
+        medir_paginas(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,240 @@
+"""Suíte de benchmark de todas as rotas GET sobre dados sintéticos em várias escalas.
+
+Uso: python benchmarks/rotas.py [--escalas 10000,100000,1000000] [--repeticoes 10]
+     [--saida rotas.json] [--comparar anterior.json] [--dados PASTA] [--tempo-maximo 30]
+
+Para cada escala:
+- gera (ou reaproveita da pasta --dados) um banco com dados_sinteticos.py;
+- sobe o app num processo novo sobre uma cópia desse banco;
+- faz login como administrador e mede, pelo cliente de testes do Flask, cada rota GET
+  do app, inclusive as exportações e visualizações de relatório.
+
+Métricas por rota:
+- latência da primeira requisição;
+- percentis p50/p90/p99 e máximo das seguintes;
+- número de instruções SQL;
+- tamanho da resposta;
+- pico de memória alocada (tracemalloc, numa requisição à parte).
+
+O resultado vai para um JSON com a máquina, o commit e os parâmetros dos dados.
+--comparar mostra a variação do p50 e do SQL em relação a um relatório anterior.
+Rotas que passam de --tempo-maximo segundos na primeira requisição não são repetidas.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Não são páginas: encerrariam a sessão ou servem arquivos estáticos
+IGNORAR = ('static', 'logout')
+
+
+def _percentis(tempos):
+    if not tempos:
+        return {}
+    ms = np.array(tempos) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+        'media_ms': round(float(ms.mean()), 3),
+    }
+
+
+def _parametros_url(app, db):
+    """Ids reais para preencher as rotas com parâmetros (primeiro registro de cada tabela)."""
+    from sqlalchemy import func
+    from database import Veiculo, Motorista, Abastecimento, ContratoCombustivel, AditivoContratoCombustivel, User
+    with app.app_context():
+        aditivo = AditivoContratoCombustivel.query.order_by(AditivoContratoCombustivel.id).first()
+        return {
+            'veiculo_id': db.session.query(func.min(Veiculo.id)).scalar(),
+            'motorista_id': db.session.query(func.min(Motorista.id)).scalar(),
+            'abastecimento_id': db.session.query(func.min(Abastecimento.id)).scalar(),
+            'contrato_id': aditivo.contrato_id if aditivo else db.session.query(func.min(ContratoCombustivel.id)).scalar(),
+            'aditivo_id': aditivo.id if aditivo else None,
+            'user_id': db.session.query(func.min(User.id)).scalar(),
+        }
+
+
+def medir_rotas(repeticoes, tempo_maximo):
+    """Executado no processo filho, dentro da pasta com instance/database.db."""
+    from flask import url_for
+    from sqlalchemy import event
+    inicio = time.perf_counter()
+    from app import app, db
+    importacao = time.perf_counter() - inicio
+
+    contador = {'sql': 0}
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def contar(conexao, cursor, sql, parametros, contexto, executemany):
+            contador['sql'] += 1
+
+    parametros = _parametros_url(app, db)
+    cliente = app.test_client()
+    resposta = cliente.post('/login', data={'email': 'benchmark@local', 'password': 'benchmark'})
+    if resposta.status_code != 302:
+        raise RuntimeError("login do usuário benchmark@local falhou (banco não gerado por dados_sinteticos.py?)")
+
+    rotas, nao_medidas = {}, []
+    for regra in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if regra.endpoint in IGNORAR:
+            continue
+        if 'GET' not in regra.methods:
+            nao_medidas.append(f"{','.join(sorted(regra.methods - {'OPTIONS'}))} {regra.rule}")
+            continue
+        valores = {argumento: parametros.get(argumento) for argumento in regra.arguments}
+        if None in valores.values():
+            nao_medidas.append(f"GET {regra.rule} (sem registro para os parâmetros)")
+            continue
+        with app.test_request_context():
+            url = url_for(regra.endpoint, **valores)
+
+        contador['sql'] = 0
+        inicio = time.perf_counter()
+        resposta = cliente.get(url)
+        primeira = time.perf_counter() - inicio
+        medida = {
+            'endpoint': regra.endpoint,
+            'status': resposta.status_code,
+            'bytes': len(resposta.data),
+            'sql': contador['sql'],
+            'primeira_ms': round(primeira * 1000, 3),
+        }
+        tempos = []
+        if primeira <= tempo_maximo:
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                cliente.get(url)
+                tempos.append(time.perf_counter() - inicio)
+            # Memória numa requisição à parte: o tracemalloc deixa a execução bem mais lenta
+            tracemalloc.start()
+            cliente.get(url)
+            medida['pico_memoria_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+        medida.update(_percentis(tempos))
+        rotas[url] = medida
+    print(json.dumps({
+        'importacao_app_s': round(importacao, 3),
+        'rotas': rotas,
+        'nao_medidas': nao_medidas,
+    }))
+
+
+def preparar_dados(escala, pasta_dados, semente):
+    from dados_sinteticos import gerar
+    caminho = os.path.join(pasta_dados, f'sintetico_{escala}_{semente}.db')
+    resumo_caminho = caminho + '.json'
+    if os.path.exists(caminho) and os.path.exists(resumo_caminho):
+        with open(resumo_caminho) as arquivo:
+            return caminho, json.load(arquivo)
+    inicio = time.perf_counter()
+    resumo = gerar(caminho, escala, semente=semente)
+    resumo['geracao_s'] = round(time.perf_counter() - inicio, 2)
+    with open(resumo_caminho, 'w') as arquivo:
+        json.dump(resumo, arquivo)
+    return caminho, resumo
+
+
+def executar(banco, repeticoes, tempo_maximo):
+    pasta = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(pasta, 'instance'))
+        shutil.copy(banco, os.path.join(pasta, 'instance', 'database.db'))
+        ambiente = dict(os.environ, PERFIL='producao', INICIO_RAPIDO='0',
+                        PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get('PYTHONPATH')])))
+        saida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--filho', str(repeticoes), str(tempo_maximo)],
+            cwd=pasta, env=ambiente, capture_output=True, text=True
+        )
+        if saida.returncode != 0:
+            raise RuntimeError(saida.stderr[-4000:])
+        return json.loads(saida.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual, anterior):
+    for escala, resultado in atual['escalas'].items():
+        base = anterior.get('escalas', {}).get(escala)
+        if not base:
+            continue
+        print(f"\n== comparação ({escala} abastecimentos) com {anterior.get('commit') or '?'}")
+        print(f"{'rota':<55} {'p50 antes':>10} {'p50 agora':>10} {'variação':>9} {'SQL':>11}")
+        for url, medida in resultado['rotas'].items():
+            antes = base['rotas'].get(url)
+            if not antes or 'p50_ms' not in antes or 'p50_ms' not in medida:
+                continue
+            variacao = (medida['p50_ms'] / antes['p50_ms'] - 1) * 100 if antes['p50_ms'] else 0.0
+            print(f"{url:<55} {antes['p50_ms']:10.1f} {medida['p50_ms']:10.1f} {variacao:+8.1f}% "
+                  f"{antes['sql']:>5}->{medida['sql']:<5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escalas', default='10000', help='Quantidades de abastecimentos, separadas por vírgula.')
+    parser.add_argument('--repeticoes', type=int, default=10)
+    parser.add_argument('--saida', default='rotas.json')
+    parser.add_argument('--comparar', help='Relatório JSON anterior para comparação.')
+    parser.add_argument('--dados', default=os.path.join(tempfile.gettempdir(), 'gestao_combustivel_benchmark'),
+                        help='Pasta onde os bancos sintéticos ficam guardados entre execuções.')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--tempo-maximo', type=float, default=30.0)
+    argumentos = parser.parse_args()
+    os.makedirs(argumentos.dados, exist_ok=True)
+
+    relatorio = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'maquina': {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'repeticoes': argumentos.repeticoes,
+        'escalas': {},
+    }
+    for escala in (int(valor) for valor in argumentos.escalas.split(',')):
+        banco, resumo = preparar_dados(escala, argumentos.dados, argumentos.semente)
+        print(f"== {escala} abastecimentos ({resumo['veiculos']} veículos, {resumo['contratos']} contratos)")
+        resultado = executar(banco, argumentos.repeticoes, argumentos.tempo_maximo)
+        resultado['dados'] = resumo
+        relatorio['escalas'][str(escala)] = resultado
+        print(f"{'rota':<55} {'status':>6} {'1ª':>9} {'p50':>9} {'p99':>9} {'SQL':>6} {'memória':>10}")
+        for url, medida in resultado['rotas'].items():
+            print(f"{url:<55} {medida['status']:>6} {medida['primeira_ms']:8.1f}ms "
+                  f"{medida.get('p50_ms', float('nan')):8.1f}ms {medida.get('p99_ms', float('nan')):8.1f}ms "
+                  f"{medida['sql']:>6} {medida.get('pico_memoria_kib', float('nan')):8.0f}KiB")
+
+    with open(argumentos.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nRelatório gravado em {argumentos.saida}")
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding='utf-8') as arquivo:
+            comparar(relatorio, json.load(arquivo))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == '--filho':
+        medir_rotas(int(sys.argv[2]), float(sys.argv[3]))
+    else:
+        main()
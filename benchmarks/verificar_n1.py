@@ -0,0 +1,97 @@
+"""Verifica consultas N+1 em todas as rotas GET, com o detector em modo estrito.
+
+Uso: python benchmarks/verificar_n1.py [--escala 2000] [--limiar 10] [--dados PASTA]
+
+Gera (ou reaproveita) um banco sintético com dados_sinteticos.py, sobe o app num processo
+novo com DETECTOR_N1=estrito e visita cada rota GET como administrador. Sai com código 1
+se alguma rota carregar o mesmo relacionamento um a um --limiar vezes, listando o
+endpoint e a linha do template ou do código de origem, ou se alguma rota responder 5xx.
+Feito para rodar antes de publicar; tests/test_n1.py roda a mesma verificação no pytest.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from rotas import IGNORAR, RAIZ, _parametros_url, preparar_dados
+
+PASTA_DADOS = os.path.join(tempfile.gettempdir(), 'gestao_combustivel_benchmark')
+
+
+def visitar_rotas():
+    """Executado no processo filho, dentro da pasta com instance/database.db."""
+    # Antes de importar o app, que criaria instance/ na pasta atual
+    if os.environ.get('DETECTOR_N1') != 'estrito':
+        sys.exit("--filho é o processo filho de verificar_n1.py e precisa de DETECTOR_N1=estrito; "
+                 "rode o script sem --filho")
+    from flask import url_for
+    from app import app, db, detector_consultas_n1
+    parametros = _parametros_url(app, db)
+    cliente = app.test_client()
+    resposta = cliente.post('/login', data={'email': 'benchmark@local', 'password': 'benchmark'})
+    if resposta.status_code != 302:
+        raise RuntimeError("login do usuário benchmark@local falhou (banco não gerado por dados_sinteticos.py?)")
+
+    visitadas = []
+    for regra in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if regra.endpoint in IGNORAR or 'GET' not in regra.methods:
+            continue
+        valores = {argumento: parametros.get(argumento) for argumento in regra.arguments}
+        if None in valores.values():
+            continue
+        with app.test_request_context():
+            url = url_for(regra.endpoint, **valores)
+        # No modo estrito a exceção vira um 500; a ocorrência fica registrada no detector
+        visitadas.append({'url': url, 'status': cliente.get(url).status_code})
+    print(json.dumps({'rotas': visitadas, 'ocorrencias': list(detector_consultas_n1.ocorrencias)}))
+
+
+def verificar(escala=2000, limiar=10, dados=PASTA_DADOS, semente=42):
+    """Visita as rotas num processo filho; retorna {'rotas': [{url, status}], 'ocorrencias': [...]}."""
+    os.makedirs(dados, exist_ok=True)
+    banco, _ = preparar_dados(escala, dados, semente)
+    pasta = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(pasta, 'instance'))
+        shutil.copy(banco, os.path.join(pasta, 'instance', 'database.db'))
+        ambiente = dict(os.environ, PERFIL='producao', INICIO_RAPIDO='0',
+                        DETECTOR_N1='estrito', DETECTOR_N1_LIMIAR=str(limiar),
+                        PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get('PYTHONPATH')])))
+        saida = subprocess.run([sys.executable, os.path.abspath(__file__), '--filho'],
+                               cwd=pasta, env=ambiente, capture_output=True, text=True)
+        if saida.returncode != 0:
+            raise RuntimeError(saida.stderr[-4000:])
+        return json.loads(saida.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escala', type=int, default=2000, help='Quantidade de abastecimentos do banco sintético.')
+    parser.add_argument('--limiar', type=int, default=10)
+    parser.add_argument('--dados', default=PASTA_DADOS,
+                        help='Pasta onde os bancos sintéticos ficam guardados entre execuções.')
+    parser.add_argument('--semente', type=int, default=42)
+    argumentos = parser.parse_args()
+
+    resultado = verificar(argumentos.escala, argumentos.limiar, argumentos.dados, argumentos.semente)
+    print(f"{len(resultado['rotas'])} rotas visitadas (limiar {argumentos.limiar})")
+    for ocorrencia in resultado['ocorrencias']:
+        print(f"N+1 {ocorrencia['endpoint']:<40} {ocorrencia['relacionamento']:<40} {ocorrencia['origem']}")
+    erros = [rota for rota in resultado['rotas'] if rota['status'] >= 500]
+    for rota in erros:
+        print(f"{rota['status']} {rota['url']}")
+    if resultado['ocorrencias'] or erros:
+        sys.exit(1)
+    print("Nenhuma consulta N+1 encontrada.")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--filho':
+        visitar_rotas()
+    else:
+        main()
@@ -0,0 +1,168 @@
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy.exc import OperationalError
+
+from database import db
+
+# ----------------------
+# Busca textual em abastecimentos (SQLite FTS5)
+# ----------------------
+# busca_abastecimento é uma tabela FTS5 com uma linha por abastecimento (rowid = id):
+# número da nota, observações, placa do veículo e nome do motorista. Gatilhos em
+# abastecimento, veiculo e motorista a mantêm em dia na mesma transação de quem grava,
+# inclusive nas gravações em lote e nas instruções SQL diretas, sem chamadas no código.
+# O tokenizador ignora acentos e maiúsculas ("joao" encontra "João") e cada termo digitado
+# vale como prefixo ("ABC" encontra a placa ABC1D23). A ordenação é o bm25 do FTS5, com
+# peso maior para nota e placa do que para observações.
+#
+# Em SQLite sem FTS5 a tabela não é criada e a busca cai num LIKE sobre as mesmas colunas
+# (correto, mas percorre a tabela inteira).
+
+TABELA = "busca_abastecimento"
+POR_PAGINA = 50
+MAXIMO_TERMOS = 8
+# Pesos do bm25 na ordem das colunas: numero_nota, observacoes, placa, motorista
+PESOS = (10.0, 1.0, 8.0, 4.0)
+MARCA_INICIO, MARCA_FIM = "\x02", "\x03"
+
+CRIAR = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5(
+        numero_nota, observacoes, placa, motorista, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABELA}_ai AFTER INSERT ON abastecimento BEGIN
+        INSERT INTO {TABELA} (rowid, numero_nota, observacoes, placa, motorista)
+        SELECT NEW.id, NEW.numero_nota, NEW.observacoes,
+               (SELECT placa FROM veiculo WHERE id = NEW.veiculo_id),
+               (SELECT nome_completo FROM motorista WHERE id = NEW.motorista_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABELA}_au
+        AFTER UPDATE OF numero_nota, observacoes, veiculo_id, motorista_id ON abastecimento BEGIN
+        DELETE FROM {TABELA} WHERE rowid = OLD.id;
+        INSERT INTO {TABELA} (rowid, numero_nota, observacoes, placa, motorista)
+        SELECT NEW.id, NEW.numero_nota, NEW.observacoes,
+               (SELECT placa FROM veiculo WHERE id = NEW.veiculo_id),
+               (SELECT nome_completo FROM motorista WHERE id = NEW.motorista_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABELA}_ad AFTER DELETE ON abastecimento BEGIN
+        DELETE FROM {TABELA} WHERE rowid = OLD.id;
+    END""",
+    # Placa e nome são repetidos em cada abastecimento: renomear atualiza todas as linhas
+    f"""CREATE TRIGGER IF NOT EXISTS {TABELA}_veiculo_au AFTER UPDATE OF placa ON veiculo BEGIN
+        UPDATE {TABELA} SET placa = NEW.placa
+        WHERE rowid IN (SELECT id FROM abastecimento WHERE veiculo_id = NEW.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABELA}_motorista_au AFTER UPDATE OF nome_completo ON motorista BEGIN
+        UPDATE {TABELA} SET motorista = NEW.nome_completo
+        WHERE rowid IN (SELECT id FROM abastecimento WHERE motorista_id = NEW.id);
+    END""",
+]
+
+POPULAR = f"""
+    INSERT INTO {TABELA} (rowid, numero_nota, observacoes, placa, motorista)
+    SELECT a.id, a.numero_nota, a.observacoes, v.placa, m.nome_completo
+    FROM abastecimento a
+    LEFT JOIN veiculo v ON v.id = a.veiculo_id
+    LEFT JOIN motorista m ON m.id = a.motorista_id
+"""
+
+
+def disponivel():
+    """Se a tabela FTS5 existe neste banco."""
+    return db.session.connection().exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABELA,)
+    ).first() is not None
+
+
+def criar():
+    """Cria a tabela e os gatilhos e indexa o histórico (migração). False se o SQLite não tem FTS5."""
+    conexao = db.session.connection()
+    try:
+        for instrucao in CRIAR:
+            conexao.exec_driver_sql(instrucao)
+    except OperationalError:
+        # "no such module: fts5"
+        return False
+    reindexar()
+    return True
+
+
+def reindexar():
+    """Refaz o índice a partir das tabelas (comando reindexar-busca)."""
+    conexao = db.session.connection()
+    conexao.exec_driver_sql(f"DELETE FROM {TABELA}")
+    conexao.exec_driver_sql(POPULAR)
+    conexao.exec_driver_sql(f"INSERT INTO {TABELA} ({TABELA}) VALUES ('optimize')")
+
+
+def termos(texto):
+    """Palavras do texto digitado (letras e dígitos), no máximo MAXIMO_TERMOS."""
+    return re.findall(r"\w+", texto or "")[:MAXIMO_TERMOS]
+
+
+def consulta_fts(palavras):
+    """Expressão MATCH: todos os termos, cada um como prefixo e entre aspas (sem operadores do usuário)."""
+    return " ".join(f'"{palavra}"*' for palavra in palavras)
+
+
+def _filtro_setor(setor, parametros):
+    if not setor:
+        return ""
+    parametros.append(setor)
+    return " AND v.tipo = ?"
+
+
+def buscar(texto, setor=None, pagina=1):
+    """(ids na ordem de relevância, total de resultados, {id: trechos destacados})."""
+    palavras = termos(texto)
+    if not palavras:
+        return [], 0, {}
+    if not disponivel():
+        return _buscar_like(palavras, setor, pagina)
+    conexao = db.session.connection()
+    parametros = [consulta_fts(palavras)]
+    filtro = _filtro_setor(setor, parametros)
+    base = f"""FROM {TABELA} b JOIN abastecimento a ON a.id = b.rowid JOIN veiculo v ON v.id = a.veiculo_id
+               WHERE {TABELA} MATCH ?{filtro}"""
+    total = conexao.exec_driver_sql(f"SELECT count(*) {base}", tuple(parametros)).scalar()
+    colunas = ", ".join(
+        f"highlight({TABELA}, {indice}, '{MARCA_INICIO}', '{MARCA_FIM}')" for indice in range(len(PESOS))
+    )
+    linhas = conexao.exec_driver_sql(
+        f"""SELECT b.rowid, {colunas} {base}
+            ORDER BY bm25({TABELA}, {', '.join(map(str, PESOS))}), a.data DESC
+            LIMIT ? OFFSET ?""",
+        tuple(parametros + [POR_PAGINA, (pagina - 1) * POR_PAGINA])
+    ).all()
+    destaques = {
+        linha[0]: dict(zip(('numero_nota', 'observacoes', 'placa', 'motorista'), map(destacar, linha[1:])))
+        for linha in linhas
+    }
+    return [linha[0] for linha in linhas], total, destaques
+
+
+def _buscar_like(palavras, setor, pagina):
+    """Sem FTS5: cada termo precisa aparecer (LIKE) em alguma das colunas; mais recentes primeiro."""
+    condicoes, parametros = [], []
+    for palavra in palavras:
+        condicoes.append(
+            "(a.numero_nota LIKE ? OR a.observacoes LIKE ? OR v.placa LIKE ? OR m.nome_completo LIKE ?)"
+        )
+        parametros += [f"%{palavra}%"] * 4
+    filtro = _filtro_setor(setor, parametros)
+    base = f"""FROM abastecimento a JOIN veiculo v ON v.id = a.veiculo_id JOIN motorista m ON m.id = a.motorista_id
+               WHERE {' AND '.join(condicoes)}{filtro}"""
+    conexao = db.session.connection()
+    total = conexao.exec_driver_sql(f"SELECT count(*) {base}", tuple(parametros)).scalar()
+    ids = [linha[0] for linha in conexao.exec_driver_sql(
+        f"SELECT a.id {base} ORDER BY a.data DESC LIMIT ? OFFSET ?",
+        tuple(parametros + [POR_PAGINA, (pagina - 1) * POR_PAGINA])
+    )]
+    return ids, total, {}
+
+
+def destacar(texto):
+    """Texto do highlight() escapado, com os trechos encontrados em <mark>."""
+    if texto is None:
+        return None
+    return Markup(str(escape(texto)).replace(MARCA_INICIO, "<mark>").replace(MARCA_FIM, "</mark>"))
@@ -0,0 +1,499 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from database import db, Veiculo
+
+# ----------------------
+# Cache colunar de abastecimentos (NumPy)
+# ----------------------
+# Mantém a tabela de fatos `abastecimento` em memória como vetores NumPy, um por
+# coluna, para que o dashboard, os relatórios por veículo/motorista e o consumo de
+# contratos sejam calculados com máscaras vetorizadas e np.bincount, sem SQL.
+#
+# Setor e combustível são os do veículo (Veiculo.tipo / Veiculo.combustivel), os
+# mesmos usados nos filtros das rotas, codificados como inteiros.
+
+EPOCA = datetime(1970, 1, 1)
+SEGUNDOS_POR_DIA = 86400
+SEM_CODIGO = -1
+LOTE_LEITURA = 100_000
+
+COLUNAS = {
+    'id': np.int64,
+    'instante': np.int64,  # segundos desde a época (data/hora do abastecimento)
+    'dia': np.int32,  # dias desde a época
+    'litros': np.float64,
+    'valor': np.float64,
+    'veiculo': np.int32,
+    'motorista': np.int32,
+    'contrato': np.int32,
+    'setor': np.int32,
+    'combustivel': np.int32,
+    'hodometro': np.int64,
+    'valido': np.bool_,  # False para abastecimentos excluídos
+}
+
+
+def para_segundos(valor):
+    if isinstance(valor, datetime):
+        return int((valor - EPOCA).total_seconds())
+    return (valor - EPOCA.date()).days * SEGUNDOS_POR_DIA
+
+
+def para_dia(valor):
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    return (valor - EPOCA.date()).days
+
+
+def dia_para_data(dia):
+    return EPOCA.date() + timedelta(days=int(dia))
+
+
+class CacheColunar:
+    def __init__(self):
+        self.ativo = False
+        self._trava = threading.RLock()
+        self._n = 0
+        self._colunas = {nome: np.empty(0, dtype=tipo) for nome, tipo in COLUNAS.items()}
+        self._ids_ordenados = True
+        self.setores = []
+        self.combustiveis = []
+        self._codigo_setor = {}
+        self._codigo_combustivel = {}
+        # Setor/combustível de cada veículo, para registrar abastecimentos novos
+        self._veiculos = {}
+        # Chamado com as posições alteradas após cada registrar/remover (ver snapshot_colunar)
+        self.ao_alterar = None
+        # Versão do banco, lida antes das linhas de cada alteração e repassada a ao_alterar
+        self.ler_versao = None
+
+    def __len__(self):
+        return self._n
+
+    # ----------------------
+    # Construção e manutenção
+    # ----------------------
+    def _codigo(self, valor, nomes, codigos):
+        if valor is None:
+            return SEM_CODIGO
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(nomes)
+            nomes.append(valor)
+        return codigo
+
+    def codigo_setor(self, setor):
+        return self._codigo_setor.get(setor, SEM_CODIGO - 1)
+
+    def codigo_combustivel(self, combustivel):
+        return self._codigo_combustivel.get(combustivel, SEM_CODIGO - 1)
+
+    def _carregar_veiculos(self):
+        self._veiculos = {}
+        for veiculo_id, tipo, combustivel in db.session.query(Veiculo.id, Veiculo.tipo, Veiculo.combustivel):
+            self._veiculos[veiculo_id] = (
+                self._codigo(tipo, self.setores, self._codigo_setor),
+                self._codigo(combustivel, self.combustiveis, self._codigo_combustivel)
+            )
+
+    def construir(self):
+        """Lê toda a tabela de abastecimentos em lotes e monta os vetores."""
+        with self._trava:
+            self.setores, self.combustiveis = [], []
+            self._codigo_setor, self._codigo_combustivel = {}, {}
+            self._carregar_veiculos()
+            self.carregar_matriz(self._ler_matriz())
+            return self._n
+
+    def _ler_matriz(self, filtro="", parametros=()):
+        """Lê abastecimentos (ordenados por id) como matriz float64 na ordem de carregar_matriz."""
+        cursor = db.session.connection().exec_driver_sql(
+            "SELECT id, CAST(strftime('%s', data) AS INTEGER), litros, valor_total, veiculo_id, "
+            f"motorista_id, COALESCE(contrato_id, -1), hodometro FROM abastecimento {filtro} ORDER BY id",
+            parametros
+        )
+        partes = []
+        while True:
+            linhas = cursor.fetchmany(LOTE_LEITURA)
+            if not linhas:
+                break
+            partes.append(np.array(linhas, dtype=np.float64))
+        return np.concatenate(partes) if partes else np.empty((0, 8), dtype=np.float64)
+
+    def carregar_matriz(self, matriz):
+        """Substitui o conteúdo a partir de uma matriz (id, instante, litros, valor, veiculo, motorista, contrato, hodometro)."""
+        with self._trava:
+            if not self._veiculos:
+                self._carregar_veiculos()
+            colunas = self._colunas_da_matriz(matriz)
+            n = len(matriz)
+            self._colunas = colunas
+            self._n = n
+            self._ids_ordenados = bool(n < 2 or np.all(np.diff(colunas['id']) > 0))
+            self.ativo = True
+
+    def _colunas_da_matriz(self, matriz):
+        n = len(matriz)
+        veiculos = matriz[:, 4].astype(np.int32)
+        setor_por_veiculo, combustivel_por_veiculo = self._vetores_por_veiculo(int(veiculos.max()) if n else 0)
+        colunas = {
+            'id': matriz[:, 0].astype(np.int64),
+            'instante': matriz[:, 1].astype(np.int64),
+            'litros': matriz[:, 2].copy(),
+            'valor': matriz[:, 3].copy(),
+            'veiculo': veiculos,
+            'motorista': matriz[:, 5].astype(np.int32),
+            'contrato': matriz[:, 6].astype(np.int32),
+            'hodometro': matriz[:, 7].astype(np.int64),
+            'valido': np.ones(n, dtype=np.bool_),
+        }
+        colunas['dia'] = (colunas['instante'] // SEGUNDOS_POR_DIA).astype(np.int32)
+        colunas['setor'] = setor_por_veiculo[veiculos] if n else np.empty(0, dtype=np.int32)
+        colunas['combustivel'] = combustivel_por_veiculo[veiculos] if n else np.empty(0, dtype=np.int32)
+        return colunas
+
+    def carregar_colunas(self, colunas, setores, combustiveis):
+        """Substitui o conteúdo por vetores já prontos (ordenados por id), p.ex. lidos de um snapshot.
+
+        Os vetores podem ser somente leitura (mapeados em memória); são copiados na primeira alteração.
+        """
+        with self._trava:
+            self.setores, self.combustiveis = list(setores), list(combustiveis)
+            self._codigo_setor = {nome: codigo for codigo, nome in enumerate(self.setores)}
+            self._codigo_combustivel = {nome: codigo for codigo, nome in enumerate(self.combustiveis)}
+            self._carregar_veiculos()
+            self._colunas = {nome: colunas[nome] for nome in COLUNAS}
+            self._n = len(self._colunas['id'])
+            self._ids_ordenados = bool(self._n < 2 or np.all(np.diff(self._colunas['id']) > 0))
+            self.ativo = True
+
+    def _vetores_por_veiculo(self, maior_id):
+        maior_id = max([maior_id, *self._veiculos]) if self._veiculos else maior_id
+        setor = np.full(maior_id + 1, SEM_CODIGO, dtype=np.int32)
+        combustivel = np.full(maior_id + 1, SEM_CODIGO, dtype=np.int32)
+        for veiculo_id, (codigo_setor, codigo_combustivel) in self._veiculos.items():
+            setor[veiculo_id] = codigo_setor
+            combustivel[veiculo_id] = codigo_combustivel
+        return setor, combustivel
+
+    def _garantir_capacidade(self, extra):
+        capacidade = len(self._colunas['id'])
+        if self._n + extra <= capacidade:
+            return
+        nova = max(1024, capacidade * 2, self._n + extra)
+        for nome, vetor in self._colunas.items():
+            ampliado = np.zeros(nova, dtype=vetor.dtype)
+            ampliado[:self._n] = vetor[:self._n]
+            self._colunas[nome] = ampliado
+
+    def _posicao(self, abastecimento_id):
+        ids = self._colunas['id'][:self._n]
+        if self._ids_ordenados:
+            posicao = int(np.searchsorted(ids, abastecimento_id))
+            if posicao < self._n and ids[posicao] == abastecimento_id:
+                return posicao
+            return None
+        encontrados = np.flatnonzero(ids == abastecimento_id)
+        return int(encontrados[0]) if len(encontrados) else None
+
+    def _codigos_veiculo(self, veiculo):
+        codigos = self._veiculos.get(veiculo.id)
+        if codigos is None:
+            codigos = self._veiculos[veiculo.id] = (
+                self._codigo(veiculo.tipo, self.setores, self._codigo_setor),
+                self._codigo(veiculo.combustivel, self.combustiveis, self._codigo_combustivel)
+            )
+        return codigos
+
+    def _materializar(self):
+        """Copia para memória própria os vetores abertos de um snapshot (somente leitura)."""
+        for nome, vetor in self._colunas.items():
+            if not vetor.flags.writeable:
+                self._colunas[nome] = vetor.copy()
+
+    def _versao(self):
+        return self.ler_versao() if self.ler_versao is not None else None
+
+    def _notificar(self, posicoes, versao):
+        if self.ao_alterar is not None and len(posicoes):
+            self.ao_alterar(self, np.asarray(posicoes, dtype=np.int64), versao)
+
+    def _registrar(self, abastecimento):
+        posicao = self._posicao(abastecimento.id)
+        if posicao is None:
+            self._garantir_capacidade(1)
+            posicao = self._n
+            if self._n and abastecimento.id < self._colunas['id'][self._n - 1]:
+                self._ids_ordenados = False
+            self._n += 1
+        codigo_setor, codigo_combustivel = self._codigos_veiculo(abastecimento.veiculo)
+        instante = para_segundos(abastecimento.data)
+        linha = {
+            'id': abastecimento.id,
+            'instante': instante,
+            'dia': instante // SEGUNDOS_POR_DIA,
+            'litros': abastecimento.litros,
+            'valor': abastecimento.valor_total,
+            'veiculo': abastecimento.veiculo_id,
+            'motorista': abastecimento.motorista_id,
+            'contrato': abastecimento.contrato_id if abastecimento.contrato_id is not None else SEM_CODIGO,
+            'setor': codigo_setor,
+            'combustivel': codigo_combustivel,
+            'hodometro': abastecimento.hodometro,
+            'valido': True,
+        }
+        for nome, valor in linha.items():
+            self._colunas[nome][posicao] = valor
+        return posicao
+
+    def registrar(self, abastecimento):
+        """Inclui um abastecimento novo ou atualiza um existente (após o commit)."""
+        if not self.ativo:
+            return
+        # Antes de ler os atributos (expirados pelo commit, relidos do banco)
+        versao = self._versao()
+        with self._trava:
+            self._materializar()
+            self._notificar([self._registrar(abastecimento)], versao)
+
+    def registrar_ids(self, ids):
+        """Recarrega do banco um conjunto de abastecimentos (usado após inserções em lote)."""
+        if not self.ativo or not ids:
+            return
+        ids = np.unique(np.asarray(list(ids), dtype=np.int64))
+        versao = self._versao()
+        # Lotes importados têm ids contíguos: uma faixa em vez de um IN com milhares de parâmetros
+        matriz = self._ler_matriz("WHERE id BETWEEN ? AND ?", (int(ids[0]), int(ids[-1])))
+        matriz = matriz[np.isin(matriz[:, 0].astype(np.int64), ids)]
+        if not len(matriz):
+            return
+        with self._trava:
+            self._materializar()
+            self._carregar_veiculos()
+            novas = self._colunas_da_matriz(matriz)
+
+            atuais = self._colunas['id'][:self._n]
+            ordem = None if self._ids_ordenados else np.argsort(atuais, kind='stable')
+            indices = np.searchsorted(atuais, novas['id'], sorter=ordem)
+            indices = np.minimum(indices, max(self._n - 1, 0))
+            if ordem is not None:
+                indices = ordem[indices]
+            existentes = (atuais[indices] == novas['id']) if self._n else np.zeros(len(matriz), dtype=np.bool_)
+            posicoes = np.where(existentes, indices, -1)
+
+            quantidade_novas = int((~existentes).sum())
+            if quantidade_novas:
+                self._garantir_capacidade(quantidade_novas)
+                if self._n and novas['id'][~existentes].min() < self._colunas['id'][:self._n].max():
+                    self._ids_ordenados = False
+                posicoes[~existentes] = np.arange(self._n, self._n + quantidade_novas)
+                self._n += quantidade_novas
+            for nome, vetor in novas.items():
+                self._colunas[nome][posicoes] = vetor
+            self._notificar(posicoes, versao)
+
+    def remover(self, abastecimento_id):
+        if not self.ativo:
+            return
+        versao = self._versao()
+        with self._trava:
+            posicao = self._posicao(abastecimento_id)
+            if posicao is not None:
+                self._materializar()
+                self._colunas['valido'][posicao] = False
+                self._notificar([posicao], versao)
+
+    def remover_por(self, coluna, valor):
+        """Invalida todos os abastecimentos de um veículo ou motorista excluído."""
+        if not self.ativo:
+            return
+        versao = self._versao()
+        with self._trava:
+            self._materializar()
+            linhas = self._colunas[coluna][:self._n] == valor
+            self._colunas['valido'][:self._n][linhas] = False
+            self._notificar(np.flatnonzero(linhas), versao)
+
+    def atualizar_veiculo(self, veiculo):
+        """Propaga a troca de setor/combustível de um veículo para todos os seus abastecimentos."""
+        if not self.ativo:
+            return
+        versao = self._versao()
+        with self._trava:
+            self._materializar()
+            self._veiculos.pop(veiculo.id, None)
+            codigo_setor, codigo_combustivel = self._codigos_veiculo(veiculo)
+            linhas = self._colunas['veiculo'][:self._n] == veiculo.id
+            self._colunas['setor'][:self._n][linhas] = codigo_setor
+            self._colunas['combustivel'][:self._n][linhas] = codigo_combustivel
+            self._notificar(np.flatnonzero(linhas), versao)
+
+    def colunas(self):
+        """Visões (sem cópia) das colunas válidas no momento da chamada."""
+        with self._trava:
+            return {nome: vetor[:self._n] for nome, vetor in self._colunas.items()}
+
+    # ----------------------
+    # Filtros
+    # ----------------------
+    def mascara(self, colunas, data_inicio=None, data_fim=None, setor=None, veiculo_id=None,
+                motorista_id=None, combustivel=None, min_litros=None, max_litros=None):
+        """Máscara booleana com os mesmos filtros das rotas (datas inclusivas, por dia)."""
+        mascara = colunas['valido'].copy()
+        if data_inicio is not None:
+            mascara &= colunas['dia'] >= para_dia(data_inicio)
+        if data_fim is not None:
+            mascara &= colunas['dia'] <= para_dia(data_fim)
+        if setor:
+            mascara &= colunas['setor'] == self.codigo_setor(setor)
+        if veiculo_id is not None:
+            mascara &= colunas['veiculo'] == veiculo_id
+        if motorista_id is not None:
+            mascara &= colunas['motorista'] == motorista_id
+        if combustivel:
+            mascara &= colunas['combustivel'] == self.codigo_combustivel(combustivel)
+        if min_litros is not None:
+            mascara &= colunas['litros'] >= min_litros
+        if max_litros is not None:
+            mascara &= colunas['litros'] <= max_litros
+        return mascara
+
+
+cache = CacheColunar()
+
+
+# ----------------------
+# Agregações
+# ----------------------
+def _mais_recentes(colunas, indices, limite):
+    """Índices dos `limite` abastecimentos mais recentes (data desc, id desc)."""
+    if len(indices) > limite:
+        instantes = colunas['instante'][indices]
+        indices = indices[np.argpartition(-instantes, limite - 1)[:limite]]
+    ordem = np.lexsort((-colunas['id'][indices], -colunas['instante'][indices]))
+    return indices[ordem]
+
+
+def _top(pesos_por_codigo, limite):
+    codigos = np.flatnonzero(pesos_por_codigo)
+    ordem = np.argsort(-pesos_por_codigo[codigos], kind='stable')[:limite]
+    return [(int(codigo), float(pesos_por_codigo[codigo])) for codigo in codigos[ordem]]
+
+
+def resumo_dashboard(agrupamento='dia', limite_recentes=10, **filtros):
+    """Indicadores e séries do dashboard calculados sobre o cache."""
+    colunas = cache.colunas()
+    indices = np.flatnonzero(cache.mascara(colunas, **filtros))
+    litros = colunas['litros'][indices]
+    dias = colunas['dia'][indices]
+
+    # Litros por período: soma por dia e depois agrupa os poucos dias distintos
+    dias_unicos, inverso = np.unique(dias, return_inverse=True)
+    litros_por_dia = np.bincount(inverso, weights=litros, minlength=len(dias_unicos))
+    litros_por_periodo = defaultdict(float)
+    for dia, total in zip(dias_unicos.tolist(), litros_por_dia.tolist()):
+        data = dia_para_data(dia)
+        if agrupamento == "semana":
+            chave = data.strftime('%Y-W%U')
+        elif agrupamento == "mes":
+            chave = data.strftime('%Y-%m')
+        else:
+            chave = data.strftime('%Y-%m-%d')
+        litros_por_periodo[chave] += total
+
+    veiculos = colunas['veiculo'][indices]
+    motoristas = colunas['motorista'][indices]
+    combustiveis = colunas['combustivel'][indices]
+    litros_por_combustivel = np.bincount(combustiveis[combustiveis >= 0], weights=litros[combustiveis >= 0],
+                                         minlength=len(cache.combustiveis))
+    return {
+        'quantidade': len(indices),
+        'total_litros': float(litros.sum()),
+        'valor_total': float(colunas['valor'][indices].sum()),
+        'litros_por_periodo': dict(sorted(litros_por_periodo.items())),
+        'top_veiculos': _top(np.bincount(veiculos, weights=litros), 10) if len(indices) else [],
+        'top_motoristas': _top(np.bincount(motoristas, weights=litros), 10) if len(indices) else [],
+        'litros_por_combustivel': [(cache.combustiveis[codigo], total) for codigo, total in _top(litros_por_combustivel, len(cache.combustiveis))],
+        'ids_recentes': colunas['id'][_mais_recentes(colunas, indices, limite_recentes)].tolist(),
+    }
+
+
+def resumir_por_grupo(grupo, limite=5, **filtros):
+    """Equivalente vetorizado de resumir_abastecimentos_por_grupo.
+
+    `grupo` é 'veiculo' ou 'motorista'. Retorna (totais, mais_utilizados, ids_recentes) com
+    totais = [(grupo_id, litros, valor, quantidade)] ordenados pelo abastecimento mais recente,
+    mais_utilizados = [(grupo_id, secundario_id, litros, valor)] e ids dos `limite` abastecimentos
+    mais recentes de cada grupo.
+    """
+    secundario = 'motorista' if grupo == 'veiculo' else 'veiculo'
+    colunas = cache.colunas()
+    indices = np.flatnonzero(cache.mascara(colunas, **filtros))
+    if not len(indices):
+        return [], [], []
+    grupos = colunas[grupo][indices].astype(np.int64)
+    secundarios = colunas[secundario][indices].astype(np.int64)
+    litros = colunas['litros'][indices]
+    valores = colunas['valor'][indices]
+    instantes = colunas['instante'][indices]
+
+    # Totais por grupo
+    grupos_unicos, inverso = np.unique(grupos, return_inverse=True)
+    soma_litros = np.bincount(inverso, weights=litros)
+    soma_valor = np.bincount(inverso, weights=valores)
+    quantidade = np.bincount(inverso)
+    ultimo = np.full(len(grupos_unicos), np.iinfo(np.int64).min)
+    np.maximum.at(ultimo, inverso, instantes)
+    ordem = np.argsort(-ultimo, kind='stable')
+    totais = [
+        (int(grupos_unicos[i]), float(soma_litros[i]), float(soma_valor[i]), int(quantidade[i]))
+        for i in ordem
+    ]
+
+    # Top N de secundários por grupo: soma por par e ranking dentro de cada grupo
+    pares, inverso_pares = np.unique(grupos * (int(secundarios.max()) + 1) + secundarios, return_inverse=True)
+    litros_par = np.bincount(inverso_pares, weights=litros)
+    valor_par = np.bincount(inverso_pares, weights=valores)
+    grupo_par = pares // (int(secundarios.max()) + 1)
+    secundario_par = pares % (int(secundarios.max()) + 1)
+    ordem_pares = np.lexsort((-litros_par, grupo_par))
+    posicoes = _posicao_no_grupo(grupo_par[ordem_pares])
+    escolhidos = ordem_pares[posicoes < limite]
+    mais_utilizados = [
+        (int(grupo_par[i]), int(secundario_par[i]), float(litros_par[i]), float(valor_par[i]))
+        for i in escolhidos
+    ]
+
+    # N mais recentes por grupo
+    ordem_recentes = np.lexsort((-colunas['id'][indices], -instantes, grupos))
+    posicoes = _posicao_no_grupo(grupos[ordem_recentes])
+    ids_recentes = colunas['id'][indices[ordem_recentes[posicoes < limite]]].tolist()
+    return totais, mais_utilizados, ids_recentes
+
+
+def _posicao_no_grupo(grupos_ordenados):
+    """Posição (0, 1, 2...) de cada elemento dentro do seu grupo em um vetor já ordenado por grupo."""
+    if not len(grupos_ordenados):
+        return np.empty(0, dtype=np.int64)
+    inicio = np.r_[0, np.flatnonzero(np.diff(grupos_ordenados)) + 1]
+    tamanhos = np.diff(np.r_[inicio, len(grupos_ordenados)])
+    return np.arange(len(grupos_ordenados)) - np.repeat(inicio, tamanhos)
+
+
+def consumo_itens(efetivos, setor=None):
+    """Consumo (litros, valor) por item de contrato efetivo, com as mesmas regras de calcular_consumo_itens."""
+    colunas = cache.colunas()
+    base = colunas['valido'].copy()
+    if setor:
+        base &= colunas['setor'] == cache.codigo_setor(setor)
+    consumo = {}
+    for efetivo in efetivos:
+        mascara = base & (colunas['dia'] >= para_dia(efetivo.data_inicio)) & (colunas['dia'] <= para_dia(efetivo.data_fim))
+        mascara &= (colunas['combustivel'] == cache.codigo_combustivel(efetivo.tipo_combustivel)) | (
+            colunas['contrato'] == efetivo.contrato_id
+        )
+        if mascara.any():
+            consumo[efetivo.item_id] = (float(colunas['litros'][mascara].sum()), float(colunas['valor'][mascara].sum()))
+    return consumo
@@ -0,0 +1,137 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, case, func, or_
+
+from database import db, Veiculo, Motorista, Abastecimento
+
+# ----------------------
+# Comparação entre períodos (período anterior e mesmo período do ano anterior)
+# ----------------------
+# Os três períodos saem de uma única consulta agrupada: o WHERE aceita abastecimentos de
+# qualquer um deles e cada medida é uma soma condicional, SUM(CASE WHEN data no período
+# THEN litros END), em vez de rodar o relatório três vezes. O período anterior termina na
+# véspera do início: quando o intervalo começa no dia 1, são os mesmos dias dos N meses de
+# calendário anteriores (comparação mês a mês), senão a mesma quantidade de dias. O do ano
+# anterior são as mesmas datas 12 meses antes (29/02 vira 28/02 e vice-versa no fim de mês).
+
+PERIODOS = {
+    'atual': 'Período',
+    'anterior': 'Período anterior',
+    'ano_anterior': 'Ano anterior',
+}
+
+DIMENSOES = {
+    'veiculo': 'Veículo',
+    'motorista': 'Motorista',
+    'setor': 'Setor',
+    'combustivel': 'Combustível',
+}
+
+MEDIDAS = ('litros', 'valor', 'quantidade')
+
+
+def _meses_antes(dia, meses, fim_de_mes=False):
+    """O mesmo dia N meses antes, limitado ao último dia do mês (ou sempre o último, com fim_de_mes)."""
+    indice = dia.year * 12 + dia.month - 1 - meses
+    ano, mes = indice // 12, indice % 12 + 1
+    ultimo = (date(ano + mes // 12, mes % 12 + 1, 1) - timedelta(days=1)).day
+    return date(ano, mes, ultimo if fim_de_mes else min(dia.day, ultimo))
+
+
+def periodos(inicio, fim):
+    """{'atual' | 'anterior' | 'ano_anterior': (primeiro dia, último dia)} a partir de datas."""
+    fim_de_mes = (fim + timedelta(days=1)).day == 1
+    if inicio.day == 1:
+        # Começando no dia 1: os mesmos dias dos N meses de calendário anteriores
+        # (março inteiro -> fevereiro inteiro, 1 a 15/03 -> 1 a 15/02)
+        meses = (fim.year - inicio.year) * 12 + fim.month - inicio.month + 1
+        anterior = (_meses_antes(inicio, meses), _meses_antes(fim, meses, fim_de_mes))
+    else:
+        dias = (fim - inicio).days + 1
+        anterior = (inicio - timedelta(days=dias), inicio - timedelta(days=1))
+    return {
+        'atual': (inicio, fim),
+        'anterior': anterior,
+        'ano_anterior': (_meses_antes(inicio, 12), _meses_antes(fim, 12, fim_de_mes)),
+    }
+
+
+def _variacao(atual, referencia):
+    """(diferença, percentual); percentual None quando a referência é zero."""
+    diferenca = atual - referencia
+    return diferenca, (diferenca / referencia * 100 if referencia else None)
+
+
+def _linha(grupo, valores):
+    linha = {'grupo': grupo}
+    for periodo in PERIODOS:
+        litros, valor, quantidade = (valores[f'{periodo}_{medida}'] or 0 for medida in MEDIDAS)
+        linha[periodo] = {
+            'litros': litros,
+            'valor': valor,
+            'quantidade': quantidade,
+            'media_litros': litros / quantidade if quantidade else 0,
+            'preco_medio': valor / litros if litros else 0,
+        }
+    for periodo in ('anterior', 'ano_anterior'):
+        linha[f'variacao_{periodo}'] = {
+            medida: _variacao(linha['atual'][medida], linha[periodo][medida])
+            for medida in ('litros', 'valor', 'quantidade', 'media_litros', 'preco_medio')
+        }
+    return linha
+
+
+def comparar(inicio, fim, dimensao=None, setor=None, veiculo_id=None, motorista_id=None, combustivel=None):
+    """Medidas dos três períodos por grupo da dimensão (ou só o total, sem dimensão).
+
+    Retorna (períodos, linhas, total); linhas em ordem decrescente de litros no período atual.
+    """
+    limites = periodos(inicio, fim)
+    condicoes = {
+        periodo: and_(Abastecimento.data >= datetime.combine(primeiro, time.min),
+                      Abastecimento.data < datetime.combine(ultimo + timedelta(days=1), time.min))
+        for periodo, (primeiro, ultimo) in limites.items()
+    }
+    colunas = []
+    for periodo, condicao in condicoes.items():
+        colunas += [
+            func.sum(case((condicao, Abastecimento.litros))).label(f'{periodo}_litros'),
+            func.sum(case((condicao, Abastecimento.valor_total))).label(f'{periodo}_valor'),
+            func.count(case((condicao, Abastecimento.id))).label(f'{periodo}_quantidade'),
+        ]
+    grupo = {
+        'veiculo': Veiculo.placa,
+        'motorista': Motorista.nome_completo,
+        'setor': Veiculo.tipo,
+        'combustivel': Veiculo.combustivel,
+    }.get(dimensao)
+    chave = {'veiculo': Veiculo.id, 'motorista': Motorista.id}.get(dimensao, grupo)
+    consulta = db.session.query(*([grupo.label('grupo')] if grupo is not None else []), *colunas).select_from(
+        Abastecimento
+    ).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).filter(or_(*condicoes.values()))
+    if dimensao == 'motorista':
+        consulta = consulta.join(Motorista, Abastecimento.motorista_id == Motorista.id)
+    if setor:
+        consulta = consulta.filter(Veiculo.tipo == setor)
+    if veiculo_id:
+        consulta = consulta.filter(Abastecimento.veiculo_id == veiculo_id)
+    if motorista_id:
+        consulta = consulta.filter(Abastecimento.motorista_id == motorista_id)
+    if combustivel:
+        consulta = consulta.filter(Veiculo.combustivel == combustivel)
+
+    if grupo is None:
+        return limites, [], _linha('Total', consulta.one()._mapping)
+    linhas = [
+        _linha(linha.grupo or 'Não informado', linha._mapping)
+        for linha in consulta.group_by(chave).order_by(func.sum(case((condicoes['atual'], Abastecimento.litros), else_=0)).desc())
+    ]
+    soma = {f'{periodo}_{medida}': sum(linha[periodo][medida] for linha in linhas)
+            for periodo in PERIODOS for medida in MEDIDAS}
+    return limites, linhas, _linha('Total', soma)
+
+
+def intervalo_padrao(hoje=None):
+    """Sem datas informadas: do primeiro dia do mês até hoje."""
+    hoje = hoje or date.today()
+    return hoje.replace(day=1), hoje
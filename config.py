@@ -0,0 +1,86 @@
+import os
+from jinja2 import FileSystemBytecodeCache
+
+# ----------------------
+# Perfis de configuração
+# ----------------------
+# Selecionados pela variável de ambiente PERFIL (desenvolvimento | producao).
+# O executável (main.py) usa produção; rodando o app.py direto o padrão é desenvolvimento.
+
+
+def _inteiro(nome, padrao):
+    return int(os.environ.get(nome, padrao))
+
+
+class ConfigServidor:
+    """Servidor WSGI (waitress) e SQLite; comum aos dois perfis, ajustável por variáveis de ambiente."""
+    SERVIDOR_HOST = os.environ.get('SERVIDOR_HOST', '127.0.0.1')
+    SERVIDOR_PORTA = _inteiro('SERVIDOR_PORTA', 5000)
+    SERVIDOR_THREADS = _inteiro('SERVIDOR_THREADS', 8)
+    SERVIDOR_BACKLOG = _inteiro('SERVIDOR_BACKLOG', 1024)
+    SERVIDOR_TIMEOUT_CANAL = _inteiro('SERVIDOR_TIMEOUT_CANAL', 120)  # segundos
+    SERVIDOR_LIMITE_CONEXOES = _inteiro('SERVIDOR_LIMITE_CONEXOES', 100)
+    # Processos pré-forkados compartilhando o socket (só em sistemas com fork; no Windows fica 1)
+    SERVIDOR_PROCESSOS = _inteiro('SERVIDOR_PROCESSOS', 1) if hasattr(os, 'fork') else 1
+    # Faixa pesada (exportações/visualizações de relatório, ver admissao.py): simultâneas + fila
+    # devem ficar abaixo de SERVIDOR_THREADS para sobrar threads às demais telas
+    EXPORTACAO_SIMULTANEAS = _inteiro('EXPORTACAO_SIMULTANEAS', 2)
+    EXPORTACAO_FILA = _inteiro('EXPORTACAO_FILA', 4)
+    EXPORTACAO_ESPERA_MAXIMA = _inteiro('EXPORTACAO_ESPERA_MAXIMA', 10)  # segundos
+    EXPORTACAO_RETRY_AFTER = _inteiro('EXPORTACAO_RETRY_AFTER', 15)  # segundos
+    # Abaixo desta quantidade estimada de abastecimentos a exportação não passa pela faixa pesada
+    EXPORTACAO_LIMIAR_LINHAS = _inteiro('EXPORTACAO_LIMIAR_LINHAS', 2000)
+    # Instrumentação por requisição (desempenho.py, página /admin/desempenho)
+    DESEMPENHO = os.environ.get('DESEMPENHO', '0') == '1'
+    DESEMPENHO_JANELA = _inteiro('DESEMPENHO_JANELA', 1000)  # amostras guardadas por endpoint
+    # cProfile das requisições mais lentas que isto (ms); 0 desliga (?perfilar=1 continua valendo para admins)
+    DESEMPENHO_PERFIL_LIMIAR_MS = _inteiro('DESEMPENHO_PERFIL_LIMIAR_MS', 0)
+    # Métricas no formato do Prometheus em /metrics (metricas.py)
+    METRICAS = os.environ.get('METRICAS', '1') == '1'
+    # Endereços autorizados a coletar, separados por vírgula (vazio libera qualquer um)
+    METRICAS_ENDERECOS = os.environ.get('METRICAS_ENDERECOS', '127.0.0.1,::1')
+    # Detector de consultas N+1 (detector_n1.py): '' desligado, 'log' ou 'estrito'
+    DETECTOR_N1 = os.environ.get('DETECTOR_N1', '')
+    DETECTOR_N1_LIMIAR = _inteiro('DETECTOR_N1_LIMIAR', 10)  # cargas iguais numa requisição
+    # Máximo de abastecimentos por requisição da API de lotes (/api/abastecimentos/lote)
+    API_LOTE_MAXIMO = _inteiro('API_LOTE_MAXIMO', 5000)
+    # Espera (segundos) por um lock de escrita no SQLite antes de falhar com "database is locked"
+    SQLITE_TIMEOUT = _inteiro('SQLITE_TIMEOUT', 15)
+    # Journal WAL: leitores não bloqueiam o escritor; ligado automaticamente com mais de um processo
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '0') == '1' or SERVIDOR_PROCESSOS > 1
+
+
+class ConfigDesenvolvimento(ConfigServidor):
+    TEMPLATES_AUTO_RELOAD = True
+    # Cache de bytecode dos templates Jinja em instance/ (None desliga)
+    TEMPLATES_BYTECODE_CACHE = None
+    PRECOMPILAR_TEMPLATES = False
+
+
+class ConfigProducao(ConfigServidor):
+    # Templates não mudam com o programa rodando: nada de stat nos arquivos a cada render
+    TEMPLATES_AUTO_RELOAD = False
+    TEMPLATES_BYTECODE_CACHE = 'templates_bytecode'
+    PRECOMPILAR_TEMPLATES = True
+
+
+PERFIS = {
+    'desenvolvimento': ConfigDesenvolvimento,
+    'producao': ConfigProducao,
+}
+
+
+def perfil_atual():
+    return os.environ.get('PERFIL', 'desenvolvimento')
+
+
+class CacheBytecodeTemplates(FileSystemBytecodeCache):
+    """Cache de bytecode indexado só pelo nome do template.
+
+    O padrão do Jinja usa também o caminho do arquivo, que no executável do PyInstaller
+    muda a cada abertura (pasta temporária _MEIxxxx) e invalidaria o cache sempre.
+    A validade continua garantida pelo checksum do código-fonte do template.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return super().get_cache_key(name)
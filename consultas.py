@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from datetime import datetime
+from database import db, Veiculo, Motorista, Abastecimento, ContratoCombustivel
+
+# ----------------------
+# Camada de leitura para relatórios
+# ----------------------
+# As rotas de relatório, CSV e PDF apenas leem dados. Em vez de hidratar entidades
+# ORM (identity map, controle de alterações, lazy load) para cada linha, projetam
+# apenas as colunas usadas em um único SELECT e as mapeiam para registros leves com
+# os mesmos nomes de atributos usados nos templates (abastecimento.veiculo.placa etc.).
+
+
+@dataclass(frozen=True, slots=True)
+class VeiculoResumo:
+    id: int
+    placa: str
+    tipo: str
+    combustivel: str
+
+
+@dataclass(frozen=True, slots=True)
+class MotoristaResumo:
+    id: int
+    nome_completo: str
+    documento: str
+    setor: str
+
+
+@dataclass(slots=True)
+class LinhaAbastecimento:
+    id: int
+    data: datetime
+    hodometro: int
+    litros: float
+    valor_total: float
+    numero_nota: str
+    observacoes: str
+    combustivel: str
+    contrato_id: int
+    contrato_numero: str
+    contrato_ano: int
+    veiculo: VeiculoResumo
+    motorista: MotoristaResumo
+    veiculo_id: int
+    motorista_id: int
+
+    @property
+    def contrato_descricao(self):
+        if self.contrato_numero is None:
+            return ""
+        return f"{self.contrato_numero}/{self.contrato_ano}"
+
+
+COLUNAS_ABASTECIMENTO = (
+    Abastecimento.id,
+    Abastecimento.data,
+    Abastecimento.hodometro,
+    Abastecimento.litros,
+    Abastecimento.valor_total,
+    Abastecimento.numero_nota,
+    Abastecimento.observacoes,
+    Abastecimento.combustivel,
+    Abastecimento.contrato_id,
+    ContratoCombustivel.numero_contrato,
+    ContratoCombustivel.ano_contrato,
+    Veiculo.id,
+    Veiculo.placa,
+    Veiculo.tipo,
+    Veiculo.combustivel,
+    Motorista.id,
+    Motorista.nome_completo,
+    Motorista.documento,
+    Motorista.setor,
+)
+
+
+def listar_abastecimentos(query):
+    """Executa uma consulta de abastecimentos (já com join em Veiculo e Motorista e
+    filtros aplicados) e devolve uma lista de LinhaAbastecimento.
+
+    Veículos e motoristas repetidos compartilham o mesmo registro, de modo que o
+    custo de memória cresce com o número de abastecimentos e não com o de junções.
+    As linhas brutas são lidas em lotes (yield_per) para não ficarem todas em memória.
+    """
+    linhas = query.outerjoin(
+        ContratoCombustivel, Abastecimento.contrato_id == ContratoCombustivel.id
+    ).with_entities(*COLUNAS_ABASTECIMENTO).yield_per(5000)
+
+    veiculos = {}
+    motoristas = {}
+    resultado = []
+    for (id_, data, hodometro, litros, valor_total, numero_nota, observacoes, combustivel,
+         contrato_id, contrato_numero, contrato_ano,
+         veiculo_id, placa, tipo, veiculo_combustivel,
+         motorista_id, nome_completo, documento, setor) in linhas:
+        veiculo = veiculos.get(veiculo_id)
+        if veiculo is None:
+            veiculo = veiculos[veiculo_id] = VeiculoResumo(veiculo_id, placa, tipo, veiculo_combustivel)
+        motorista = motoristas.get(motorista_id)
+        if motorista is None:
+            motorista = motoristas[motorista_id] = MotoristaResumo(motorista_id, nome_completo, documento, setor)
+        resultado.append(LinhaAbastecimento(
+            id_, data, hodometro, litros, valor_total, numero_nota, observacoes, combustivel,
+            contrato_id, contrato_numero, contrato_ano, veiculo, motorista, veiculo_id, motorista_id
+        ))
+    return resultado
+
+
+def consulta_abastecimentos():
+    """Consulta base de abastecimentos com os joins esperados por listar_abastecimentos."""
+    return db.session.query(Abastecimento).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).join(
+        Motorista, Abastecimento.motorista_id == Motorista.id
+    )
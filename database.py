@@ -1,3 +1,4 @@
+import re
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
@@ -117,6 +118,50 @@ class AditivoContratoCombustivel(db.Model):
         return f'<Aditivo {self.tipo_aditivo} para Contrato {self.contrato_id}>'
 
 
+# Estado vigente de cada item de contrato, já consolidando os aditivos.
+# Recalculado sempre que um aditivo ou os itens do contrato mudam.
+class ContratoEfetivo(db.Model):
+    __tablename__ = 'contrato_efetivo'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('contrato_combustivel_item.id'), primary_key=True)
+    contrato_id = db.Column(db.Integer, db.ForeignKey('contrato_combustivel.id'), nullable=False, index=True)
+    tipo_combustivel = db.Column(db.String(50), nullable=False)
+    data_inicio = db.Column(db.Date, nullable=False)
+    data_fim = db.Column(db.Date, nullable=False)  # data de término considerando prorrogações
+    quantidade = db.Column(db.Float, nullable=False)  # em litros, considerando aumentos
+    valor_total = db.Column(db.Float, nullable=False)  # considerando reajustes
+    valor_por_litro = db.Column(db.Float, nullable=False)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ContratoEfetivo item {self.item_id} - {self.quantidade}L até {self.data_fim}>'
+
+
+# Chave normalizada da nota fiscal: fornecedor + número sem pontuação nem zeros à esquerda.
+# "000.123" e "123" do mesmo contrato são a mesma nota. O fornecedor é o contrato ou, sem
+# contrato, o CNPJ do emitente da NF-e (prefixo E); sem nenhum dos dois o prefixo é 0 e a
+# chave só serve de aviso, pois fornecedores diferentes repetem números. Um número sem
+# nada além de zeros e pontuação ("000", "-") não identifica a nota: a chave é None.
+NOTA_SEM_FORNECEDOR = '0:'
+
+
+def chave_nota(contrato_id, numero_nota, emitente=None):
+    numero = re.sub(r'[^0-9A-Z]', '', str(numero_nota or '').upper()).lstrip('0')
+    if not numero:
+        return None
+    if contrato_id:
+        return f"{contrato_id}:{numero}"
+    cnpj = re.sub(r'\D', '', str(emitente or ''))
+    return f"E{cnpj}:{numero}" if cnpj else NOTA_SEM_FORNECEDOR + numero
+
+
+def emitente_chave_nota(chave):
+    """CNPJ do emitente gravado numa chave sem contrato, ou None."""
+    if chave and chave.startswith('E'):
+        return chave[1:].partition(':')[0]
+    return None
+
+
 class Abastecimento(db.Model):
     __tablename__ = 'abastecimento'
 
@@ -131,11 +176,59 @@ class Abastecimento(db.Model):
     observacoes = db.Column(db.Text, nullable=True)
     combustivel = db.Column(db.String(50), nullable=True)
     contrato_id = db.Column(db.Integer, db.ForeignKey('contrato_combustivel.id'), nullable=True)
+    # Ver chave_nota(); indexada para a verificação de duplicidade em cada inclusão.
+    # Não é UNIQUE porque o histórico já tem duplicatas (relatório de notas duplicadas).
+    chave_nota = db.Column(db.String(80), nullable=True, index=True)
 
     # Relacionamentos
     veiculo = db.relationship('Veiculo', backref='abastecimentos')
     motorista = db.relationship('Motorista', backref='abastecimentos')
     contrato = db.relationship('ContratoCombustivel', backref='abastecimentos_vinculados')
 
+    # Sequência de abastecimentos de cada veículo (hodômetro anterior/seguinte, ver eficiencia.py)
+    __table_args__ = (db.Index('ix_abastecimento_veiculo_data', 'veiculo_id', 'data'),)
+
     def __repr__(self):
         return f'<Abastecimento {self.id} - {self.litros}L em {self.data}>'
+
+
+# km rodados desde o abastecimento anterior do mesmo veículo e km/L do trecho.
+# Mantida por eficiencia.py a cada inclusão, edição ou exclusão de abastecimento.
+class EficienciaAbastecimento(db.Model):
+    __tablename__ = 'eficiencia_abastecimento'
+
+    abastecimento_id = db.Column(db.Integer, db.ForeignKey('abastecimento.id'), primary_key=True)
+    km = db.Column(db.Integer, nullable=True)  # nulo no primeiro abastecimento do veículo
+    km_por_litro = db.Column(db.Float, nullable=True)  # nulo quando o hodômetro não avançou
+
+    def __repr__(self):
+        return f'<EficienciaAbastecimento {self.abastecimento_id} - {self.km_por_litro} km/L>'
+
+
+# Anomalias encontradas por anomalias.py: uma linha por abastecimento e regra, com o valor
+# encontrado (litros, hodômetro, horas, preço por litro ou km/L) e a referência comparada.
+class AnomaliaAbastecimento(db.Model):
+    __tablename__ = 'anomalia_abastecimento'
+
+    abastecimento_id = db.Column(db.Integer, db.ForeignKey('abastecimento.id'), primary_key=True)
+    regra = db.Column(db.String(20), primary_key=True, index=True)
+    valor = db.Column(db.Float, nullable=True)
+    referencia = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f'<AnomaliaAbastecimento {self.abastecimento_id} - {self.regra}>'
+
+
+# Lotes gravados pela API, pela chave de idempotência do cliente: a repetição de um lote
+# (mesma chave e mesmo conteúdo) devolve a resposta original sem gravar de novo.
+class LoteApi(db.Model):
+    __tablename__ = 'lote_api'
+
+    usuario_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    chave = db.Column(db.String(100), primary_key=True)
+    hash_conteudo = db.Column(db.String(64), nullable=False)  # sha256 do corpo da requisição
+    resposta = db.Column(db.Text, nullable=False)  # JSON devolvido na primeira gravação
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<LoteApi {self.chave} do usuário {self.usuario_id}>'
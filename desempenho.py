@@ -0,0 +1,168 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+import numpy as np
+from flask import g, has_request_context, request, session, before_render_template, template_rendered
+from sqlalchemy import event
+
+# ----------------------
+# Instrumentação por requisição (opcional, DESEMPENHO=1)
+# ----------------------
+# Para cada requisição registra endpoint, tempo total, tempo e quantidade de SQL (eventos
+# before/after_cursor_execute do SQLAlchemy), tempo de renderização de templates e
+# tamanho da resposta. Cada endpoint guarda as últimas `janela` amostras; percentis e
+# histograma são calculados na leitura (/admin/desempenho). Com o pré-fork cada processo
+# tem as próprias amostras.
+#
+# cProfile opcional: com DESEMPENHO_PERFIL_LIMIAR_MS > 0 as requisições são perfiladas e
+# as que passarem do limiar ficam guardadas (as últimas `perfis_guardados`). Um admin
+# também pode pedir o perfil de uma requisição com ?perfilar=1. Só uma requisição é
+# perfilada por vez; as demais seguem sem perfil.
+
+# Limites (ms) das faixas do histograma de latência
+FAIXAS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class MonitorDesempenho:
+    def __init__(self, janela=1000, limiar_perfil_ms=0, perfis_guardados=20):
+        self.janela = janela
+        self.limiar_perfil_ms = limiar_perfil_ms
+        self._amostras = defaultdict(lambda: deque(maxlen=self.janela))
+        self._totais = defaultdict(int)  # requisições desde o início, por endpoint
+        self._trava = threading.Lock()
+        self._perfilando = threading.Lock()
+        self.perfis = deque(maxlen=perfis_guardados)
+        self.inicio = datetime.now()
+
+    # Ciclo da requisição
+    def iniciar(self):
+        g.desempenho = {'inicio': time.perf_counter(), 'sql_ms': 0.0, 'sql': 0, 'template_ms': 0.0, 'templates': []}
+        pedido = request.args.get('perfilar') == '1' and session.get('usuario_tipo') == 'admin'
+        if (pedido or self.limiar_perfil_ms > 0) and self._perfilando.acquire(blocking=False):
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Outro profiler ativo no processo
+                self._perfilando.release()
+                return
+            g.desempenho['perfil'] = perfil
+            g.desempenho['perfil_pedido'] = pedido
+
+    def finalizar(self, resposta):
+        dados = g.pop('desempenho', None)
+        if dados is None:
+            return resposta
+        total_ms = (time.perf_counter() - dados['inicio']) * 1000
+        perfil = dados.get('perfil')
+        if perfil is not None:
+            perfil.disable()
+            self._perfilando.release()
+            if dados['perfil_pedido'] or total_ms >= self.limiar_perfil_ms:
+                self._guardar_perfil(perfil, total_ms)
+        endpoint = request.endpoint or '(sem rota)'
+        amostra = (
+            total_ms, dados['sql_ms'], dados['sql'], dados['template_ms'],
+            resposta.calculate_content_length() or 0, resposta.status_code,
+        )
+        with self._trava:
+            self._amostras[endpoint].append(amostra)
+            self._totais[endpoint] += 1
+        return resposta
+
+    def encerrar(self, erro=None):
+        # Requisição que não passou por finalizar (exceção em outro after_request)
+        dados = g.pop('desempenho', None)
+        if dados and dados.get('perfil') is not None:
+            dados['perfil'].disable()
+            self._perfilando.release()
+
+    def _guardar_perfil(self, perfil, total_ms):
+        saida = io.StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats('cumulative').print_stats(40)
+        self.perfis.appendleft({
+            'data': datetime.now(), 'metodo': request.method, 'url': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint, 'total_ms': total_ms, 'relatorio': saida.getvalue(),
+        })
+
+    # Eventos do SQLAlchemy e dos templates
+    def antes_sql(self, conexao, cursor, sql, parametros, contexto, executemany):
+        conexao.info['desempenho_inicio'] = time.perf_counter()
+
+    def depois_sql(self, conexao, cursor, sql, parametros, contexto, executemany):
+        inicio = conexao.info.pop('desempenho_inicio', None)
+        if inicio is not None and has_request_context() and 'desempenho' in g:
+            g.desempenho['sql_ms'] += (time.perf_counter() - inicio) * 1000
+            g.desempenho['sql'] += 1
+
+    def antes_template(self, app, template, context, **extra):
+        if 'desempenho' in g:
+            g.desempenho['templates'].append(time.perf_counter())
+
+    def depois_template(self, app, template, context, **extra):
+        if 'desempenho' in g and g.desempenho['templates']:
+            g.desempenho['template_ms'] += (time.perf_counter() - g.desempenho['templates'].pop()) * 1000
+
+    # Leitura
+    def resumo(self):
+        """Estatísticas por endpoint sobre a janela atual, do mais lento (p95) ao mais rápido."""
+        with self._trava:
+            copias = {endpoint: np.array(amostras, dtype=float) for endpoint, amostras in self._amostras.items() if amostras}
+            totais = dict(self._totais)
+        endpoints = []
+        for endpoint, matriz in copias.items():
+            total_ms = matriz[:, 0]
+            p50, p90, p95, p99 = np.percentile(total_ms, [50, 90, 95, 99])
+            histograma = np.bincount(np.searchsorted(FAIXAS_MS, total_ms), minlength=len(FAIXAS_MS) + 1)
+            endpoints.append({
+                'endpoint': endpoint,
+                'requisicoes': totais[endpoint],
+                'amostras': len(matriz),
+                'p50_ms': round(float(p50), 2), 'p90_ms': round(float(p90), 2),
+                'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2),
+                'max_ms': round(float(total_ms.max()), 2),
+                'sql_ms_medio': round(float(matriz[:, 1].mean()), 2),
+                'sql_medio': round(float(matriz[:, 2].mean()), 1),
+                'sql_max': int(matriz[:, 2].max()),
+                'template_ms_medio': round(float(matriz[:, 3].mean()), 2),
+                'bytes_medio': int(matriz[:, 4].mean()),
+                'erros': int((matriz[:, 5] >= 500).sum()),
+                'histograma': histograma.tolist(),
+            })
+        endpoints.sort(key=lambda item: item['p95_ms'], reverse=True)
+        return {
+            'desde': self.inicio.isoformat(timespec='seconds'),
+            'janela': self.janela,
+            'faixas_ms': list(FAIXAS_MS),
+            'endpoints': endpoints,
+            'perfis': [{chave: valor for chave, valor in perfil.items() if chave != 'relatorio'}
+                       | {'data': perfil['data'].isoformat(timespec='seconds')} for perfil in self.perfis],
+        }
+
+    def limpar(self):
+        with self._trava:
+            self._amostras.clear()
+            self._totais.clear()
+            self.perfis.clear()
+            self.inicio = datetime.now()
+
+
+def instalar(app, db):
+    """Liga a instrumentação no app; retorna o monitor (ou None com DESEMPENHO desligado)."""
+    if not app.config['DESEMPENHO']:
+        return None
+    monitor = MonitorDesempenho(app.config['DESEMPENHO_JANELA'], app.config['DESEMPENHO_PERFIL_LIMIAR_MS'])
+    app.before_request(monitor.iniciar)
+    app.after_request(monitor.finalizar)
+    app.teardown_request(monitor.encerrar)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', monitor.antes_sql)
+        event.listen(db.engine, 'after_cursor_execute', monitor.depois_sql)
+    before_render_template.connect(monitor.antes_template, app)
+    template_rendered.connect(monitor.depois_template, app)
+    return monitor
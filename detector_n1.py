@@ -0,0 +1,87 @@
+import logging
+import os
+import sys
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# ----------------------
+# Detector de consultas N+1 (desenvolvimento e verificação antes de publicar)
+# ----------------------
+# Com DETECTOR_N1=log ou DETECTOR_N1=estrito, cada carga preguiçosa de relacionamento
+# (ex.: abastecimento.veiculo dentro de um laço) é contada por "formato": classe de origem,
+# classe carregada e SQL. Quando um mesmo formato se repete DETECTOR_N1_LIMIAR vezes numa
+# requisição, a ocorrência é registrada com o endpoint e a origem: linha do template ou,
+# fora de templates, a linha do código do projeto. No modo estrito a carga levanta
+# ConsultaN1Detectada, e a requisição falha.
+#
+# Verificação de todas as rotas: python -m pytest tests (ou python benchmarks/verificar_n1.py)
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+logger = logging.getLogger(__name__)
+
+
+class ConsultaN1Detectada(RuntimeError):
+    pass
+
+
+def _origem():
+    """Linha do template (ou do código do projeto) que disparou a carga."""
+    quadro = sys._getframe(2)
+    codigo_projeto = None
+    while quadro is not None:
+        template = quadro.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f"{template.name}:{template.get_corresponding_lineno(quadro.f_lineno)}"
+        arquivo = quadro.f_code.co_filename
+        if codigo_projeto is None and arquivo.startswith(RAIZ) and arquivo != __file__:
+            codigo_projeto = f"{os.path.relpath(arquivo, RAIZ)}:{quadro.f_lineno}"
+        quadro = quadro.f_back
+    return codigo_projeto or '?'
+
+
+class DetectorN1:
+    def __init__(self, limiar=10, estrito=False):
+        self.limiar = limiar
+        self.estrito = estrito
+        self.ocorrencias = deque(maxlen=200)
+
+    def ao_executar(self, estado):
+        # Instruções que não são SELECT (db.text, UPDATE em lote...) não têm opções de carga
+        if not estado.is_select or estado.lazy_loaded_from is None or not has_request_context():
+            return
+        contagem = g.setdefault('cargas_preguicosas', {})
+        destino = estado.bind_arguments.get('mapper')
+        formato = (
+            estado.lazy_loaded_from.class_.__name__,
+            destino.class_.__name__ if destino is not None else '?',
+            str(estado.statement),
+        )
+        contagem[formato] = contagem.get(formato, 0) + 1
+        if contagem[formato] != self.limiar:
+            return
+        ocorrencia = {
+            'endpoint': request.endpoint,
+            'url': request.full_path.rstrip('?'),
+            'relacionamento': f"{formato[0]} -> {formato[1]}",
+            'origem': _origem(),
+            'limiar': self.limiar,
+        }
+        self.ocorrencias.append(ocorrencia)
+        mensagem = (f"N+1 em {ocorrencia['endpoint']} ({ocorrencia['url']}): {ocorrencia['relacionamento']} "
+                    f"carregado {self.limiar}x um a um, a partir de {ocorrencia['origem']}")
+        if self.estrito:
+            raise ConsultaN1Detectada(mensagem)
+        logger.warning(mensagem)
+
+
+def instalar(app):
+    """Liga o detector conforme DETECTOR_N1 ('log' ou 'estrito'); retorna o detector ou None."""
+    modo = app.config['DETECTOR_N1']
+    if modo not in ('log', 'estrito'):
+        return None
+    detector = DetectorN1(app.config['DETECTOR_N1_LIMIAR'], estrito=modo == 'estrito')
+    event.listen(Session, 'do_orm_execute', detector.ao_executar)
+    return detector
@@ -0,0 +1,173 @@
+from sqlalchemy import bindparam, case, func, text
+
+from database import db, Veiculo, Motorista, Abastecimento, EficienciaAbastecimento
+
+# ----------------------
+# Eficiência (km/L) a partir do hodômetro
+# ----------------------
+# Cada abastecimento guarda em eficiencia_abastecimento os km rodados desde o abastecimento
+# anterior do mesmo veículo (LAG do hodômetro em (veiculo_id ORDER BY data, id)) e o km/L
+# desse trecho: km / litros do abastecimento atual, que repõe o que o trecho consumiu
+# (método do tanque cheio). O primeiro abastecimento do veículo fica com km nulo; leituras
+# com hodômetro igual ou menor que o anterior ficam sem km/L e contam como descartadas.
+#
+# A tabela é mantida de forma incremental: incluir, editar ou excluir um abastecimento
+# recalcula só as linhas do veículo entre a data alterada e o abastecimento seguinte, que é
+# o único cujo "anterior" muda. Lotes (importação, NF-e, API) recalculam, por veículo, do
+# primeiro ao último abastecimento inserido mais o seguinte. Tudo numa instrução e dentro da
+# transação de quem grava.
+
+# (veiculo_id, inicio, fim): datas alteradas em cada veículo
+FAIXAS_POR_IDS = """
+    SELECT veiculo_id, min(data) AS inicio, max(data) AS fim
+    FROM abastecimento WHERE id IN :ids GROUP BY veiculo_id
+"""
+FAIXA_POSICAO = "SELECT :veiculo_id AS veiculo_id, :data AS inicio, :data AS fim"
+
+RECALCULAR = """
+    WITH faixas AS ({faixas}),
+    limites AS (
+        SELECT f.veiculo_id, f.inicio,
+               (SELECT max(a.data) FROM abastecimento a WHERE a.veiculo_id = f.veiculo_id AND a.data < f.inicio) AS anterior,
+               (SELECT min(a.data) FROM abastecimento a WHERE a.veiculo_id = f.veiculo_id AND a.data > f.fim) AS seguinte
+        FROM faixas f
+    ),
+    trechos AS (
+        SELECT a.id, a.data, a.litros, l.inicio,
+               a.hodometro - LAG(a.hodometro) OVER (PARTITION BY a.veiculo_id ORDER BY a.data, a.id) AS km
+        FROM abastecimento a JOIN limites l ON l.veiculo_id = a.veiculo_id
+        WHERE a.data >= coalesce(l.anterior, l.inicio) AND (l.seguinte IS NULL OR a.data <= l.seguinte)
+    )
+    INSERT OR REPLACE INTO eficiencia_abastecimento (abastecimento_id, km, km_por_litro)
+    SELECT id, km, CASE WHEN km > 0 AND litros > 0 THEN km * 1.0 / litros END
+    FROM trechos WHERE data >= inicio
+"""
+
+RECALCULAR_TUDO = """
+    INSERT INTO eficiencia_abastecimento (abastecimento_id, km, km_por_litro)
+    SELECT id, km, CASE WHEN km > 0 AND litros > 0 THEN km * 1.0 / litros END
+    FROM (
+        SELECT id, litros, hodometro - LAG(hodometro) OVER (PARTITION BY veiculo_id ORDER BY data, id) AS km
+        FROM abastecimento
+    )
+"""
+
+
+def recalcular_tudo():
+    """Refaz a tabela inteira (migração e comando recalcular-eficiencia)."""
+    db.session.execute(text("DELETE FROM eficiencia_abastecimento"))
+    db.session.execute(text(RECALCULAR_TUDO))
+
+
+def recalcular_ids(ids):
+    """Abastecimentos incluídos ou movidos: recalcula eles e os vizinhos seguintes."""
+    if not ids:
+        return
+    db.session.flush()
+    db.session.execute(
+        text(RECALCULAR.format(faixas=FAIXAS_POR_IDS)).bindparams(bindparam('ids', expanding=True)),
+        {'ids': list(ids)}
+    )
+
+
+def recalcular_posicao(veiculo_id, data):
+    """Abastecimento que saiu de (veiculo_id, data): recalcula o seguinte, que ganhou outro anterior."""
+    db.session.flush()
+    db.session.execute(
+        text(RECALCULAR.format(faixas=FAIXA_POSICAO)).bindparams(bindparam('data', type_=db.DateTime)),
+        {'veiculo_id': veiculo_id, 'data': data}
+    )
+
+
+def remover(abastecimento_id, veiculo_id, data):
+    db.session.execute(
+        text("DELETE FROM eficiencia_abastecimento WHERE abastecimento_id = :id"), {'id': abastecimento_id}
+    )
+    recalcular_posicao(veiculo_id, data)
+
+
+# ----------------------
+# Agregações do relatório
+# ----------------------
+AGRUPAMENTOS = {
+    'veiculo': 'Veículo',
+    'motorista': 'Motorista',
+    'setor': 'Setor',
+    'mes': 'Mês',
+}
+
+
+def agregar(agrupamento='veiculo', data_inicio=None, data_fim=None, setor=None):
+    """km, litros, km/L ponderado e custo por km por grupo, num único GROUP BY.
+
+    O período filtra a data do abastecimento que fecha cada trecho. O km/L do grupo é
+    a soma dos km sobre a soma dos litros dos trechos válidos; mínimo e máximo são os
+    dos trechos individuais.
+    """
+    valido = EficienciaAbastecimento.km_por_litro.isnot(None)
+    grupo = {
+        'veiculo': Veiculo.placa,
+        'motorista': Motorista.nome_completo,
+        'setor': Veiculo.tipo,
+        'mes': func.strftime('%Y-%m', Abastecimento.data),
+    }[agrupamento]
+    chave = {'veiculo': Veiculo.id, 'motorista': Motorista.id}.get(agrupamento, grupo)
+    km = func.sum(case((valido, EficienciaAbastecimento.km), else_=0))
+    litros = func.sum(case((valido, Abastecimento.litros), else_=0))
+    valor = func.sum(case((valido, Abastecimento.valor_total), else_=0))
+    consulta = db.session.query(
+        grupo.label('grupo'),
+        func.count(EficienciaAbastecimento.km_por_litro).label('trechos'),
+        func.sum(case((valido, 0), else_=1)).label('descartados'),
+        km.label('km'),
+        litros.label('litros'),
+        valor.label('valor'),
+        func.min(EficienciaAbastecimento.km_por_litro).label('km_por_litro_min'),
+        func.max(EficienciaAbastecimento.km_por_litro).label('km_por_litro_max'),
+    ).select_from(EficienciaAbastecimento).join(
+        Abastecimento, Abastecimento.id == EficienciaAbastecimento.abastecimento_id
+    ).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).join(
+        Motorista, Abastecimento.motorista_id == Motorista.id
+    ).filter(EficienciaAbastecimento.km.isnot(None))
+    if data_inicio:
+        consulta = consulta.filter(Abastecimento.data >= data_inicio)
+    if data_fim:
+        consulta = consulta.filter(Abastecimento.data <= data_fim)
+    if setor:
+        consulta = consulta.filter(Veiculo.tipo == setor)
+    # Meses em ordem cronológica; os demais do mais eficiente ao menos (sem trecho válido por último)
+    ordem = grupo if agrupamento == 'mes' else (km * 1.0 / func.nullif(litros, 0)).desc().nulls_last()
+    linhas = []
+    for linha in consulta.group_by(chave).order_by(ordem):
+        linhas.append({
+            'grupo': linha.grupo,
+            'trechos': linha.trechos,
+            'descartados': linha.descartados,
+            'km': linha.km or 0,
+            'litros': linha.litros or 0,
+            'valor': linha.valor or 0,
+            'km_por_litro': linha.km / linha.litros if linha.litros else None,
+            'custo_km': linha.valor / linha.km if linha.km else None,
+            'km_por_litro_min': linha.km_por_litro_min,
+            'km_por_litro_max': linha.km_por_litro_max,
+        })
+    return linhas
+
+
+def totais(linhas):
+    minimos = [linha['km_por_litro_min'] for linha in linhas if linha['km_por_litro_min'] is not None]
+    maximos = [linha['km_por_litro_max'] for linha in linhas if linha['km_por_litro_max'] is not None]
+    km = sum(linha['km'] for linha in linhas)
+    litros = sum(linha['litros'] for linha in linhas)
+    valor = sum(linha['valor'] for linha in linhas)
+    return {
+        'trechos': sum(linha['trechos'] for linha in linhas),
+        'descartados': sum(linha['descartados'] for linha in linhas),
+        'km': km,
+        'litros': litros,
+        'valor': valor,
+        'km_por_litro': km / litros if litros else None,
+        'custo_km': valor / km if km else None,
+        'km_por_litro_min': min(minimos, default=None),
+        'km_por_litro_max': max(maximos, default=None),
+    }
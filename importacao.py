@@ -0,0 +1,496 @@
+import csv
+import io
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert, func, literal_column
+from database import db, Veiculo, Motorista, Abastecimento, ContratoCombustivel, ContratoEfetivo, chave_nota, NOTA_SEM_FORNECEDOR
+import anomalias
+import eficiencia
+import previsao
+
+# ----------------------
+# Importação de abastecimentos em lote (CSV / XLSX)
+# ----------------------
+# As linhas da planilha são lidas em fluxo, validadas em lotes contra mapas em memória
+# (placa -> veículo, documento -> motorista, número/ano -> contrato) e gravadas com um
+# INSERT em lote por bloco, cada bloco na sua própria transação. Os mapas recebem, a cada
+# bloco, só os cadastros citados nele (consultas pelos índices de expressão abaixo), de modo
+# que um lote pequeno da API não paga pelo tamanho das tabelas. Linhas inválidas não
+# impedem as demais e voltam no relatório de erros com o número da linha na planilha.
+# Notas repetidas dentro do arquivo são vistas em memória; as já gravadas, por uma consulta
+# por bloco só às chaves dele (índice ix_abastecimento_chave_nota).
+# Uma falha na leitura ou na gravação de um bloco interrompe a importação: os blocos
+# anteriores continuam gravados e o resultado traz os ids deles e a falha.
+
+TAMANHO_LOTE = 5000
+
+# Nome normalizado do cabeçalho -> campo
+CABECALHOS = {
+    'data': 'data', 'data_hora': 'data', 'data/hora': 'data',
+    'placa': 'placa', 'veiculo': 'placa',
+    'documento': 'documento', 'cpf': 'documento', 'documento_motorista': 'documento', 'motorista': 'documento',
+    'hodometro': 'hodometro', 'odometro': 'hodometro', 'km': 'hodometro',
+    'litros': 'litros', 'quantidade': 'litros',
+    'valor_total': 'valor_total', 'valor': 'valor_total',
+    'numero_nota': 'numero_nota', 'nota': 'numero_nota', 'nota_fiscal': 'numero_nota',
+    'observacoes': 'observacoes', 'obs': 'observacoes',
+    'contrato': 'contrato',
+}
+OBRIGATORIOS = ('data', 'placa', 'documento', 'hodometro', 'litros', 'valor_total', 'numero_nota')
+FORMATOS_DATA = ('%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+# Maior inteiro gravável numa coluna INTEGER do SQLite
+INTEIRO_MAXIMO = 2 ** 63 - 1
+
+# Placa e documento sem a pontuação usual, calculados no SQLite para buscar os cadastros pelo
+# valor normalizado. O texto é o mesmo dos índices criados na migração (versão 9): só assim o
+# SQLite usa o índice de expressão.
+PLACA_SQL = "upper(replace(replace(replace(placa, '-', ''), ' ', ''), '.', ''))"
+DOCUMENTO_SQL = "upper(replace(replace(replace(replace(documento, '.', ''), '-', ''), '/', ''), ' ', ''))"
+INDICES_NORMALIZADOS = {
+    'ix_veiculo_placa_normalizada': ('veiculo', PLACA_SQL),
+    'ix_motorista_documento_normalizado': ('motorista', DOCUMENTO_SQL),
+}
+
+
+@dataclass
+class ResultadoImportacao:
+    importados: int = 0
+    ids: list = field(default_factory=list)
+    erros: list = field(default_factory=list)  # [(linha, mensagem)]
+    falha: str = None  # motivo da interrupção; o que está em `ids` já foi gravado
+
+    @property
+    def total_linhas(self):
+        return self.importados + len(self.erros)
+
+
+class ErroLinha(ValueError):
+    pass
+
+
+# ----------------------
+# Normalização
+# ----------------------
+def normalizar_cabecalho(nome):
+    nome = unicodedata.normalize('NFKD', str(nome or '')).encode('ascii', 'ignore').decode()
+    return re.sub(r'\s+', '_', nome.strip().lower())
+
+
+def normalizar_placa(placa):
+    return re.sub(r'[^A-Z0-9]', '', str(placa or '').upper())
+
+
+def normalizar_documento(documento):
+    if isinstance(documento, float) and documento.is_integer():
+        documento = int(documento)
+    if isinstance(documento, int):
+        # CPF digitado como número no Excel perde os zeros à esquerda
+        return str(documento).zfill(11)
+    texto = str(documento or '').strip()
+    digitos = re.sub(r'\D', '', texto)
+    return digitos or texto.upper()
+
+
+def converter_numero(valor, campo):
+    if isinstance(valor, (int, float)):
+        texto = valor
+    else:
+        texto = str(valor or '').replace('R$', '').replace(' ', '').strip()
+        if not texto:
+            raise ErroLinha(f"{campo} não informado")
+        if ',' in texto:
+            # Formato brasileiro: 1.234,56
+            texto = texto.replace('.', '').replace(',', '.')
+    try:
+        numero = float(texto)
+    except (OverflowError, ValueError):
+        raise ErroLinha(f"{campo} inválido: {valor}")
+    if not math.isfinite(numero):
+        # NaN e infinito chegam pela API (o JSON do Python aceita) e quebrariam as contas
+        raise ErroLinha(f"{campo} inválido: {valor}")
+    return numero
+
+
+def converter_inteiro(valor, campo):
+    numero = converter_numero(valor, campo)
+    if abs(numero) > INTEIRO_MAXIMO:
+        # O SQLite recusaria na gravação, derrubando o bloco (ou o lote da API) inteiro
+        raise ErroLinha(f"{campo} fora do intervalo: {valor}")
+    return int(numero)
+
+
+def converter_data(valor):
+    if isinstance(valor, datetime):
+        return valor
+    texto = str(valor or '').strip()
+    if not texto:
+        raise ErroLinha("data não informada")
+    try:
+        # Com fuso (2025-03-10T08:15:00-03:00) guarda o horário local informado, como nas NF-e
+        return datetime.fromisoformat(texto).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    raise ErroLinha(f"data inválida: {valor}")
+
+
+# ----------------------
+# Leitura das planilhas
+# ----------------------
+def _linhas_csv(conteudo):
+    try:
+        texto = conteudo.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = conteudo.decode('latin-1')
+    primeira_linha = texto.split('\n', 1)[0]
+    separador = ';' if primeira_linha.count(';') > primeira_linha.count(',') else ','
+    yield from csv.reader(io.StringIO(texto), delimiter=separador)
+
+
+def _linhas_xlsx(conteudo):
+    from openpyxl import load_workbook  # só necessário na importação
+    planilha = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+    try:
+        yield from planilha.active.iter_rows(values_only=True)
+    finally:
+        planilha.close()
+
+
+def ler_planilha(conteudo, nome_arquivo):
+    """Gera (número da linha, {campo: valor}) a partir de um CSV ou XLSX, pulando linhas vazias."""
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao in ('.xlsx', '.xlsm'):
+        linhas = _linhas_xlsx(conteudo)
+    elif extensao in ('.csv', '.txt', ''):
+        linhas = _linhas_csv(conteudo)
+    else:
+        raise ValueError(f"Formato não suportado: {extensao} (use CSV ou XLSX)")
+
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        raise ValueError("Planilha vazia")
+    campos = [CABECALHOS.get(normalizar_cabecalho(nome)) for nome in cabecalho]
+    faltando = [campo for campo in OBRIGATORIOS if campo not in campos]
+    if faltando:
+        raise ValueError("Colunas obrigatórias ausentes: " + ", ".join(faltando))
+
+    for numero, valores in enumerate(linhas, start=2):
+        if not valores or all(valor in (None, '') for valor in valores):
+            continue
+        yield numero, {campo: valor for campo, valor in zip(campos, valores) if campo}
+
+
+# ----------------------
+# Importação
+# ----------------------
+def _nota_lancada(numero_nota, contrato_id):
+    return f"nota {numero_nota} já lançada" + (" neste contrato" if contrato_id else " por este emitente")
+
+
+def _numero_ano_contrato(contrato):
+    """("12", 2025) a partir de "12/2025", ou None."""
+    numero, _, ano = contrato.partition('/')
+    try:
+        return numero.strip(), int(ano)
+    except ValueError:
+        return None
+
+
+class ImportadorAbastecimentos:
+    def __init__(self, setor=None):
+        """`setor` restringe a importação aos veículos do setor (usuários não administradores)."""
+        self.setor = setor
+        # Preenchidos por bloco em carregar(); None marca o que foi consultado e não existe
+        self.veiculos = {}
+        self.motoristas = {}
+        self.contratos = {}
+        # Chaves de nota aceitas neste arquivo/lote; as do banco são conferidas por bloco
+        # (descartar_notas_lancadas)
+        self.chaves = set()
+
+    def carregar(self, linhas):
+        """Consulta os veículos, motoristas e contratos citados nas linhas do bloco que ainda não estão nos mapas."""
+        linhas = [linha for linha in linhas if isinstance(linha, dict)]
+        placas = {normalizar_placa(linha.get('placa')) for linha in linhas} - self.veiculos.keys() - {''}
+        if placas:
+            self.veiculos.update(dict.fromkeys(placas))
+            for veiculo_id, placa, combustivel, tipo in db.session.query(
+                Veiculo.id, Veiculo.placa, Veiculo.combustivel, Veiculo.tipo
+            ).filter(literal_column(PLACA_SQL).in_(placas)):
+                self.veiculos[normalizar_placa(placa)] = (veiculo_id, combustivel, tipo)
+
+        documentos = {normalizar_documento(linha.get('documento')) for linha in linhas} - self.motoristas.keys() - {''}
+        if documentos:
+            self.motoristas.update(dict.fromkeys(documentos))
+            for motorista_id, documento in db.session.query(Motorista.id, Motorista.documento).filter(
+                literal_column(DOCUMENTO_SQL).in_(documentos)
+            ):
+                self.motoristas[normalizar_documento(documento)] = motorista_id
+
+        contratos = {_numero_ano_contrato(str(linha.get('contrato') or '').strip()) for linha in linhas if linha.get('contrato')}
+        contratos -= self.contratos.keys() | {None}
+        if contratos:
+            self.contratos.update(dict.fromkeys(contratos))
+            for contrato_id, numero, ano in db.session.query(
+                ContratoCombustivel.id, ContratoCombustivel.numero_contrato, ContratoCombustivel.ano_contrato
+            ).filter(
+                ContratoCombustivel.numero_contrato.in_({numero for numero, _ in contratos}),
+                ContratoCombustivel.ano_contrato.in_({ano for _, ano in contratos})
+            ):
+                if (str(numero).strip(), int(ano)) in contratos:
+                    self.contratos[(str(numero).strip(), int(ano))] = contrato_id
+
+    def reservar_chave(self, contrato_id, numero_nota, emitente=None):
+        chave = chave_nota(contrato_id, numero_nota, emitente)
+        if chave is None:
+            raise ErroLinha(f"número da nota inválido: {numero_nota}")
+        if chave.startswith(NOTA_SEM_FORNECEDOR):
+            # Sem contrato nem emitente o número pode ser de outro fornecedor: não bloqueia
+            # (a nota aparece no relatório de notas duplicadas)
+            return chave
+        if chave in self.chaves:
+            raise ErroLinha(_nota_lancada(numero_nota, contrato_id))
+        self.chaves.add(chave)
+        return chave
+
+    def descartar_notas_lancadas(self, validas, erros):
+        """Tira de `validas` [(origem, dados)] as notas já gravadas no banco, que vão para `erros`.
+
+        Consulta pelo índice só as chaves do bloco, em vez de carregar todas as do banco.
+        """
+        chaves = {dados['chave_nota'] for _, dados in validas if not dados['chave_nota'].startswith(NOTA_SEM_FORNECEDOR)}
+        if not chaves:
+            return validas
+        lancadas = {chave for (chave,) in db.session.query(Abastecimento.chave_nota).filter(
+            Abastecimento.chave_nota.in_(chaves)
+        )}
+        if not lancadas:
+            return validas
+        aceitas = []
+        for origem, dados in validas:
+            if dados['chave_nota'] in lancadas:
+                erros.append((origem, _nota_lancada(dados['numero_nota'], dados['contrato_id'])))
+            else:
+                aceitas.append((origem, dados))
+        return aceitas
+
+    def validar(self, linha):
+        """Converte uma linha da planilha no dicionário de inserção ou lança ErroLinha."""
+        veiculo = self.veiculos.get(normalizar_placa(linha.get('placa')))
+        if veiculo is None:
+            raise ErroLinha(f"veículo não cadastrado: {linha.get('placa')}")
+        veiculo_id, combustivel, tipo = veiculo
+        if self.setor and tipo != self.setor:
+            raise ErroLinha(f"veículo {linha.get('placa')} não pertence ao setor {self.setor}")
+        motorista_id = self.motoristas.get(normalizar_documento(linha.get('documento')))
+        if motorista_id is None:
+            raise ErroLinha(f"motorista não cadastrado: {linha.get('documento')}")
+
+        contrato_id = None
+        contrato = str(linha.get('contrato') or '').strip()
+        if contrato:
+            contrato_id = self.contratos.get(_numero_ano_contrato(contrato))
+            if contrato_id is None:
+                raise ErroLinha(f"contrato não encontrado: {contrato} (use número/ano)")
+
+        litros = converter_numero(linha.get('litros'), 'litros')
+        if litros <= 0:
+            raise ErroLinha("litros deve ser maior que zero")
+        valor_total = converter_numero(linha.get('valor_total'), 'valor')
+        if valor_total < 0:
+            raise ErroLinha("valor não pode ser negativo")
+        numero_nota = linha.get('numero_nota')
+        if isinstance(numero_nota, float) and numero_nota.is_integer():
+            numero_nota = int(numero_nota)
+        numero_nota = str(numero_nota or '').strip()
+        if not numero_nota:
+            raise ErroLinha("número da nota não informado")
+
+        return {
+            'data': converter_data(linha.get('data')),
+            'veiculo_id': veiculo_id,
+            'motorista_id': motorista_id,
+            'hodometro': converter_inteiro(linha.get('hodometro'), 'hodômetro'),
+            'litros': litros,
+            'valor_total': valor_total,
+            'numero_nota': numero_nota,
+            'observacoes': str(linha.get('observacoes') or '').strip() or None,
+            'combustivel': combustivel,
+            'contrato_id': contrato_id,
+            # Por último: só reserva a chave depois que as conversões acima passaram
+            'chave_nota': self.reservar_chave(contrato_id, numero_nota),
+        }
+
+    def _gravar(self, lote, resultado):
+        ids = db.session.scalars(insert(Abastecimento).returning(Abastecimento.id), lote).all()
+        eficiencia.recalcular_ids(ids)
+        anomalias.verificar_ids(ids)
+        previsao.cache.marcar_ids(ids)
+        db.session.commit()
+        resultado.importados += len(ids)
+        resultado.ids.extend(ids)
+
+    def gravar_tudo_ou_nada(self, itens):
+        """Valida todos os itens e, se nenhum falhar, insere todos numa só instrução em lote.
+
+        Retorna (ids, erros): ids na ordem dos itens, ou erros [(índice, mensagem)] sem gravar
+        nada. Não faz commit; a transação fica com quem chama (ver a API de lotes).
+        """
+        self.carregar(itens)
+        validos, erros = [], []
+        for indice, item in enumerate(itens):
+            try:
+                if not isinstance(item, dict):
+                    raise ErroLinha("item deve ser um objeto")
+                validos.append((indice, self.validar(item)))
+            except ErroLinha as erro:
+                erros.append((indice, str(erro)))
+        validos = self.descartar_notas_lancadas(validos, erros)
+        if erros or not validos:
+            return [], sorted(erros)
+        ids = db.session.scalars(
+            insert(Abastecimento).returning(Abastecimento.id, sort_by_parameter_order=True),
+            [dados for _, dados in validos]
+        ).all()
+        return ids, []
+
+    def importar(self, linhas, tamanho_lote=TAMANHO_LOTE):
+        """Valida e grava as linhas (iterável de (número, dict)) em blocos de `tamanho_lote`.
+
+        Não propaga falhas de leitura ou gravação: desfaz o bloco em andamento e devolve o
+        resultado com `falha`, para quem chama registrar os blocos já gravados.
+        """
+        resultado = ResultadoImportacao()
+        linhas = iter(linhas)
+        try:
+            while True:
+                bloco = list(islice(linhas, tamanho_lote))
+                if not bloco:
+                    break
+                self.carregar([linha for _, linha in bloco])
+                lote, erros = [], []
+                for numero, linha in bloco:
+                    try:
+                        lote.append((numero, self.validar(linha)))
+                    except ErroLinha as erro:
+                        erros.append((numero, str(erro)))
+                lote = self.descartar_notas_lancadas(lote, erros)
+                resultado.erros.extend(sorted(erros, key=lambda erro: erro[0]))
+                if lote:
+                    self._gravar([dados for _, dados in lote], resultado)
+        except Exception as e:
+            db.session.rollback()
+            resultado.falha = str(e)
+        return resultado
+
+
+class ImportadorNFe(ImportadorAbastecimentos):
+    """Grava abastecimentos a partir de NF-e já lidas por nfe.ler_lote.
+
+    Notas repetidas (no banco ou no próprio lote) são descartadas pela chave da nota (contrato
+    ou, sem contrato, CNPJ do emitente). Sem CPF do motorista nas informações complementares,
+    usa o do último abastecimento do veículo; sem hodômetro a nota é recusada (repetir o
+    anterior criaria um trecho de 0 km na eficiência e nas anomalias). O contrato é o ativo
+    do combustível do veículo vigente na data da nota, preferindo o do mesmo setor.
+    """
+
+    def __init__(self, setor=None):
+        super().__init__(setor)
+        # Motorista do último abastecimento de cada veículo do lote (preenchido em carregar)
+        self.ultimos = {}
+        self.vigencias = defaultdict(list)
+        for contrato_id, setor_contrato, tipo, inicio, fim in db.session.query(
+            ContratoEfetivo.contrato_id, ContratoCombustivel.setor, ContratoEfetivo.tipo_combustivel,
+            ContratoEfetivo.data_inicio, ContratoEfetivo.data_fim
+        ).join(ContratoCombustivel, ContratoCombustivel.id == ContratoEfetivo.contrato_id).filter(
+            ContratoCombustivel.ativo == True
+        ).order_by(ContratoEfetivo.data_inicio.desc()):
+            self.vigencias[tipo].append((contrato_id, setor_contrato, inicio, fim))
+
+    def carregar(self, notas):
+        super().carregar(notas)
+        veiculos = {self.veiculos.get(normalizar_placa(nota['placa'])) for nota in notas if isinstance(nota, dict)}
+        novos = {veiculo[0] for veiculo in veiculos if veiculo} - self.ultimos.keys()
+        if not novos:
+            return
+        self.ultimos.update(dict.fromkeys(novos))
+        ordem = func.row_number().over(
+            partition_by=Abastecimento.veiculo_id,
+            order_by=(Abastecimento.data.desc(), Abastecimento.id.desc())
+        ).label('ordem')
+        recentes = db.session.query(Abastecimento.veiculo_id, Abastecimento.motorista_id, ordem).filter(
+            Abastecimento.veiculo_id.in_(novos)
+        ).subquery()
+        self.ultimos.update(db.session.query(recentes.c.veiculo_id, recentes.c.motorista_id).filter(recentes.c.ordem == 1))
+
+    def escolher_contrato(self, combustivel, data, setor):
+        dia = data.date()
+        vigentes = [(contrato_id, setor_contrato) for contrato_id, setor_contrato, inicio, fim
+                    in self.vigencias.get(combustivel, ()) if inicio <= dia <= fim]
+        for contrato_id, setor_contrato in vigentes:
+            if setor_contrato == setor:
+                return contrato_id
+        for contrato_id, setor_contrato in vigentes:
+            if not setor_contrato:
+                return contrato_id
+        return vigentes[0][0] if vigentes else None
+
+    def validar(self, nota):
+        if isinstance(nota, Exception):
+            raise ErroLinha(f"XML inválido: {nota}")
+        numero_nota = nota['numero_nota']
+        if not nota['placa']:
+            raise ErroLinha(f"nota {numero_nota} sem placa nas informações complementares")
+        veiculo = self.veiculos.get(normalizar_placa(nota['placa']))
+        if veiculo is None:
+            raise ErroLinha(f"veículo não cadastrado: {nota['placa']}")
+        veiculo_id, combustivel, tipo = veiculo
+        if self.setor and tipo != self.setor:
+            raise ErroLinha(f"veículo {nota['placa']} não pertence ao setor {self.setor}")
+
+        hodometro = nota['hodometro']
+        if hodometro is None:
+            raise ErroLinha(f"nota {numero_nota}: hodômetro não informado nas informações complementares")
+        motorista_anterior = self.ultimos.get(veiculo_id)
+        observacoes = [f"Importado da NF-e {numero_nota}" + (f" ({nota['fornecedor']})" if nota.get('fornecedor') else "")]
+        motorista_id = self.motoristas.get(normalizar_documento(nota['documento'])) if nota['documento'] else None
+        if motorista_id is None:
+            if motorista_anterior is None:
+                raise ErroLinha(f"nota {numero_nota}: motorista não identificado e veículo sem abastecimentos anteriores")
+            motorista_id = motorista_anterior
+            observacoes.append("motorista do último abastecimento do veículo")
+
+        contrato_id = self.escolher_contrato(combustivel, nota['data'], tipo)
+        chave = self.reservar_chave(contrato_id, numero_nota, nota.get('cnpj_emitente'))
+        self.ultimos[veiculo_id] = motorista_id
+        return {
+            'data': nota['data'],
+            'veiculo_id': veiculo_id,
+            'motorista_id': motorista_id,
+            'hodometro': hodometro,
+            'litros': round(nota['litros'], 3),
+            'valor_total': round(nota['valor_produtos'] or nota.get('valor_nota', 0.0), 2),
+            'numero_nota': numero_nota,
+            'observacoes': "; ".join(observacoes),
+            'combustivel': combustivel,
+            'contrato_id': contrato_id,
+            'chave_nota': chave,
+        }
+
+
+def relatorio_erros_csv(erros, origem='Linha'):
+    saida = io.StringIO()
+    escritor = csv.writer(saida, delimiter=';')
+    escritor.writerow([origem, 'Erro'])
+    escritor.writerows(erros)
+    return saida.getvalue()
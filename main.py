@@ -1,10 +1,32 @@
 # main.py
+import multiprocessing
 import threading
 import time
-import webview
 import os
 import sys
-from app import app
+import urllib.request
+
+# No executável o cache colunar fica ligado; o snapshot em instance/ evita remontá-lo a cada abertura
+os.environ.setdefault('CACHE_COLUNAR', '1')
+# Início rápido: o cache é carregado em segundo plano, depois que o servidor já responde
+os.environ.setdefault('INICIO_RAPIDO', '1')
+# Perfil de produção: templates sem auto-reload, com cache de bytecode em instance/
+os.environ.setdefault('PERFIL', 'producao')
+
+from config import PERFIS, perfil_atual
+
+# Endereço e porta vêm da configuração (SERVIDOR_HOST / SERVIDOR_PORTA)
+CONFIG = PERFIS[perfil_atual()]
+URL = f'http://{CONFIG.SERVIDOR_HOST}:{CONFIG.SERVIDOR_PORTA}'
+TEMPO_MAXIMO_INICIO = 60  # segundos
+
+# Tela exibida enquanto o servidor sobe (a janela abre antes de importar o app)
+TELA_CARREGANDO = """
+<html><body style="font-family: sans-serif; display: flex; align-items: center;
+justify-content: center; height: 100vh; margin: 0; color: #555;">
+<p>Carregando Gestão de Combustível...</p>
+</body></html>
+"""
 
 # Função para obter caminho de recursos (necessária para PyInstaller)
 def resource_path(relative_path):
@@ -17,9 +39,30 @@ def resource_path(relative_path):
 
 def start_server():
     """Inicia o servidor com waitress"""
-    from waitress import serve
-    print("Servidor rodando em http://127.0.0.1:5000")
-    serve(app, host='127.0.0.1', port=5000)
+    import servidor
+    from app import app
+    # A janela roda neste processo: sem pré-fork no executável
+    servidor.servir(app, processos=1)
+
+def aguardar_servidor(tempo_maximo=TEMPO_MAXIMO_INICIO):
+    """Consulta /saude até o servidor responder; retorna False se o tempo máximo esgotar."""
+    limite = time.monotonic() + tempo_maximo
+    while time.monotonic() < limite:
+        try:
+            with urllib.request.urlopen(f'{URL}/saude', timeout=1) as resposta:
+                if resposta.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return False
+
+def abrir_quando_pronto(window):
+    """Executado pelo webview após a janela aparecer: troca a tela de carregamento pelo sistema."""
+    if aguardar_servidor():
+        window.load_url(URL)
+    else:
+        window.load_html("<p>Não foi possível iniciar o servidor local.</p>")
 
 # Função para evitar abrir links em navegador externo
 def on_new_window(url):
@@ -27,16 +70,25 @@ def on_new_window(url):
     return False  # Impede ação padrão
 
 if __name__ == '__main__':
+    # No executável, os processos de leitura de NF-e reexecutam este arquivo
+    multiprocessing.freeze_support()
+
     # Inicia o servidor em uma thread
     t = threading.Thread(target=start_server)
     t.daemon = True
     t.start()
-    time.sleep(1)  # Espera o servidor iniciar
+
+    if '--sem-janela' in sys.argv:
+        # Apenas o servidor (usado pelo benchmark de inicialização)
+        t.join()
+        sys.exit(0)
+
+    import webview
 
     # Cria a janela do sistema
     window = webview.create_window(
         'Gestão de Combustível',
-        'http://127.0.0.1:5000',
+        html=TELA_CARREGANDO,
         width=1200,
         height=800,
         resizable=True,
@@ -44,4 +96,4 @@ if __name__ == '__main__':
     )
 
     # Inicia o webview sem abrir navegador externo
-    webview.start(debug=False)
+    webview.start(abrir_quando_pronto, window, debug=False)
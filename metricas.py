@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+
+from desempenho import FAIXAS_MS
+
+# ----------------------
+# Métricas no formato de exposição do Prometheus (/metrics)
+# ----------------------
+# Contadores e histogramas simples mantidos em dicionários sob uma trava, sem dependência
+# externa; o texto é montado só quando o coletor é lido. No caminho das requisições o custo é
+# um perf_counter e alguns incrementos; tamanhos de arquivo, fila da faixa pesada e threads do
+# waitress são lidos na hora da coleta.
+#
+# São por processo: com SERVIDOR_PROCESSOS > 1 cada coleta vê o processo que a atendeu
+# (o rótulo pid das métricas de processo identifica qual).
+
+PREFIXO = 'gestao_combustivel'
+FAIXAS_S = tuple(limite / 1000 for limite in FAIXAS_MS)
+FAIXAS_PDF_S = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _rotulos(**rotulos):
+    partes = []
+    for nome, valor in rotulos.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nome}="{valor}"')
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+class Histograma:
+    def __init__(self, faixas):
+        self.faixas = faixas
+        self.contagens = [0] * (len(faixas) + 1)
+        self.soma = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.faixas, valor)] += 1
+        self.soma += valor
+
+    def linhas(self, nome, **rotulos):
+        acumulado = 0
+        for limite, quantidade in zip(self.faixas + ('+Inf',), self.contagens):
+            acumulado += quantidade
+            yield f"{nome}_bucket{_rotulos(**rotulos, le=limite)} {acumulado}"
+        yield f"{nome}_sum{_rotulos(**rotulos)} {self.soma}"
+        yield f"{nome}_count{_rotulos(**rotulos)} {acumulado}"
+
+
+class ColetorMetricas:
+    def __init__(self, caminho_banco, faixa_pesada=None, threads_configuradas=None, enderecos_permitidos=()):
+        self.caminho_banco = caminho_banco
+        self.enderecos_permitidos = set(enderecos_permitidos)
+        self.faixa_pesada = faixa_pesada
+        self.threads_configuradas = threads_configuradas
+        # Despachante de tarefas do waitress (ver servidor.py); None fora do waitress
+        self.waitress = None
+        self._trava = threading.Lock()
+        self._requisicoes = defaultdict(int)  # (endpoint, método, status)
+        self._latencia = defaultdict(lambda: Histograma(FAIXAS_S))  # endpoint
+        self._sql = defaultdict(int)  # endpoint
+        self._sql_duracao = Histograma(FAIXAS_S)
+        self._cache = defaultdict(int)  # (cache, resultado)
+        self._pdf = Histograma(FAIXAS_PDF_S)
+        self._pdf_erros = 0
+        self._exportacao_bytes = defaultdict(int)  # endpoint
+        self._exportacoes = defaultdict(int)  # endpoint
+        self._em_andamento = 0
+        self.inicio = time.time()
+
+    # Ciclo da requisição
+    def iniciar(self):
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_em_andamento = True
+        with self._trava:
+            self._em_andamento += 1
+
+    def finalizar(self, resposta):
+        inicio = g.pop('metricas_inicio', None)
+        if inicio is None:
+            return resposta
+        duracao = time.perf_counter() - inicio
+        endpoint = request.endpoint or '(sem rota)'
+        exportacao = endpoint.startswith('export_') and resposta.status_code == 200
+        tamanho = (resposta.calculate_content_length() or 0) if exportacao else 0
+        with self._trava:
+            self._requisicoes[endpoint, request.method, resposta.status_code] += 1
+            self._latencia[endpoint].observar(duracao)
+            if exportacao:
+                self._exportacoes[endpoint] += 1
+                self._exportacao_bytes[endpoint] += tamanho
+        return resposta
+
+    def encerrar(self, erro=None):
+        if g.pop('metricas_em_andamento', False):
+            with self._trava:
+                self._em_andamento -= 1
+
+    # Eventos do SQLAlchemy
+    def antes_sql(self, conexao, cursor, sql, parametros, contexto, executemany):
+        conexao.info['metricas_inicio'] = time.perf_counter()
+
+    def depois_sql(self, conexao, cursor, sql, parametros, contexto, executemany):
+        inicio = conexao.info.pop('metricas_inicio', None)
+        if inicio is None:
+            return
+        duracao = time.perf_counter() - inicio
+        endpoint = (request.endpoint or '(sem rota)') if has_request_context() else '(fora de requisição)'
+        with self._trava:
+            self._sql[endpoint] += 1
+            self._sql_duracao.observar(duracao)
+
+    # Registros feitos pelo app
+    def contar_cache(self, cache, acerto):
+        with self._trava:
+            self._cache[cache, 'acerto' if acerto else 'falta'] += 1
+
+    def registrar_pdf(self, duracao, erro=False):
+        with self._trava:
+            if erro:
+                self._pdf_erros += 1
+            else:
+                self._pdf.observar(duracao)
+
+    # Coleta
+    def _arquivos(self):
+        for arquivo, caminho in (('banco', self.caminho_banco), ('wal', self.caminho_banco + '-wal')):
+            try:
+                yield arquivo, os.path.getsize(caminho)
+            except OSError:
+                yield arquivo, 0
+
+    def texto(self):
+        with self._trava:
+            requisicoes = dict(self._requisicoes)
+            latencia = list(self._latencia.items())
+            latencia_linhas = [linha for endpoint, histograma in latencia
+                               for linha in histograma.linhas(f'{PREFIXO}_requisicao_segundos', endpoint=endpoint)]
+            sql = dict(self._sql)
+            sql_linhas = list(self._sql_duracao.linhas(f'{PREFIXO}_sql_segundos'))
+            cache = dict(self._cache)
+            pdf_linhas = list(self._pdf.linhas(f'{PREFIXO}_pdf_segundos'))
+            pdf_erros = self._pdf_erros
+            exportacoes = dict(self._exportacoes)
+            exportacao_bytes = dict(self._exportacao_bytes)
+            em_andamento = self._em_andamento
+
+        linhas = []
+
+        def metrica(nome, tipo, ajuda, valores):
+            linhas.append(f"# HELP {PREFIXO}_{nome} {ajuda}")
+            linhas.append(f"# TYPE {PREFIXO}_{nome} {tipo}")
+            linhas.extend(valores)
+
+        metrica('processo_info', 'gauge', 'Processo que atendeu a coleta.',
+                [f"{PREFIXO}_processo_info{_rotulos(pid=os.getpid())} 1"])
+        metrica('processo_inicio_segundos', 'gauge', 'Início da coleta de métricas (epoch).',
+                [f"{PREFIXO}_processo_inicio_segundos {self.inicio}"])
+        metrica('requisicoes_total', 'counter', 'Requisições atendidas por endpoint, método e status.',
+                [f"{PREFIXO}_requisicoes_total{_rotulos(endpoint=e, metodo=m, status=s)} {n}"
+                 for (e, m, s), n in sorted(requisicoes.items())])
+        metrica('requisicao_segundos', 'histogram', 'Latência das requisições por endpoint.', latencia_linhas)
+        metrica('requisicoes_em_andamento', 'gauge', 'Requisições sendo processadas agora.',
+                [f"{PREFIXO}_requisicoes_em_andamento {em_andamento}"])
+        metrica('sql_total', 'counter', 'Instruções SQL executadas por endpoint.',
+                [f"{PREFIXO}_sql_total{_rotulos(endpoint=e)} {n}" for e, n in sorted(sql.items())])
+        metrica('sql_segundos', 'histogram', 'Duração das instruções SQL.', sql_linhas)
+        metrica('cache_consultas_total', 'counter', 'Consultas aos caches por resultado (acerto ou falta).',
+                [f"{PREFIXO}_cache_consultas_total{_rotulos(cache=c, resultado=r)} {n}"
+                 for (c, r), n in sorted(cache.items())])
+        razoes = []
+        for nome in sorted({c for c, _ in cache}):
+            total = cache.get((nome, 'acerto'), 0) + cache.get((nome, 'falta'), 0)
+            razoes.append(f"{PREFIXO}_cache_razao_acertos{_rotulos(cache=nome)} {cache.get((nome, 'acerto'), 0) / total}")
+        metrica('cache_razao_acertos', 'gauge', 'Fração de acertos de cada cache desde o início.', razoes)
+        metrica('pdf_segundos', 'histogram', 'Duração da geração de PDFs (WeasyPrint).', pdf_linhas)
+        metrica('pdf_erros_total', 'counter', 'Gerações de PDF que falharam.', [f"{PREFIXO}_pdf_erros_total {pdf_erros}"])
+        if self.faixa_pesada is not None:
+            metrica('faixa_pesada_aguardando', 'gauge', 'Exportações e visualizações (PDF inclusive) na fila da faixa pesada.',
+                    [f"{PREFIXO}_faixa_pesada_aguardando {self.faixa_pesada.aguardando}"])
+            metrica('faixa_pesada_em_execucao', 'gauge', 'Exportações e visualizações em execução na faixa pesada.',
+                    [f"{PREFIXO}_faixa_pesada_em_execucao {self.faixa_pesada.em_execucao}"])
+        metrica('exportacoes_total', 'counter', 'Exportações (CSV/PDF) entregues por endpoint.',
+                [f"{PREFIXO}_exportacoes_total{_rotulos(endpoint=e)} {n}" for e, n in sorted(exportacoes.items())])
+        metrica('exportacao_bytes_total', 'counter', 'Bytes entregues pelas exportações por endpoint.',
+                [f"{PREFIXO}_exportacao_bytes_total{_rotulos(endpoint=e)} {n}" for e, n in sorted(exportacao_bytes.items())])
+        metrica('sqlite_bytes', 'gauge', 'Tamanho do arquivo do banco SQLite e do WAL.',
+                [f"{PREFIXO}_sqlite_bytes{_rotulos(arquivo=a)} {n}" for a, n in self._arquivos()])
+        if self.threads_configuradas is not None:
+            metrica('waitress_threads', 'gauge', 'Threads de trabalho configuradas no waitress.',
+                    [f"{PREFIXO}_waitress_threads {self.threads_configuradas}"])
+        if self.waitress is not None:
+            metrica('waitress_threads_ativas', 'gauge', 'Threads do waitress atendendo uma tarefa.',
+                    [f"{PREFIXO}_waitress_threads_ativas {self.waitress.active_count}"])
+            metrica('waitress_fila', 'gauge', 'Tarefas esperando uma thread livre do waitress.',
+                    [f"{PREFIXO}_waitress_fila {len(self.waitress.queue)}"])
+        return '\n'.join(linhas) + '\n'
+
+    def responder(self):
+        """View de /metrics: só para os endereços de METRICAS_ENDERECOS (vazio libera todos)."""
+        permitidos = self.enderecos_permitidos
+        if permitidos and request.remote_addr not in permitidos:
+            abort(403)
+        return Response(self.texto(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def instalar(app, db, caminho_banco, faixa_pesada=None):
+    """Liga a coleta e registra /metrics; retorna o coletor (ou None com METRICAS desligado)."""
+    if not app.config['METRICAS']:
+        return None
+    enderecos = [endereco.strip() for endereco in app.config['METRICAS_ENDERECOS'].split(',') if endereco.strip()]
+    coletor = ColetorMetricas(caminho_banco, faixa_pesada, app.config['SERVIDOR_THREADS'], enderecos)
+    app.before_request(coletor.iniciar)
+    app.after_request(coletor.finalizar)
+    app.teardown_request(coletor.encerrar)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', coletor.antes_sql)
+        event.listen(db.engine, 'after_cursor_execute', coletor.depois_sql)
+    app.add_url_rule('/metrics', 'metricas', coletor.responder)
+    app.extensions['metricas'] = coletor
+    return coletor
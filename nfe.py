@@ -0,0 +1,142 @@
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+
+# ----------------------
+# Leitura de NF-e (XML) de combustível
+# ----------------------
+# Cada arquivo é lido com lxml.iterparse, tratando só as tags de interesse e limpando
+# os elementos já processados, de modo que a memória por arquivo fica constante.
+# Este módulo não depende do app nem do banco: ele roda também nos processos do pool.
+# O lxml é importado só na leitura da primeira nota, como o WeasyPrint no primeiro PDF.
+
+NS = '{http://www.portalfiscal.inf.br/nfe}'
+TAGS = [NS + nome for nome in ('nNF', 'dhEmi', 'dEmi', 'CNPJ', 'xNome', 'prod', 'vNF', 'infCpl', 'placa')]
+
+# Placa antiga (ABC-1234) ou Mercosul (ABC1D23)
+RE_PLACA = re.compile(r'\b([A-Z]{3})-?(\d[A-Z0-9]\d{2})\b')
+RE_CPF = re.compile(r'\b(\d{3}\.?\d{3}\.?\d{3}-?\d{2})\b')
+# Hodômetro com rótulo ("HODOMETRO 45120", "HOD.: 45.120") ou "KM" seguido de ":" ou "=";
+# "KM" solto é quilômetro de rodovia no endereço ("ROD BR-232 KM 252")
+RE_HODOMETRO = re.compile(
+    r'\b(?:(?:HOD[OÔ]METRO|OD[OÔ]METRO|HOD)\.?\s*[:=]?|KM\s*[:=])\s*(\d[\d.]*)', re.IGNORECASE
+)
+UNIDADES_LITRO = {'L', 'LT', 'LTS', 'LITRO', 'LITROS'}
+
+# Abaixo disto o custo de subir os processos não compensa
+MINIMO_PARA_POOL = 200
+
+
+class ErroNFe(ValueError):
+    pass
+
+
+def _texto(elemento):
+    return (elemento.text or '').strip()
+
+
+def _data_emissao(texto):
+    # dhEmi vem com fuso (2025-03-10T08:15:00-03:00); guardamos o horário local da emissão
+    data = datetime.fromisoformat(texto)
+    return data.replace(tzinfo=None)
+
+
+def ler_nfe(origem):
+    """Lê uma NF-e. `origem` é um caminho ou (nome, bytes). Retorna (nome, dados) ou (nome, ErroNFe)."""
+    from lxml import etree  # só necessário na importação de NF-e
+    if isinstance(origem, tuple):
+        nome, conteudo = origem
+        arquivo = io.BytesIO(conteudo)
+    else:
+        nome, arquivo = os.path.basename(origem), origem
+    try:
+        return nome, _ler(arquivo)
+    except (ErroNFe, etree.XMLSyntaxError, ValueError) as erro:
+        return nome, ErroNFe(str(erro))
+
+
+def _ler(arquivo):
+    from lxml import etree
+    dados = {'litros': 0.0, 'valor_produtos': 0.0, 'produtos': [], 'placa': None, 'cnpj_emitente': None}
+    informacoes = ''
+    for _, elemento in etree.iterparse(arquivo, events=('end',), tag=TAGS):
+        tag = elemento.tag
+        if tag == NS + 'nNF':
+            dados['numero_nota'] = _texto(elemento)
+        elif tag in (NS + 'dhEmi', NS + 'dEmi'):
+            dados['data'] = _data_emissao(_texto(elemento))
+        elif tag in (NS + 'CNPJ', NS + 'xNome'):
+            if elemento.getparent().tag != NS + 'emit':
+                # CNPJ/nome do destinatário ou da transportadora
+                continue
+            dados['cnpj_emitente' if tag == NS + 'CNPJ' else 'fornecedor'] = _texto(elemento)
+        elif tag == NS + 'prod':
+            unidade = (elemento.findtext(NS + 'uCom') or '').strip().upper()
+            combustivel = elemento.find(NS + 'comb') is not None
+            if combustivel or unidade in UNIDADES_LITRO:
+                dados['litros'] += float(elemento.findtext(NS + 'qCom') or 0)
+                dados['valor_produtos'] += float(elemento.findtext(NS + 'vProd') or 0)
+                dados['produtos'].append((elemento.findtext(NS + 'xProd') or '').strip())
+        elif tag == NS + 'vNF':
+            dados['valor_nota'] = float(_texto(elemento) or 0)
+        elif tag == NS + 'placa':
+            # veicTransp vem antes de reboque
+            dados['placa'] = dados['placa'] or _texto(elemento)
+        elif tag == NS + 'infCpl':
+            informacoes = _texto(elemento)
+        # Libera o que já foi lido (e os irmãos anteriores) para manter a memória constante
+        elemento.clear()
+        while elemento.getprevious() is not None:
+            del elemento.getparent()[0]
+
+    if not dados.get('numero_nota'):
+        raise ErroNFe("número da nota (nNF) não encontrado")
+    if 'data' not in dados:
+        raise ErroNFe("data de emissão não encontrada")
+    if dados['litros'] <= 0:
+        raise ErroNFe("nenhum item de combustível (em litros) na nota")
+
+    texto = informacoes.upper()
+    if not dados['placa']:
+        placa = RE_PLACA.search(texto)
+        dados['placa'] = placa.group(1) + placa.group(2) if placa else None
+    cpf = RE_CPF.search(texto)
+    dados['documento'] = cpf.group(1) if cpf else None
+    hodometro = RE_HODOMETRO.search(texto)
+    dados['hodometro'] = int(hodometro.group(1).replace('.', '')) if hodometro else None
+    dados['informacoes'] = informacoes
+    return dados
+
+
+def listar_origens(caminho):
+    """Arquivos XML de uma pasta ou de um ZIP (como caminhos ou (nome, bytes))."""
+    if os.path.isdir(caminho):
+        return sorted(
+            os.path.join(raiz, nome)
+            for raiz, _, nomes in os.walk(caminho) for nome in nomes if nome.lower().endswith('.xml')
+        )
+    with open(caminho, 'rb') as arquivo:
+        return origens_zip(arquivo.read())
+
+
+def origens_zip(conteudo):
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as pacote:
+        return [
+            (os.path.basename(info.filename), pacote.read(info))
+            for info in pacote.infolist() if info.filename.lower().endswith('.xml') and not info.is_dir()
+        ]
+
+
+def ler_lote(origens, processos=None):
+    """Lê várias NF-e, em paralelo (pool de processos) quando são muitas."""
+    processos = processos or os.cpu_count() or 1
+    if len(origens) < MINIMO_PARA_POOL or processos == 1:
+        return [ler_nfe(origem) for origem in origens]
+    # spawn: seguro com o servidor multi-thread e igual ao comportamento no Windows/executável
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as pool:
+        return list(pool.map(ler_nfe, origens, chunksize=64))
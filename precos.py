@@ -0,0 +1,312 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from database import db, ContratoCombustivel, ContratoEfetivo
+import previsao
+import versoes
+
+# ----------------------
+# Preço por litro e conciliação com os contratos (NumPy)
+# ----------------------
+# Cada abastecimento é atribuído a no máximo um item de contrato ativo: o do mesmo
+# combustível (o da nota ou, sem ele, o do veículo) com vigência efetiva na data. Entre
+# vários candidatos vence o contrato vinculado ao abastecimento, depois o do setor do
+# veículo, depois o sem setor e, empatados, o de início mais recente. Os abastecimentos
+# são lidos numa consulta e ordenados por (combustível, data), de modo que os candidatos
+# de cada item são uma fatia contígua (np.searchsorted): a atribuição é um laço pelos
+# itens, não pelos abastecimentos.
+#
+# Conciliação: valor cobrado menos litros x valor por litro do item, somado por item e
+# contrato (acima e abaixo do contrato em separado). Fica em memória por (setor, contrato)
+# e é invalidada pelas mesmas marcações da previsão de esgotamento (gravações de
+# abastecimentos do combustível, mudanças de veículo ou de contrato). Com SERVIDOR_PROCESSOS > 1
+# confere também o contador de consumo (versoes), como a previsão, para ver as gravações
+# feitas em outros processos.
+
+TOLERANCIA_POR_LITRO = 0.01  # diferença por litro (R$) atribuída a arredondamento da nota
+MAIORES_DIFERENCAS = 10  # abastecimentos guardados por contrato para o detalhamento
+SEM_CONTRATO = 'Sem contrato'
+TODOS = previsao.TODOS
+
+
+def _itens(combustiveis=None):
+    """Itens vigentes de contratos ativos, com fornecedor e setor do contrato."""
+    consulta = db.session.query(
+        ContratoEfetivo.item_id, ContratoEfetivo.contrato_id, ContratoEfetivo.tipo_combustivel,
+        func.julianday(ContratoEfetivo.data_inicio), func.julianday(ContratoEfetivo.data_fim, '+1 day'),
+        ContratoEfetivo.valor_por_litro, ContratoCombustivel.setor, ContratoCombustivel.fornecedor,
+        ContratoCombustivel.numero_contrato, ContratoCombustivel.ano_contrato
+    ).join(ContratoCombustivel, ContratoCombustivel.id == ContratoEfetivo.contrato_id).filter(
+        ContratoCombustivel.ativo == True
+    )
+    if combustiveis is not None:
+        consulta = consulta.filter(ContratoEfetivo.tipo_combustivel.in_(list(combustiveis)))
+    # Ordem de preferência crescente: quem vem depois ganha os empates
+    return sorted(consulta.all(), key=lambda item: (item[3], -item[0]))
+
+
+def _data_juliana(dia_juliano):
+    # julianday 1721425,5 é 0001-01-01 (ordinal 1)
+    return date.fromordinal(int(dia_juliano - 1721424.5))
+
+
+def _ler(combustiveis, setores, inicio=None, fim=None, setor=None):
+    """Matriz (id, julianday, combustível, contrato vinculado, setor, litros, valor).
+
+    Combustível e setor chegam como códigos (posição nas listas; -1 fora delas), resolvidos
+    num CASE para que o NumPy receba só números.
+    """
+    def codigo(expressao, nomes):
+        if not nomes:
+            return "-1"
+        return f"CASE {expressao} " + " ".join(f"WHEN ? THEN {indice}" for indice in range(len(nomes))) + " ELSE -1 END"
+
+    filtros, parametros = [], list(combustiveis) + list(setores)
+    if inicio is not None:
+        filtros.append("a.data >= ?")
+        parametros.append(str(inicio))
+    if fim is not None:
+        filtros.append("a.data < date(?, '+1 day')")
+        parametros.append(str(fim))
+    if setor:
+        filtros.append("v.tipo = ?")
+        parametros.append(setor)
+    resultado = db.session.connection().exec_driver_sql(
+        f"""SELECT a.id, julianday(a.data), {codigo('COALESCE(a.combustivel, v.combustivel)', combustiveis)},
+                   COALESCE(a.contrato_id, -1), {codigo('v.tipo', setores)}, a.litros, a.valor_total
+            FROM abastecimento a JOIN veiculo v ON v.id = a.veiculo_id
+            {'WHERE ' + ' AND '.join(filtros) if filtros else ''}""",
+        tuple(parametros)
+    )
+    # Tuplas do cursor do sqlite3, como em anomalias._ler
+    linhas = resultado.cursor.fetchall()
+    resultado.close()
+    return np.array(linhas, dtype=np.float64).reshape(-1, 7)
+
+
+def atribuir(matriz, itens, combustiveis, setores):
+    """Posição em itens do item de cada linha da matriz (-1 sem contrato aplicável)."""
+    n = len(matriz)
+    escolhido = np.full(n, -1, dtype=np.int64)
+    if not n or not itens:
+        return escolhido
+    _, dia, combustivel, contrato, setor, _, _ = matriz.T
+    ordem = np.lexsort((dia, combustivel))
+    combustivel_ordenado, dia_ordenado = combustivel[ordem], dia[ordem]
+    # Início e fim do bloco de cada combustível na ordenação
+    limites = np.searchsorted(combustivel_ordenado, np.arange(len(combustiveis) + 1) - 0.5)
+    melhor = np.full(n, -1, dtype=np.int64)
+    codigo_combustivel = {nome: indice for indice, nome in enumerate(combustiveis)}
+    codigo_setor = {nome: indice for indice, nome in enumerate(setores)}
+    for posicao, item in enumerate(itens):
+        _, contrato_id, tipo, inicio, fim, _, setor_contrato = item[:7]
+        bloco = codigo_combustivel[tipo]
+        primeiro, ultimo = limites[bloco], limites[bloco + 1]
+        dias = dia_ordenado[primeiro:ultimo]
+        fatia = ordem[primeiro + np.searchsorted(dias, inicio):primeiro + np.searchsorted(dias, fim)]
+        if not len(fatia):
+            continue
+        # Vínculo com o contrato > setor do veículo igual ao do contrato > contrato sem setor
+        pontos = 4 * (contrato[fatia] == contrato_id)
+        if setor_contrato is None:
+            pontos = pontos + 1
+        else:
+            pontos = pontos + 2 * (setor[fatia] == codigo_setor[setor_contrato])
+        ganha = pontos >= melhor[fatia]
+        melhor[fatia[ganha]] = pontos[ganha]
+        escolhido[fatia[ganha]] = posicao
+    return escolhido
+
+
+def _listas(itens):
+    combustiveis = sorted({item[2] for item in itens})
+    setores = sorted({item[6] for item in itens if item[6] is not None})
+    return combustiveis, setores
+
+
+def conciliar(contrato_ids, setor=None):
+    """{contrato_id: conciliação} dos contratos pedidos, sobre todo o histórico."""
+    contrato_ids = set(contrato_ids)
+    resultado = {}
+    todos = _itens()
+    # Só os combustíveis dos contratos pedidos importam; os outros contratos desses
+    # combustíveis continuam na disputa pelos abastecimentos
+    pedidos = {item[2] for item in todos if item[1] in contrato_ids}
+    itens = [item for item in todos if item[2] in pedidos]
+    for contrato_id in contrato_ids:
+        resultado[contrato_id] = {
+            'itens': {}, 'quantidade': 0, 'litros': 0.0, 'valor_cobrado': 0.0, 'valor_contrato': 0.0,
+            'diferenca': 0.0, 'acima': 0.0, 'abaixo': 0.0, 'divergentes': 0, 'maiores': [],
+            'combustiveis': set(),
+        }
+    if not itens:
+        return resultado
+    combustiveis, setores = _listas(itens)
+    # Só importam os abastecimentos dentro da vigência de algum item pedido
+    inicio = min(item[3] for item in itens if item[1] in contrato_ids)
+    fim = max(item[4] for item in itens if item[1] in contrato_ids)
+    matriz = _ler(combustiveis, setores, _data_juliana(inicio), _data_juliana(fim) - timedelta(days=1), setor)
+    escolhido = atribuir(matriz, itens, combustiveis, setores)
+    atribuidas = np.flatnonzero(escolhido >= 0)
+    posicao = escolhido[atribuidas]
+    litros, valor = matriz[atribuidas, 5], matriz[atribuidas, 6]
+    preco_item = np.array([item[5] for item in itens], dtype=np.float64)
+    esperado = litros * preco_item[posicao]
+    diferenca = valor - esperado
+    with np.errstate(divide='ignore', invalid='ignore'):
+        divergente = np.abs(diferenca) > TOLERANCIA_POR_LITRO * litros
+    m = len(itens)
+
+    def somar(pesos):
+        return np.bincount(posicao, weights=pesos, minlength=m)
+
+    quantidade = np.bincount(posicao, minlength=m)
+    somas = {
+        'litros': somar(litros), 'valor_cobrado': somar(valor), 'valor_contrato': somar(esperado),
+        'acima': somar(np.maximum(diferenca, 0)), 'abaixo': somar(np.minimum(diferenca, 0)),
+        'divergentes': np.bincount(posicao, weights=divergente, minlength=m),
+    }
+    for indice, item in enumerate(itens):
+        item_id, contrato_id, tipo = item[:3]
+        if contrato_id not in contrato_ids:
+            continue
+        conciliacao = resultado[contrato_id]
+        linha = {
+            'tipo_combustivel': tipo,
+            'valor_por_litro': item[5],
+            'quantidade': int(quantidade[indice]),
+            'litros': float(somas['litros'][indice]),
+            'valor_cobrado': float(somas['valor_cobrado'][indice]),
+            'valor_contrato': float(somas['valor_contrato'][indice]),
+            'acima': float(somas['acima'][indice]),
+            'abaixo': float(somas['abaixo'][indice]),
+            'divergentes': int(somas['divergentes'][indice]),
+        }
+        linha['diferenca'] = linha['valor_cobrado'] - linha['valor_contrato']
+        linha['preco_medio'] = linha['valor_cobrado'] / linha['litros'] if linha['litros'] else None
+        conciliacao['itens'][item_id] = linha
+        conciliacao['combustiveis'].add(tipo)
+        for chave in ('quantidade', 'litros', 'valor_cobrado', 'valor_contrato', 'diferenca', 'acima', 'abaixo', 'divergentes'):
+            conciliacao[chave] += linha[chave]
+
+    # Maiores diferenças (em módulo) de cada contrato, para o detalhamento
+    contrato_da_linha = np.array([item[1] for item in itens], dtype=np.int64)[posicao]
+    for contrato_id in contrato_ids:
+        linhas = np.flatnonzero((contrato_da_linha == contrato_id) & divergente)
+        maiores = linhas[np.argsort(-np.abs(diferenca[linhas]), kind='stable')[:MAIORES_DIFERENCAS]]
+        resultado[contrato_id]['maiores'] = [
+            (int(matriz[atribuidas[linha], 0]), itens[posicao[linha]][0], float(diferenca[linha]))
+            for linha in maiores
+        ]
+    return resultado
+
+
+def serie_precos(inicio, fim, setor=None, combustivel=None):
+    """Preço médio por litro (valor / litros) por mês, combustível e fornecedor do item atribuído.
+
+    Retorna [(mês 'AAAA-MM', combustível, fornecedor, litros, valor, valor pelo contrato)];
+    abastecimentos sem contrato aplicável entram com o fornecedor SEM_CONTRATO.
+    """
+    itens = _itens()
+    combustiveis, setores = _listas(itens)
+    if combustivel and combustivel not in combustiveis:
+        combustiveis.append(combustivel)
+    elif not combustivel:
+        # Combustíveis sem contrato também aparecem na série
+        combustiveis += sorted(
+            {linha[0] for linha in db.session.execute(db.text(
+                "SELECT DISTINCT combustivel FROM veiculo UNION SELECT DISTINCT combustivel FROM abastecimento"
+            )) if linha[0] is not None} - set(combustiveis)
+        )
+    matriz = _ler(combustiveis, setores, inicio, fim, setor)
+    if combustivel:
+        matriz = matriz[matriz[:, 2] == combustiveis.index(combustivel)]
+    escolhido = atribuir(matriz, itens, combustiveis, setores)
+    if not len(matriz):
+        return []
+
+    # Fornecedores numerados; o código len(fornecedores) é SEM_CONTRATO
+    fornecedores = sorted({item[7] for item in itens})
+    codigo_fornecedor = np.array([fornecedores.index(item[7]) for item in itens] + [len(fornecedores)], dtype=np.int64)
+    preco_item = np.array([item[5] for item in itens] + [np.nan], dtype=np.float64)
+    fornecedor = codigo_fornecedor[escolhido]  # sem item (-1) cai no último código, SEM_CONTRATO
+    preco = preco_item[escolhido]
+    # julianday 2440587,5 é 1970-01-01 00:00
+    dias = np.floor(matriz[:, 1] - 2440587.5).astype(np.int64)
+    meses = dias.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    codigo_combustivel = matriz[:, 2].astype(np.int64)
+    chave = (meses * (len(combustiveis) + 1) + codigo_combustivel + 1) * (len(fornecedores) + 1) + fornecedor
+    grupos, grupo = np.unique(chave, return_inverse=True)
+    litros = np.bincount(grupo, weights=matriz[:, 5])
+    valor = np.bincount(grupo, weights=matriz[:, 6])
+    contrato = np.bincount(grupo, weights=np.where(np.isnan(preco), 0, matriz[:, 5] * preco))
+    nomes_fornecedores = fornecedores + [SEM_CONTRATO]
+    serie = []
+    for indice, chave_grupo in enumerate(grupos.tolist()):
+        resto, codigo_f = divmod(chave_grupo, len(fornecedores) + 1)
+        mes, codigo_c = divmod(resto, len(combustiveis) + 1)
+        serie.append((
+            str(np.datetime64(mes, 'M')),
+            combustiveis[codigo_c - 1] if codigo_c else None,
+            nomes_fornecedores[codigo_f],
+            float(litros[indice]), float(valor[indice]),
+            None if codigo_f == len(fornecedores) else float(contrato[indice]),
+        ))
+    return serie
+
+
+class CacheConciliacao:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._geracao = 0
+        self._conciliacoes = {}  # (setor, contrato_id) -> conciliação
+        self.versao = versoes.VersaoCompartilhada('consumo')
+
+    def obter(self, contrato_ids, setor=None):
+        """Conciliação dos contratos; calcula só os que faltam. Retorna (conciliações, acerto)."""
+        # Gravações de outros processos (sempre False com um processo só)
+        mudou = self.versao.mudou()
+        with self._trava:
+            if mudou:
+                self._conciliacoes.clear()
+                self._geracao += 1
+            geracao = self._geracao
+            conciliacoes = {}
+            faltantes = []
+            for contrato_id in contrato_ids:
+                conciliacao = self._conciliacoes.get((setor, contrato_id))
+                if conciliacao is None:
+                    faltantes.append(contrato_id)
+                else:
+                    conciliacoes[contrato_id] = conciliacao
+        if not faltantes:
+            return conciliacoes, True
+        novas = conciliar(faltantes, setor)
+        with self._trava:
+            if self._geracao == geracao:
+                self._conciliacoes.update(((setor, contrato_id), conciliacao) for contrato_id, conciliacao in novas.items())
+        conciliacoes.update(novas)
+        return conciliacoes, False
+
+    def invalidar(self, alvos):
+        """Mesmos alvos (combustível, setor, contrato_id) de previsao.CachePrevisao.invalidar."""
+        with self._trava:
+            self._geracao += 1
+            # Mudança de contrato (sem combustível) pode mudar a atribuição entre contratos concorrentes
+            if any(combustivel is TODOS or combustivel is None for combustivel, _, _ in alvos):
+                self._conciliacoes.clear()
+                return
+            for chave, conciliacao in list(self._conciliacoes.items()):
+                setor, contrato_id = chave
+                for combustivel, setor_alvo, contrato_alvo in alvos:
+                    mesmo_setor = setor is None or setor_alvo is TODOS or setor == setor_alvo
+                    if mesmo_setor and (combustivel in conciliacao['combustiveis'] or contrato_id == contrato_alvo):
+                        del self._conciliacoes[chave]
+                        break
+
+
+cache = CacheConciliacao()
+previsao.cache.dependentes.append(cache)
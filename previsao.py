@@ -0,0 +1,224 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import and_, event, func, or_
+
+from database import db, Veiculo, Abastecimento, ContratoEfetivo
+import versoes
+
+# ----------------------
+# Previsão de esgotamento dos itens de contrato (NumPy)
+# ----------------------
+# O ritmo de consumo de cada item vem da soma diária dos litros atribuídos a ele (mesmas
+# regras de calcular_consumo_itens: vigência efetiva, combustível do veículo ou vínculo com
+# o contrato), lida num único GROUP BY. Sobre os últimos JANELA_DIAS dias completos o ritmo
+# é a média com suavização exponencial (peso (1 - ALFA)^k para o dia k antes de ontem), de
+# modo que uma mudança recente de uso pesa mais que o início da janela. O saldo dividido pelo
+# ritmo dá a data de esgotamento, comparada com o fim efetivo do contrato (com prorrogações).
+#
+# As previsões ficam em memória por (setor, item) e só são refeitas quando chegam
+# abastecimentos do combustível e do setor do item (ou vinculados ao contrato), quando o
+# contrato muda, ou na virada do dia. Essas marcações só alcançam o processo que gravou:
+# com SERVIDOR_PROCESSOS > 1 cada consulta confere antes o contador de consumo (versoes)
+# e descarta todas as previsões quando ele andou.
+
+JANELA_DIAS = 28
+ALFA = 0.1
+PRAZO_ADITIVO_DIAS = 60  # antecedência para tramitar um aditivo
+
+TODOS = object()  # marca de invalidação de todos os setores ou combustíveis
+
+
+def consumo_diario(efetivos, setor=None):
+    """[(item_id, dia, litros)] dos abastecimentos atribuídos a cada item, por dia."""
+    dia = func.date(Abastecimento.data)
+    consulta = db.session.query(
+        ContratoEfetivo.item_id, dia, func.sum(Abastecimento.litros)
+    ).join(Abastecimento, and_(
+        Abastecimento.data >= ContratoEfetivo.data_inicio,
+        Abastecimento.data < func.date(ContratoEfetivo.data_fim, '+1 day')
+    )).join(Veiculo, Abastecimento.veiculo_id == Veiculo.id).filter(
+        ContratoEfetivo.item_id.in_([efetivo.item_id for efetivo in efetivos]),
+        or_(
+            Veiculo.combustivel == ContratoEfetivo.tipo_combustivel,
+            Abastecimento.contrato_id == ContratoEfetivo.contrato_id
+        )
+    )
+    if setor:
+        consulta = consulta.filter(Veiculo.tipo == setor)
+    return consulta.group_by(ContratoEfetivo.item_id, dia).all()
+
+
+def _sem_previsao(efetivo):
+    return {
+        'item_id': efetivo.item_id,
+        'contrato_id': efetivo.contrato_id,
+        'tipo_combustivel': efetivo.tipo_combustivel,
+        'data_fim': efetivo.data_fim,
+        'consumido': None,
+        'saldo': None,
+        'taxa_diaria': None,
+        'data_esgotamento': None,
+        'em_risco': False,
+        'dias_antes_do_fim': None,
+        'urgente': False,
+    }
+
+
+def prever(efetivos, setor=None, hoje=None):
+    """Ritmo diário, saldo e data de esgotamento de cada item, todos de uma vez: {item_id: previsão}."""
+    hoje = hoje or date.today()
+    # Itens encerrados ou ainda não iniciados não têm previsão (nem entram na consulta)
+    previsoes = {efetivo.item_id: _sem_previsao(efetivo) for efetivo in efetivos}
+    efetivos = [efetivo for efetivo in efetivos if efetivo.data_inicio <= hoje <= efetivo.data_fim]
+    if not efetivos:
+        return previsoes
+    posicao = {efetivo.item_id: indice for indice, efetivo in enumerate(efetivos)}
+    linhas = consumo_diario(efetivos, setor)
+    n = len(efetivos)
+    itens = np.array([posicao[item_id] for item_id, _, _ in linhas], dtype=np.int64)
+    dias = np.array([dia for _, dia, _ in linhas], dtype='datetime64[D]')
+    litros = np.array([litros or 0 for _, _, litros in linhas], dtype=np.float64)
+    consumido = np.bincount(itens, weights=litros, minlength=n)
+
+    # Dias antes de hoje: 0 é ontem, o último dia completo
+    hoje_np = np.datetime64(hoje, 'D')
+    atraso = (hoje_np - dias).astype(np.int64) - 1
+    na_janela = (atraso >= 0) & (atraso < JANELA_DIAS)
+    janela = np.bincount(
+        itens[na_janela] * JANELA_DIAS + atraso[na_janela], weights=litros[na_janela], minlength=n * JANELA_DIAS
+    ).reshape(n, JANELA_DIAS)
+
+    # Só contam os dias da janela dentro da vigência (contrato iniciado há menos de JANELA_DIAS)
+    inicio = np.array([efetivo.data_inicio for efetivo in efetivos], dtype='datetime64[D]')
+    fim = np.array([efetivo.data_fim for efetivo in efetivos], dtype='datetime64[D]')
+    dias_janela = hoje_np - 1 - np.arange(JANELA_DIAS)
+    vigente_no_dia = ((dias_janela >= inicio[:, None]) & (dias_janela <= fim[:, None])).astype(np.float64)
+    pesos = (1 - ALFA) ** np.arange(JANELA_DIAS)
+    soma_pesos = vigente_no_dia @ pesos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        taxa = np.where(soma_pesos > 0, (janela * vigente_no_dia) @ pesos / soma_pesos, np.nan)
+        quantidade = np.array([efetivo.quantidade for efetivo in efetivos], dtype=np.float64)
+        saldo = np.maximum(quantidade - consumido, 0)
+        dias_restantes = np.where(saldo > 0, saldo / taxa, 0)
+
+    for indice, efetivo in enumerate(efetivos):
+        esgotamento = None
+        if np.isfinite(dias_restantes[indice]):
+            # Ritmos muito baixos projetam datas além do calendário: ficam sem data (não esgota)
+            dias_ate = int(np.ceil(dias_restantes[indice]))
+            if dias_ate < 36500:
+                esgotamento = hoje + timedelta(days=dias_ate)
+        em_risco = esgotamento is not None and esgotamento <= efetivo.data_fim
+        previsoes[efetivo.item_id] = {
+            **previsoes[efetivo.item_id],
+            'consumido': float(consumido[indice]),
+            'saldo': float(saldo[indice]),
+            'taxa_diaria': None if np.isnan(taxa[indice]) else float(taxa[indice]),
+            'data_esgotamento': esgotamento,
+            'em_risco': em_risco,
+            'dias_antes_do_fim': (efetivo.data_fim - esgotamento).days if em_risco else None,
+            'urgente': em_risco and (esgotamento - hoje).days <= PRAZO_ADITIVO_DIAS,
+        }
+    return previsoes
+
+
+class CachePrevisao:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._dia = None
+        self._geracao = 0
+        self._previsoes = {}  # (setor, item_id) -> previsão
+        self.dependentes = []  # outros caches invalidados pelas mesmas marcações (precos.cache)
+        self.versao = versoes.VersaoCompartilhada('consumo')
+
+    def obter(self, efetivos, setor=None):
+        """Previsões dos itens; calcula só os que faltam. Retorna (previsões, acerto)."""
+        hoje = date.today()
+        # Gravações de outros processos (sempre False com um processo só)
+        mudou = self.versao.mudou()
+        with self._trava:
+            if self._dia != hoje or mudou:
+                self._dia = hoje
+                self._previsoes.clear()
+                self._geracao += 1
+            geracao = self._geracao
+            previsoes = {}
+            faltantes = []
+            for efetivo in efetivos:
+                previsao = self._previsoes.get((setor, efetivo.item_id))
+                if previsao is None:
+                    faltantes.append(efetivo)
+                else:
+                    previsoes[efetivo.item_id] = previsao
+        if not faltantes:
+            return previsoes, True
+        novas = prever(faltantes, setor, hoje)
+        with self._trava:
+            # Uma invalidação durante o cálculo pode ter tornado o resultado velho: não guarda
+            if self._geracao == geracao:
+                self._previsoes.update(((setor, item_id), previsao) for item_id, previsao in novas.items())
+        previsoes.update(novas)
+        return previsoes, False
+
+    def invalidar(self, alvos):
+        """Descarta as previsões atingidas por (combustível, setor, contrato_id); TODOS vale para qualquer um."""
+        with self._trava:
+            self._geracao += 1
+            if any(alvo == (TODOS, TODOS, None) for alvo in alvos):
+                self._previsoes.clear()
+                return
+            for chave, previsao in list(self._previsoes.items()):
+                setor = chave[0]
+                for combustivel, setor_alvo, contrato_id in alvos:
+                    mesmo_setor = setor is None or setor_alvo is TODOS or setor == setor_alvo
+                    atinge = (combustivel is TODOS or previsao['tipo_combustivel'] == combustivel
+                              or (contrato_id is not None and previsao['contrato_id'] == contrato_id))
+                    if mesmo_setor and atinge:
+                        del self._previsoes[chave]
+                        break
+
+    # ----------------------
+    # Marcação na transação (aplicada só depois do commit)
+    # ----------------------
+    def _pendentes(self):
+        return db.session.info.setdefault('previsao_pendente', set())
+
+    def marcar_ids(self, ids):
+        """Abastecimentos gravados ou prestes a ser excluídos (antes do commit)."""
+        if not ids:
+            return
+        db.session.flush()
+        alvos = db.session.query(
+            Veiculo.combustivel, Abastecimento.combustivel, Veiculo.tipo, Abastecimento.contrato_id
+        ).join(Abastecimento, Abastecimento.veiculo_id == Veiculo.id).filter(Abastecimento.id.in_(list(ids))).distinct().all()
+        for combustivel_veiculo, combustivel_nota, setor, contrato_id in alvos:
+            # O combustível da nota, quando difere do veículo, decide o preço do contrato (precos)
+            self._pendentes().update({(combustivel_veiculo, setor, contrato_id), (combustivel_nota or combustivel_veiculo, setor, contrato_id)})
+
+    def marcar_veiculo(self, veiculo_id, contrato_id=None):
+        veiculo = db.session.get(Veiculo, veiculo_id)
+        if veiculo is not None:
+            self._pendentes().add((veiculo.combustivel, veiculo.tipo, contrato_id))
+
+    def marcar_contrato(self, contrato_id):
+        self._pendentes().add((None, TODOS, contrato_id))
+
+    def marcar_tudo(self):
+        self._pendentes().add((TODOS, TODOS, None))
+
+    def depois_do_commit(self, sessao):
+        alvos = sessao.info.pop('previsao_pendente', None)
+        if alvos:
+            self.invalidar(alvos)
+            for dependente in self.dependentes:
+                dependente.invalidar(alvos)
+
+    def depois_do_rollback(self, sessao, transacao):
+        sessao.info.pop('previsao_pendente', None)
+
+
+cache = CachePrevisao()
+event.listen(db.session, 'after_commit', cache.depois_do_commit)
+event.listen(db.session, 'after_soft_rollback', cache.depois_do_rollback)
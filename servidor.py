@@ -0,0 +1,104 @@
+import logging
+import os
+import signal
+import socket
+import sys
+from waitress import create_server
+from database import db
+
+# ----------------------
+# Servidor WSGI (waitress)
+# ----------------------
+# Host, porta, threads, backlog, timeout de canal e limite de conexões vêm de
+# app.config (ver config.ConfigServidor). Com SERVIDOR_PROCESSOS > 1 o processo pai
+# abre o socket, carrega o app uma vez e faz fork dos processos de trabalho, que
+# aceitam conexões do mesmo socket; o SQLite fica em modo WAL para que leituras e
+# escritas de processos diferentes convivam.
+#
+# Uso na hospedagem central: PERFIL=producao SERVIDOR_HOST=0.0.0.0 SERVIDOR_PROCESSOS=4 python servidor.py
+
+
+def opcoes_waitress(config):
+    return {
+        'threads': config['SERVIDOR_THREADS'],
+        'backlog': config['SERVIDOR_BACKLOG'],
+        'channel_timeout': config['SERVIDOR_TIMEOUT_CANAL'],
+        'connection_limit': config['SERVIDOR_LIMITE_CONEXOES'],
+        'ident': 'gestao-combustivel',
+    }
+
+
+def _servir_waitress(app, **opcoes):
+    """Como waitress.serve, expondo as threads e a fila do waitress em /metrics."""
+    logging.basicConfig()
+    servidor = create_server(app, **opcoes)
+    coletor = app.extensions.get('metricas')
+    if coletor is not None:
+        coletor.waitress = servidor.task_dispatcher
+    servidor.print_listen("Serving on http://{}:{}")
+    servidor.run()
+
+
+def servir(app, processos=None):
+    """Inicia o servidor conforme a configuração do app (bloqueia até o encerramento)."""
+    config = app.config
+    processos = config['SERVIDOR_PROCESSOS'] if processos is None else processos
+    print(f"Servidor rodando em http://{config['SERVIDOR_HOST']}:{config['SERVIDOR_PORTA']} "
+          f"({processos} processo(s), {config['SERVIDOR_THREADS']} threads cada)")
+    if processos <= 1:
+        _servir_waitress(app, host=config['SERVIDOR_HOST'], port=config['SERVIDOR_PORTA'], **opcoes_waitress(config))
+        return
+
+    soquete = socket.create_server((config['SERVIDOR_HOST'], config['SERVIDOR_PORTA']),
+                                   backlog=config['SERVIDOR_BACKLOG'])
+    soquete.setblocking(False)
+    filhos = set()
+    encerrando = False
+
+    def encerrar(sinal, quadro):
+        nonlocal encerrando
+        encerrando = True
+        for pid in filhos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    def iniciar_processo():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            with app.app_context():
+                # Conexões SQLite abertas pelo pai não podem ser usadas no filho
+                db.engine.dispose(close=False)
+            try:
+                _servir_waitress(app, sockets=[soquete], **opcoes_waitress(config))
+            finally:
+                os._exit(0)
+        filhos.add(pid)
+
+    for _ in range(processos):
+        iniciar_processo()
+
+    # Supervisão: recria processos que terminarem inesperadamente
+    while filhos:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        filhos.discard(pid)
+        if not encerrando:
+            iniciar_processo()
+    soquete.close()
+
+
+if __name__ == '__main__':
+    from app import app
+    servir(app)
+    sys.exit(0)
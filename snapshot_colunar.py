@@ -0,0 +1,202 @@
+import glob
+import json
+import os
+import threading
+import numpy as np
+import pyarrow as pa
+from cache_colunar import COLUNAS
+import versoes
+
+# ----------------------
+# Snapshot em disco do cache colunar (Arrow IPC / Feather v2)
+# ----------------------
+# Reconstruir o cache a partir do SQLite a cada abertura do executável é lento em
+# bases grandes. O snapshot guarda os vetores do cache em `instance/cache_colunar/`:
+#
+#   base.arrow            tabela completa, aberta com memory map (sem cópia)
+#   delta-<seq>.arrow     linhas alteradas após cada commit, aplicadas por cima da base
+#
+# A cada LIMITE_DELTAS deltas a base é regravada numa thread em segundo plano: o commit que
+# completou a conta não espera a escrita da tabela inteira, e a trava do cache fica presa só
+# durante a cópia das colunas. Os deltas gravados durante a escrita continuam valendo.
+#
+# O contador do grupo 'colunar' de versoes.py (tabela `versao_dados`, mantida por gatilhos) é
+# gravado nos metadados de cada arquivo, com o valor lido antes das linhas que o arquivo contém
+# (CacheColunar.ler_versao). Na abertura, se a versão do último arquivo não bater
+# com a do banco (alteração feita por fora da aplicação, queda antes de gravar o
+# delta etc.), o snapshot é descartado e o cache volta a ser montado via SQL.
+
+ARQUIVO_BASE = 'base.arrow'
+PREFIXO_DELTA = 'delta-'
+LIMITE_DELTAS = 50
+
+# Arrow guarda booleanos em bits; `valido` vai como uint8 para a leitura continuar sem cópia
+TIPOS_ARROW = {nome: (np.uint8 if tipo is np.bool_ else tipo) for nome, tipo in COLUNAS.items()}
+
+GRUPO_VERSAO = 'colunar'
+
+
+def versao_banco():
+    return versoes.ler(GRUPO_VERSAO)
+
+
+class SnapshotColunar:
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self._sequencia = 0
+        self._deltas = 0
+        self._versao = None  # versão do último delta gravado
+        self._compactando = False
+        self._trava_base = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    @property
+    def caminho_base(self):
+        return os.path.join(self.diretorio, ARQUIVO_BASE)
+
+    def _arquivos_delta(self):
+        return sorted(glob.glob(os.path.join(self.diretorio, PREFIXO_DELTA + '*.arrow')))
+
+    @staticmethod
+    def _sequencia_delta(caminho):
+        return int(os.path.basename(caminho)[len(PREFIXO_DELTA):-len('.arrow')])
+
+    # ----------------------
+    # Escrita
+    # ----------------------
+    def _tabela(self, cache, versao, posicoes=None):
+        """Cópia das colunas (todas ou só `posicoes`) numa tabela Arrow; chamada sob a trava do cache."""
+        colunas = cache.colunas()
+        dados = {}
+        for nome in COLUNAS:
+            # Indexar por posições já copia; a tabela inteira é copiada para ser gravada fora da trava
+            vetor = colunas[nome] if posicoes is None else colunas[nome][posicoes]
+            dados[nome] = pa.array(vetor.astype(TIPOS_ARROW[nome], copy=posicoes is None))
+        metadados = {
+            'versao': str(versao),
+            'setores': json.dumps(cache.setores),
+            'combustiveis': json.dumps(cache.combustiveis),
+        }
+        return pa.table(dados).replace_schema_metadata(metadados)
+
+    def _gravar(self, tabela, caminho):
+        # Grava em arquivo temporário e troca no final, para nunca deixar um snapshot pela metade
+        temporario = caminho + '.tmp'
+        with pa.OSFile(temporario, 'wb') as destino:
+            with pa.ipc.new_file(destino, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+        os.replace(temporario, caminho)
+
+    def salvar(self, cache, versao):
+        """Grava a tabela completa como nova base e descarta os deltas que ela já contém.
+
+        `versao` é a do banco lida antes das linhas que o cache contém: uma gravação entre a
+        leitura e o arquivo deixa o snapshot com versão antiga (refeito na abertura), nunca o
+        contrário.
+        """
+        with cache._trava:
+            tabela = self._tabela(cache, versao)
+            sequencia = self._sequencia
+        return self._trocar_base(cache, tabela, sequencia)
+
+    def _trocar_base(self, cache, tabela, sequencia):
+        """Grava a base (fora da trava do cache) e remove os deltas até `sequencia`, já contidos nela."""
+        with self._trava_base:
+            try:
+                self._gravar(tabela, self.caminho_base)
+            except OSError:
+                # No Windows a base ainda mapeada não pode ser substituída; tenta no próximo delta
+                return False
+            for arquivo in self._arquivos_delta():
+                if self._sequencia_delta(arquivo) <= sequencia:
+                    os.remove(arquivo)
+        with cache._trava:
+            self._deltas = self._sequencia - sequencia
+        return True
+
+    def _compactar(self, cache):
+        try:
+            with cache._trava:
+                tabela = self._tabela(cache, self._versao)
+                sequencia = self._sequencia
+            self._trocar_base(cache, tabela, sequencia)
+        finally:
+            self._compactando = False
+
+    def gravar_delta(self, cache, posicoes, versao):
+        """Callback de CacheColunar.ao_alterar: grava só as linhas alteradas, com a versão lida antes delas.
+
+        Roda depois do commit, com a trava do cache, na thread da requisição que gravou.
+        """
+        self._sequencia += 1
+        caminho = os.path.join(self.diretorio, f'{PREFIXO_DELTA}{self._sequencia:08d}.arrow')
+        self._gravar(self._tabela(cache, versao, posicoes), caminho)
+        self._versao = versao
+        self._deltas += 1
+        if self._deltas >= LIMITE_DELTAS and not self._compactando:
+            self._compactando = True
+            threading.Thread(target=self._compactar, args=(cache,), daemon=True).start()
+
+    # ----------------------
+    # Leitura
+    # ----------------------
+    def _ler(self, caminho):
+        """Abre um arquivo Arrow via memory map; os vetores apontam direto para o arquivo."""
+        tabela = pa.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+        colunas = {}
+        for nome, tipo in COLUNAS.items():
+            coluna = tabela.column(nome).combine_chunks()
+            vetor = coluna.to_numpy(zero_copy_only=True) if len(coluna) else np.empty(0, dtype=TIPOS_ARROW[nome])
+            colunas[nome] = vetor.view(np.bool_) if tipo is np.bool_ else vetor
+        return colunas, tabela.schema.metadata
+
+    def abrir(self, cache):
+        """Carrega o cache a partir do snapshot. Retorna False se não existir ou estiver desatualizado."""
+        if not os.path.exists(self.caminho_base):
+            return False
+        try:
+            colunas, metadados = self._ler(self.caminho_base)
+            deltas = self._arquivos_delta()
+            partes = [colunas]
+            for arquivo in deltas:
+                colunas_delta, metadados = self._ler(arquivo)
+                partes.append(colunas_delta)
+        except (OSError, pa.ArrowException, KeyError):
+            return False
+        if int(metadados[b'versao']) != versao_banco():
+            return False
+
+        if len(partes) > 1:
+            # Upsert por id: vale a última ocorrência (deltas mais novos por último)
+            colunas = {nome: np.concatenate([parte[nome] for parte in partes]) for nome in COLUNAS}
+            ids = colunas['id']
+            _, primeira_invertida = np.unique(ids[::-1], return_index=True)
+            ultimas = len(ids) - 1 - primeira_invertida
+            colunas = {nome: vetor[ultimas] for nome, vetor in colunas.items()}
+        cache.carregar_colunas(
+            colunas, json.loads(metadados[b'setores']), json.loads(metadados[b'combustiveis'])
+        )
+        if deltas:
+            self._sequencia = self._sequencia_delta(deltas[-1])
+            self._deltas = len(deltas)
+        return True
+
+
+def iniciar(cache, diretorio):
+    """Abre o cache pelo snapshot ou, se estiver desatualizado, monta via SQL e grava uma base nova.
+
+    A partir daí cada alteração do cache gera um delta em disco.
+    """
+    versao_inicial = versao_banco()
+    snapshot = SnapshotColunar(diretorio)
+    if not snapshot.abrir(cache):
+        cache.construir()
+        snapshot.salvar(cache, versao_inicial)
+    cache.ler_versao = versao_banco
+    cache.ao_alterar = snapshot.gravar_delta
+    versao = versao_banco()
+    if versao != versao_inicial:
+        # Houve gravações enquanto o cache era carregado em segundo plano
+        cache.construir()
+        snapshot.salvar(cache, versao)
+    return snapshot
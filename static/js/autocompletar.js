@@ -0,0 +1,154 @@
+// Autocompletar de veículos e motoristas.
+//
+// Cada campo é um input de texto com data-autocompletar="<url JSON>" seguido de um input
+// hidden (o valor enviado no formulário) e de um .dropdown-menu para as opções. Ao escolher
+// uma opção o hidden recebe o id, os demais campos do item (placa, combustivel, nome...) vão
+// para o dataset do hidden e um evento "change" é disparado nele. Editar o texto limpa a
+// escolha. data-setor-campo aponta o select de setor que restringe a busca (admin).
+(function () {
+  const ESPERA_MS = 200;
+
+  function iniciar(entrada) {
+    const oculto = document.getElementById(entrada.dataset.alvo);
+    const menu = entrada.parentElement.querySelector(".autocompletar-opcoes");
+    const obrigatorio = entrada.hasAttribute("required");
+    let itens = [];
+    let ativo = -1;
+    let temporizador = null;
+    let controlador = null;
+
+    function fechar() {
+      menu.classList.remove("show");
+      ativo = -1;
+    }
+
+    function validar() {
+      const invalido = entrada.value.trim() !== "" && !oculto.value;
+      entrada.setCustomValidity(invalido || (obrigatorio && !oculto.value) ? "Selecione uma opção da lista." : "");
+    }
+
+    function escolher(item) {
+      oculto.value = item ? item.id : "";
+      Object.keys(oculto.dataset).forEach(chave => delete oculto.dataset[chave]);
+      if (item) {
+        Object.entries(item).forEach(([chave, valor]) => {
+          if (chave !== "id" && chave !== "texto" && chave !== "detalhe") oculto.dataset[chave] = valor ?? "";
+        });
+        entrada.value = item.texto;
+      }
+      validar();
+      oculto.dispatchEvent(new Event("change", { bubbles: true }));
+      fechar();
+    }
+
+    function destacar(indice) {
+      const opcoes = menu.querySelectorAll(".dropdown-item");
+      opcoes.forEach((opcao, i) => opcao.classList.toggle("active", i === indice));
+      ativo = indice;
+      if (opcoes[indice]) opcoes[indice].scrollIntoView({ block: "nearest" });
+    }
+
+    function mostrar(lista) {
+      itens = lista;
+      menu.replaceChildren();
+      if (!lista.length) {
+        const vazio = document.createElement("span");
+        vazio.className = "dropdown-item-text text-muted small";
+        vazio.textContent = "Nenhum resultado";
+        menu.appendChild(vazio);
+      }
+      lista.forEach((item, indice) => {
+        const opcao = document.createElement("button");
+        opcao.type = "button";
+        opcao.className = "dropdown-item";
+        opcao.textContent = item.texto;
+        if (item.detalhe) {
+          const detalhe = document.createElement("small");
+          detalhe.className = "text-muted ms-2";
+          detalhe.textContent = item.detalhe;
+          opcao.appendChild(detalhe);
+        }
+        // mousedown antes do blur do input
+        opcao.addEventListener("mousedown", evento => {
+          evento.preventDefault();
+          escolher(item);
+        });
+        opcao.addEventListener("mouseenter", () => destacar(indice));
+        menu.appendChild(opcao);
+      });
+      menu.classList.add("show");
+      ativo = -1;
+    }
+
+    function consultar() {
+      const texto = entrada.value.trim();
+      if (!texto) {
+        fechar();
+        return;
+      }
+      const parametros = new URLSearchParams({ q: texto });
+      const campoSetor = entrada.dataset.setorCampo ? document.querySelector(entrada.dataset.setorCampo) : null;
+      if (campoSetor && campoSetor.value) parametros.set("setor", campoSetor.value);
+      if (controlador) controlador.abort();
+      controlador = new AbortController();
+      fetch(entrada.dataset.autocompletar + "?" + parametros, {
+        signal: controlador.signal,
+        headers: { "Accept": "application/json" }
+      })
+        .then(resposta => resposta.ok ? resposta.json() : { itens: [] })
+        .then(dados => {
+          if (entrada.value.trim() === texto && document.activeElement === entrada) mostrar(dados.itens || []);
+        })
+        .catch(erro => {
+          if (erro.name !== "AbortError") fechar();
+        });
+    }
+
+    entrada.addEventListener("input", () => {
+      if (oculto.value) escolher(null);
+      validar();
+      clearTimeout(temporizador);
+      temporizador = setTimeout(consultar, ESPERA_MS);
+    });
+
+    entrada.addEventListener("keydown", evento => {
+      if (!menu.classList.contains("show")) {
+        if (evento.key === "ArrowDown") consultar();
+        return;
+      }
+      if (evento.key === "ArrowDown") {
+        evento.preventDefault();
+        destacar(Math.min(ativo + 1, itens.length - 1));
+      } else if (evento.key === "ArrowUp") {
+        evento.preventDefault();
+        destacar(Math.max(ativo - 1, 0));
+      } else if (evento.key === "Enter") {
+        if (ativo >= 0 || itens.length === 1) {
+          evento.preventDefault();
+          escolher(itens[Math.max(ativo, 0)]);
+        }
+      } else if (evento.key === "Escape") {
+        fechar();
+      }
+    });
+
+    entrada.addEventListener("blur", fechar);
+
+    if (entrada.dataset.setorCampo) {
+      const campoSetor = document.querySelector(entrada.dataset.setorCampo);
+      // Trocar o setor invalida a escolha feita em outro setor
+      if (campoSetor) campoSetor.addEventListener("change", () => {
+        if (oculto.value && campoSetor.value && oculto.dataset.setor && oculto.dataset.setor !== campoSetor.value) {
+          entrada.value = "";
+          escolher(null);
+        }
+      });
+    }
+
+    validar();
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    document.querySelectorAll("input[data-autocompletar]").forEach(iniciar);
+  });
+})();
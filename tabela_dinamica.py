@@ -0,0 +1,201 @@
+import io
+
+import numpy as np
+from sqlalchemy import cast, func, Integer
+
+from database import db, Veiculo, Motorista, Abastecimento
+import cache_colunar
+
+# ----------------------
+# Tabela dinâmica: dimensão (linhas) x período (colunas)
+# ----------------------
+# Litros e valor somados num único GROUP BY por (chave da dimensão, início do período), ou
+# com np.bincount sobre o cache colunar quando ele está ativo, e remontados como matriz
+# linhas x colunas com NumPy. Cada período é identificado pelo seu primeiro dia, calculado
+# igual no SQLite e no NumPy, e as colunas cobrem o intervalo inteiro (meses sem
+# abastecimento aparecem zerados). Setor e combustível são os do veículo, como nos filtros
+# das outras telas.
+
+DIMENSOES = {
+    'veiculo': 'Veículo',
+    'motorista': 'Motorista',
+    'setor': 'Setor',
+    'combustivel': 'Combustível',
+}
+
+PERIODOS = {
+    'mes': 'Mês',
+    'trimestre': 'Trimestre',
+    'semana': 'Semana',
+    'ano': 'Ano',
+}
+
+MEDIDAS = {
+    'litros': 'Litros',
+    'valor': 'Valor (R$)',
+}
+
+SEM_VALOR = '(não informado)'
+
+
+def _inicio_periodo_sql(periodo):
+    """Primeiro dia do período de Abastecimento.data, como texto AAAA-MM-DD."""
+    data = Abastecimento.data
+    if periodo == 'ano':
+        return func.date(data, 'start of year')
+    if periodo == 'trimestre':
+        meses = (cast(func.strftime('%m', data), Integer) - 1) % 3
+        return func.date(data, 'start of month', func.printf('-%d months', meses))
+    if periodo == 'semana':
+        # Segunda-feira da semana: recua 6 dias e avança até a próxima segunda
+        return func.date(data, '-6 days', 'weekday 1')
+    return func.date(data, 'start of month')
+
+
+def inicio_periodo(dias, periodo):
+    """Mesmo cálculo de _inicio_periodo_sql sobre um vetor datetime64[D]."""
+    if periodo == 'ano':
+        return dias.astype('datetime64[Y]').astype('datetime64[D]')
+    if periodo == 'trimestre':
+        meses = dias.astype('datetime64[M]').astype(np.int64)
+        return (meses - meses % 3).astype('datetime64[M]').astype('datetime64[D]')
+    if periodo == 'semana':
+        numeros = dias.astype(np.int64)
+        # 1970-01-01 foi quinta-feira: (número + 3) % 7 é 0 nas segundas
+        return (numeros - (numeros + 3) % 7).astype('datetime64[D]')
+    return dias.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def rotulo_periodo(inicio, periodo):
+    if periodo == 'ano':
+        return inicio.strftime('%Y')
+    if periodo == 'trimestre':
+        return f"{(inicio.month - 1) // 3 + 1}º tri/{inicio.year}"
+    if periodo == 'semana':
+        return f"Sem. {inicio.strftime('%d/%m/%Y')}"
+    return inicio.strftime('%m/%Y')
+
+
+def _grupos_sql(dimensao, periodo, data_inicio, data_fim, setor):
+    """(chaves, inícios dos períodos, litros, valor) de um GROUP BY no banco."""
+    chave = {
+        'veiculo': Abastecimento.veiculo_id,
+        'motorista': Abastecimento.motorista_id,
+        'setor': Veiculo.tipo,
+        'combustivel': Veiculo.combustivel,
+    }[dimensao]
+    inicio = _inicio_periodo_sql(periodo)
+    consulta = db.session.query(
+        chave, inicio, func.sum(Abastecimento.litros), func.sum(Abastecimento.valor_total)
+    ).filter(Abastecimento.data >= data_inicio, Abastecimento.data <= data_fim)
+    if dimensao in ('setor', 'combustivel') or setor:
+        consulta = consulta.join(Veiculo, Abastecimento.veiculo_id == Veiculo.id)
+    if setor:
+        consulta = consulta.filter(Veiculo.tipo == setor)
+    linhas = consulta.group_by(chave, inicio).all()
+    chaves = [linha[0] for linha in linhas]
+    inicios = np.array([linha[1] for linha in linhas], dtype='datetime64[D]')
+    litros = np.array([linha[2] or 0 for linha in linhas], dtype=np.float64)
+    valor = np.array([linha[3] or 0 for linha in linhas], dtype=np.float64)
+    return chaves, inicios, litros, valor
+
+
+def _grupos_colunares(dimensao, periodo, data_inicio, data_fim, setor):
+    """O mesmo que _grupos_sql, a partir do cache colunar (uma linha por abastecimento)."""
+    cache = cache_colunar.cache
+    colunas = cache.colunas()
+    mascara = cache.mascara(colunas, data_inicio=data_inicio, data_fim=data_fim, setor=setor)
+    inicios = inicio_periodo(colunas['dia'][mascara].astype('datetime64[D]'), periodo)
+    # Agrega por (código, período) antes de qualquer laço em Python: os dois numa chave
+    # int64 (código + 1, pois SEM_CODIGO é -1, nos bits altos; dias desde 1970 nos baixos)
+    chave = ((colunas[dimensao][mascara].astype(np.int64) + 1) << 32) | inicios.astype(np.int64)
+    pares, grupo = np.unique(chave, return_inverse=True)
+    litros = np.bincount(grupo, weights=colunas['litros'][mascara], minlength=len(pares))
+    valor = np.bincount(grupo, weights=colunas['valor'][mascara], minlength=len(pares))
+    codigos = ((pares >> 32) - 1).tolist()
+    if dimensao in ('setor', 'combustivel'):
+        nomes = cache.setores if dimensao == 'setor' else cache.combustiveis
+        chaves = [None if codigo == cache_colunar.SEM_CODIGO else nomes[codigo] for codigo in codigos]
+    else:
+        chaves = codigos
+    return chaves, (pares & 0xFFFFFFFF).astype('datetime64[D]'), litros, valor
+
+
+def _rotulos(dimensao, chaves):
+    # Cadastros pequenos: lidos inteiros em vez de um IN com milhares de ids
+    if dimensao == 'veiculo':
+        nomes = dict(db.session.query(Veiculo.id, Veiculo.placa).all())
+    elif dimensao == 'motorista':
+        nomes = dict(db.session.query(Motorista.id, Motorista.nome_completo).all())
+    else:
+        nomes = {}
+    return [str(nomes.get(chave, chave) or SEM_VALOR) for chave in chaves]
+
+
+def calcular(dimensao='veiculo', periodo='mes', data_inicio=None, data_fim=None, setor=None, colunar=False):
+    """Matrizes de litros e valor (linhas x períodos), rótulos e totais."""
+    grupos = _grupos_colunares if colunar else _grupos_sql
+    chaves, inicios, litros, valor = grupos(dimensao, periodo, data_inicio, data_fim, setor)
+
+    # Colunas: todos os períodos do intervalo, mesmo sem abastecimento
+    dias = np.arange(np.datetime64(data_inicio.date(), 'D'), np.datetime64(data_fim.date(), 'D') + 1)
+    colunas = np.unique(inicio_periodo(dias, periodo))
+    coluna = np.searchsorted(colunas, inicios)
+
+    # Linhas: chaves distintas (None vira o rótulo SEM_VALOR), em ordem do rótulo
+    distintas = sorted(set(chaves), key=lambda chave: (chave is None, str(chave)))
+    rotulos = _rotulos(dimensao, [chave for chave in distintas if chave is not None]) + ([SEM_VALOR] if None in distintas else [])
+    ordem = sorted(range(len(distintas)), key=lambda indice: rotulos[indice].casefold())
+    posicao = {distintas[indice]: nova for nova, indice in enumerate(ordem)}
+    linha = np.fromiter((posicao[chave] for chave in chaves), dtype=np.int64, count=len(chaves))
+
+    n_linhas, n_colunas = len(distintas), len(colunas)
+    celula = linha * n_colunas + coluna
+    matrizes = {
+        medida: np.bincount(celula, weights=pesos, minlength=n_linhas * n_colunas).reshape(n_linhas, n_colunas)
+        for medida, pesos in (('litros', litros), ('valor', valor))
+    }
+    return {
+        'linhas': [rotulos[indice] for indice in ordem],
+        'colunas': [rotulo_periodo(inicio.item(), periodo) for inicio in colunas],
+        'matrizes': matrizes,
+        'total_linhas': {medida: matriz.sum(axis=1) for medida, matriz in matrizes.items()},
+        'total_colunas': {medida: matriz.sum(axis=0) for medida, matriz in matrizes.items()},
+        'total': {medida: float(matriz.sum()) for medida, matriz in matrizes.items()},
+    }
+
+
+def para_xlsx(tabela, titulo, informacoes, rotulo_linhas=""):
+    """Planilha com uma aba por medida (litros e valor), linhas e colunas de total."""
+    from openpyxl import Workbook  # só necessário na exportação
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    livro = Workbook(write_only=True)
+    for medida, nome in MEDIDAS.items():
+        aba = livro.create_sheet(nome.split(' ')[0])
+        aba.freeze_panes = 'B5'
+        negrito = WriteOnlyCell(aba, value=titulo)
+        negrito.font = Font(bold=True)
+        aba.append([negrito])
+        aba.append([" | ".join(informacoes)])
+        aba.append([])
+        cabecalho = []
+        for valor in [rotulo_linhas] + tabela['colunas'] + ["Total"]:
+            celula = WriteOnlyCell(aba, value=valor)
+            celula.font = Font(bold=True)
+            cabecalho.append(celula)
+        aba.append(cabecalho)
+        # Corpo com valores simples (sem estilo por célula, que triplica o tempo de gravação)
+        matriz = tabela['matrizes'][medida].round(2)
+        for rotulo, valores, total in zip(tabela['linhas'], matriz.tolist(), tabela['total_linhas'][medida].round(2).tolist()):
+            aba.append([rotulo] + valores + [total])
+        totais = []
+        for valor in ["Total"] + tabela['total_colunas'][medida].round(2).tolist() + [round(tabela['total'][medida], 2)]:
+            celula = WriteOnlyCell(aba, value=valor)
+            celula.font = Font(bold=True)
+            totais.append(celula)
+        aba.append(totais)
+    saida = io.BytesIO()
+    livro.save(saida)
+    return saida.getvalue()
@@ -0,0 +1,150 @@
+"""API de lotes de abastecimentos (/api/abastecimentos/lote): validação por item, gravação
+tudo ou nada, reenvio com Idempotency-Key e restrição de setor.
+
+O app é importado com a pasta de trabalho num diretório temporário, onde cria o próprio
+banco (instance/database.db), preenchido com um cadastro mínimo.
+"""
+import importlib
+import os
+import sys
+from datetime import date
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SENHA = 'senha-teste'
+ADMIN = ('admin@teste', SENHA)
+SAUDE = ('saude@teste', SENHA)
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    pasta = tmp_path_factory.mktemp('api_lote')
+    anterior = os.getcwd()
+    os.chdir(pasta)
+    try:
+        modulo = importlib.import_module('app')
+    finally:
+        os.chdir(anterior)
+    # Nunca gravar no banco da pasta do projeto
+    assert modulo.DB_PATH.startswith(str(pasta)), "app já importado com outro banco"
+
+    from database import db, User, Veiculo, Motorista, ContratoCombustivel
+    with modulo.app.app_context():
+        db.session.add_all([
+            User(nome='Admin', email=ADMIN[0], senha_hash=generate_password_hash(SENHA), tipo='admin'),
+            User(nome='Saúde', email=SAUDE[0], senha_hash=generate_password_hash(SENHA), tipo='departamento', setor='SAUDE'),
+            Veiculo(placa='ABC-1234', tipo='SAUDE', combustivel='Gasolina', capacidade_tanque=50),
+            Veiculo(placa='DEF5G67', tipo='EDUCACAO', combustivel='Diesel', capacidade_tanque=80),
+            Motorista(nome_completo='Motorista Teste', documento='123.456.789-01', setor='SAUDE'),
+            ContratoCombustivel(numero_contrato='10', ano_contrato=2025, data_inicio_contrato=date(2025, 1, 1),
+                                data_fim_contrato=date(2025, 12, 31), fornecedor='Posto Teste'),
+        ])
+        db.session.commit()
+    return modulo.app
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+def item(numero_nota, **campos):
+    return {
+        'data': '2025-03-10 08:15', 'placa': 'abc1234', 'documento': '12345678901', 'hodometro': 45120,
+        'litros': 40.5, 'valor_total': 247.05, 'numero_nota': numero_nota, 'contrato': '10/2025', **campos,
+    }
+
+
+def total_abastecimentos(app):
+    from database import Abastecimento
+    with app.app_context():
+        return Abastecimento.query.count()
+
+
+def test_exige_autenticacao(cliente):
+    resposta = cliente.post('/api/abastecimentos/lote', json=[item('1')])
+    assert resposta.status_code == 401
+    assert resposta.headers['WWW-Authenticate'].startswith('Basic')
+
+
+def test_grava_lote_e_devolve_ids_por_item(app, cliente):
+    antes = total_abastecimentos(app)
+    resposta = cliente.post('/api/abastecimentos/lote', auth=ADMIN,
+                            json={'abastecimentos': [item('100'), item('101', hodometro='45300')]})
+    assert resposta.status_code == 201, resposta.get_json()
+    dados = resposta.get_json()
+    assert dados['importados'] == 2
+    assert [linha['indice'] for linha in dados['itens']] == [0, 1]
+    assert total_abastecimentos(app) == antes + 2
+
+    from database import db, Abastecimento
+    with app.app_context():
+        gravado = db.session.get(Abastecimento, dados['itens'][1]['id'])
+        assert (gravado.numero_nota, gravado.hodometro) == ('101', 45300)
+
+
+def test_erros_por_item_sem_gravar_nada(app, cliente):
+    antes = total_abastecimentos(app)
+    lote = [
+        item('200'),
+        item('201', placa='ZZZ9999'),
+        item('202', hodometro=float('inf')),
+        item('203', litros=float('nan')),
+        item('204', hodometro=1e30),
+        'não é um objeto',
+        item('200'),
+    ]
+    resposta = cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=lote)
+    assert resposta.status_code == 422
+    dados = resposta.get_json()
+    assert dados['importados'] == 0
+    assert [erro['indice'] for erro in dados['erros']] == [1, 2, 3, 4, 5, 6]
+    assert 'veículo não cadastrado' in dados['erros'][0]['erro']
+    assert 'já lançada' in dados['erros'][5]['erro']
+    # O item válido (índice 0) também não foi gravado
+    assert total_abastecimentos(app) == antes
+
+
+def test_nota_ja_gravada_recusa_o_lote_inteiro(app, cliente):
+    assert cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=[item('300')]).status_code == 201
+    antes = total_abastecimentos(app)
+    resposta = cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=[item('301'), item('000300')])
+    assert resposta.status_code == 422
+    assert resposta.get_json()['erros'] == [{'indice': 1, 'erro': 'nota 000300 já lançada neste contrato'}]
+    assert total_abastecimentos(app) == antes
+
+
+def test_reenvio_com_chave_de_idempotencia(app, cliente):
+    cabecalhos = {'Idempotency-Key': 'terminal-7-lote-1'}
+    lote = [item('400'), item('401')]
+    primeira = cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=lote, headers=cabecalhos)
+    assert primeira.status_code == 201
+    depois_da_primeira = total_abastecimentos(app)
+
+    reenvio = cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=lote, headers=cabecalhos)
+    assert reenvio.status_code == 201
+    assert reenvio.headers.get('Idempotent-Replayed') == 'true'
+    assert reenvio.get_json() == primeira.get_json()
+    assert total_abastecimentos(app) == depois_da_primeira
+
+    outro_conteudo = cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=[item('402')], headers=cabecalhos)
+    assert outro_conteudo.status_code == 409
+    assert total_abastecimentos(app) == depois_da_primeira
+
+
+def test_usuario_de_setor_so_grava_veiculos_do_setor(app, cliente):
+    antes = total_abastecimentos(app)
+    resposta = cliente.post('/api/abastecimentos/lote', auth=SAUDE,
+                            json=[item('500'), item('501', placa='DEF-5G67')])
+    assert resposta.status_code == 422
+    assert resposta.get_json()['erros'] == [
+        {'indice': 1, 'erro': 'veículo DEF-5G67 não pertence ao setor SAUDE'}
+    ]
+    assert total_abastecimentos(app) == antes
+
+    assert cliente.post('/api/abastecimentos/lote', auth=SAUDE, json=[item('500')]).status_code == 201
+    assert cliente.post('/api/abastecimentos/lote', auth=ADMIN, json=[item('501', placa='DEF-5G67')]).status_code == 201
+    assert total_abastecimentos(app) == antes + 2
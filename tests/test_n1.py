@@ -0,0 +1,31 @@
+"""Todas as rotas GET sem erro 5xx e sem consultas N+1 (mesma verificação de benchmarks/verificar_n1.py).
+
+Gera o banco sintético na primeira execução (guardado em DADOS_BENCHMARK, ou na pasta
+temporária) e visita as rotas num processo filho com DETECTOR_N1=estrito.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import verificar_n1  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def resultado():
+    return verificar_n1.verificar(dados=os.environ.get('DADOS_BENCHMARK', verificar_n1.PASTA_DADOS))
+
+
+def test_rotas_sem_erro_do_servidor(resultado):
+    assert resultado['rotas'], "nenhuma rota visitada"
+    erros = [f"{rota['status']} {rota['url']}" for rota in resultado['rotas'] if rota['status'] >= 500]
+    assert not erros, "Rotas com erro do servidor:\n" + "\n".join(erros)
+
+
+def test_rotas_sem_consultas_n1(resultado):
+    ocorrencias = [
+        f"{ocorrencia['endpoint']}: {ocorrencia['relacionamento']} a partir de {ocorrencia['origem']}"
+        for ocorrencia in resultado['ocorrencias']
+    ]
+    assert not ocorrencias, "Consultas N+1:\n" + "\n".join(ocorrencias)
@@ -0,0 +1,114 @@
+import threading
+
+from database import db
+
+# ----------------------
+# Versões dos dados compartilhadas entre processos
+# ----------------------
+# Os caches em memória (índice de autocompletar, previsões...) são atualizados pelas chamadas
+# feitas depois do commit, que só alcançam o processo que gravou. Com SERVIDOR_PROCESSOS > 1
+# (servidor.py) os outros processos precisam saber que o banco mudou: a tabela versao_dados
+# guarda um contador por grupo de tabelas, incrementado por gatilhos na mesma transação de
+# quem grava (inclusive lotes e SQL direto). Antes de responder, o cache compara o contador
+# com o da consulta anterior e, se ele andou, descarta o que tem.
+#
+# O mesmo contador serve ao snapshot do cache colunar (grupo 'colunar', snapshot_colunar.py),
+# que grava nos arquivos a versão dos dados que contêm. Há um gatilho por tabela e evento:
+# ele incrementa numa só instrução todos os grupos afetados, e a condição de um grupo (com
+# OLD/NEW) o restringe às colunas que interessam a ele.
+#
+# Com um processo só a verificação dos caches fica desligada (`ativo`): as atualizações depois do
+# commit já são exatas e o contador sobe também com as gravações do próprio processo.
+
+TABELA = 'versao_dados'
+# Autocompletar: cadastros de veículos e motoristas e vínculos motorista/setor editados.
+# Previsão de esgotamento e conciliação de preços: abastecimentos, setor/combustível dos
+# veículos e contratos. Cache colunar: abastecimentos e setor/combustível dos veículos.
+GRUPOS = ('cadastros', 'consumo', 'colunar')
+
+MUDOU_VINCULO = "OLD.veiculo_id IS NOT NEW.veiculo_id OR OLD.motorista_id IS NOT NEW.motorista_id"
+MUDOU_SETOR_COMBUSTIVEL = "OLD.tipo IS NOT NEW.tipo OR OLD.combustivel IS NOT NEW.combustivel"
+SEMPRE = None
+
+# Gatilho -> (evento, {grupo: condição})
+GATILHOS = {
+    'abastecimento_insert': ("AFTER INSERT ON abastecimento", {'consumo': SEMPRE, 'colunar': SEMPRE}),
+    'abastecimento_update': ("AFTER UPDATE ON abastecimento", {
+        'cadastros': MUDOU_VINCULO, 'consumo': SEMPRE, 'colunar': SEMPRE,
+    }),
+    'abastecimento_delete': ("AFTER DELETE ON abastecimento", {'consumo': SEMPRE, 'colunar': SEMPRE}),
+    'veiculo_insert': ("AFTER INSERT ON veiculo", {'cadastros': SEMPRE}),
+    'veiculo_update': ("AFTER UPDATE OF placa, tipo, combustivel ON veiculo", {
+        'cadastros': SEMPRE, 'consumo': MUDOU_SETOR_COMBUSTIVEL, 'colunar': MUDOU_SETOR_COMBUSTIVEL,
+    }),
+    'veiculo_delete': ("AFTER DELETE ON veiculo", {'cadastros': SEMPRE, 'consumo': SEMPRE, 'colunar': SEMPRE}),
+    'motorista_insert': ("AFTER INSERT ON motorista", {'cadastros': SEMPRE}),
+    'motorista_update': ("AFTER UPDATE OF nome_completo, documento, setor ON motorista", {'cadastros': SEMPRE}),
+    'motorista_delete': ("AFTER DELETE ON motorista", {'cadastros': SEMPRE, 'colunar': SEMPRE}),
+    'contrato_insert': ("AFTER INSERT ON contrato_combustivel", {'consumo': SEMPRE}),
+    'contrato_update': ("AFTER UPDATE ON contrato_combustivel", {'consumo': SEMPRE}),
+    'contrato_delete': ("AFTER DELETE ON contrato_combustivel", {'consumo': SEMPRE}),
+    'item_insert': ("AFTER INSERT ON contrato_combustivel_item", {'consumo': SEMPRE}),
+    'item_update': ("AFTER UPDATE ON contrato_combustivel_item", {'consumo': SEMPRE}),
+    'item_delete': ("AFTER DELETE ON contrato_combustivel_item", {'consumo': SEMPRE}),
+    'aditivo_insert': ("AFTER INSERT ON aditivo_contrato_combustivel", {'consumo': SEMPRE}),
+    'aditivo_update': ("AFTER UPDATE ON aditivo_contrato_combustivel", {'consumo': SEMPRE}),
+    'aditivo_delete': ("AFTER DELETE ON aditivo_contrato_combustivel", {'consumo': SEMPRE}),
+    'efetivo_insert': ("AFTER INSERT ON contrato_efetivo", {'consumo': SEMPRE}),
+    'efetivo_update': ("AFTER UPDATE ON contrato_efetivo", {'consumo': SEMPRE}),
+    'efetivo_delete': ("AFTER DELETE ON contrato_efetivo", {'consumo': SEMPRE}),
+}
+
+ativo = False
+
+
+def instalar():
+    """Cria (se preciso) a tabela e uma linha por grupo e refaz os gatilhos (migração)."""
+    conexao = db.session.connection()
+    conexao.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {TABELA} (grupo VARCHAR(30) PRIMARY KEY, versao INTEGER NOT NULL)"
+    )
+    for grupo in GRUPOS:
+        conexao.exec_driver_sql(f"INSERT OR IGNORE INTO {TABELA} (grupo, versao) VALUES (?, 0)", (grupo,))
+    # Refeitos do zero: versões anteriores do esquema tinham um gatilho por grupo
+    for (nome,) in conexao.exec_driver_sql(
+        f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB '{TABELA}_*'"
+    ).all():
+        conexao.exec_driver_sql(f"DROP TRIGGER {nome}")
+    for nome, (evento, grupos) in GATILHOS.items():
+        condicoes = " OR ".join(
+            f"grupo = '{grupo}'" if condicao is SEMPRE else f"(grupo = '{grupo}' AND ({condicao}))"
+            for grupo, condicao in grupos.items()
+        )
+        conexao.exec_driver_sql(
+            f"CREATE TRIGGER {TABELA}_{nome} {evento} BEGIN "
+            f"UPDATE {TABELA} SET versao = versao + 1 WHERE {condicoes}; END"
+        )
+
+
+def ler(grupo):
+    return db.session.connection().exec_driver_sql(
+        f"SELECT versao FROM {TABELA} WHERE grupo = ?", (grupo,)
+    ).scalar() or 0
+
+
+class VersaoCompartilhada:
+    """Contador de um grupo visto por um cache."""
+
+    def __init__(self, grupo):
+        self.grupo = grupo
+        self._trava = threading.Lock()
+        self._vista = None
+
+    def mudou(self):
+        """Se o contador andou desde a chamada anterior (sempre False com um processo só).
+
+        Chamada antes de ler o cache: o que for montado depois dela já vê a versão anotada.
+        """
+        if not ativo:
+            return False
+        atual = ler(self.grupo)
+        with self._trava:
+            mudou = self._vista is not None and atual != self._vista
+            self._vista = atual
+        return mudou